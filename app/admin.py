@@ -1,8 +1,11 @@
 from django.contrib import admin
 
-from app.models import CinemaHall, PurchasedTicket, MovieShow
+from app.models import CinemaHall, PurchasedTicket, MovieShow, SeatInventory, DailyRollup, SeatHold
 
 
 admin.site.register(CinemaHall)
 admin.site.register(PurchasedTicket)
 admin.site.register(MovieShow)
+admin.site.register(SeatInventory)
+admin.site.register(DailyRollup)
+admin.site.register(SeatHold)
@@ -0,0 +1,118 @@
+"""
+Async read endpoints for the ASGI deployment (cinema/asgi.py).
+
+Django 4.0 has no async ORM interface yet, so these views read the schedule
+from the versioned cache on the event loop and make at most one
+sync_to_async hop per request, for the single query a cache miss or a seat
+count needs. With the default local memory cache a cache read does no I/O.
+The schedule is staff only, as on /api/movie/: the token is checked in that
+same hop.
+
+Every middleware in settings.MIDDLEWARE is async capable outside DEBUG (the
+debug toolbar is sync only), so the views run on the event loop without the
+handler adapting the chain through a thread.
+"""
+from datetime import date, timedelta
+
+from asgiref.sync import sync_to_async
+from django.http import Http404, JsonResponse
+from rest_framework import exceptions, status
+from rest_framework.permissions import IsAdminUser
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from app.api.serializers import CinemaHallSerializer, MovieShowSerializer
+from app.cache import MISSING, schedule_cache
+from app.models import CinemaHall, MovieShow, SeatInventory
+
+
+def get_show_date(show_day):
+    return date.today() + timedelta(days=1) if show_day == 'tomorrow' else date.today()
+
+
+def load_shows(show_date):
+    shows = MovieShow.objects.with_tickets_left(show_date) \
+        .filter(start_date__lte=show_date, finish_date__gte=show_date).order_by('start_time', 'id')
+    return [dict(MovieShowSerializer(show).data, tickets_left=show.tickets_left) for show in shows]
+
+
+def load_seats_left(shows, show_date):
+    return dict(SeatInventory.objects.filter(movie_show__in=[show['id'] for show in shows], date=show_date)
+                .values_list('movie_show_id', 'seats_left'))
+
+
+def check_admin(request):
+    """
+    DRF's authentication classes and IsAdminUser, the access rule of
+    /api/movie/. Returns the error response, or None when the user may read.
+    """
+    drf_request = Request(request, authenticators=[cls() for cls in api_settings.DEFAULT_AUTHENTICATION_CLASSES])
+    try:
+        if IsAdminUser().has_permission(drf_request, None):
+            return None
+        error = exceptions.NotAuthenticated() if drf_request.successful_authenticator is None \
+            else exceptions.PermissionDenied()
+    except exceptions.AuthenticationFailed as failed:  # invalid or expired token
+        error = failed
+    response = JsonResponse(error.detail if isinstance(error.detail, dict) else {'detail': error.detail},
+                            status=error.status_code)
+    if error.status_code == status.HTTP_401_UNAUTHORIZED:
+        response['WWW-Authenticate'] = drf_request.authenticators[0].authenticate_header(drf_request)
+    return response
+
+
+def admin_only(load):
+    """`load` preceded by check_admin() in the same thread, so access costs no extra sync_to_async hop."""
+
+    def load_for_admin(request, *args):
+        denied = check_admin(request)
+        return (denied, None) if denied else (None, load(*args))
+
+    return sync_to_async(load_for_admin)
+
+
+async def movie_list(request, show_day='today'):
+    """Shows of today or tomorrow with their remaining seats; staff only, like /api/movie/."""
+    show_date = get_show_date(show_day)
+    key = schedule_cache.make_key('async', 'movies', show_date)
+    shows = schedule_cache.lookup(key)
+    if shows is MISSING:
+        denied, shows = await admin_only(load_shows)(request, show_date)
+        if denied:
+            return denied
+        schedule_cache.store(key, shows)
+        return JsonResponse(shows, safe=False)
+    denied, seats_left = await admin_only(load_seats_left)(request, shows, show_date)
+    if denied:
+        return denied
+    return JsonResponse([dict(show, tickets_left=seats_left.get(show['id'], show['tickets_left']))
+                         for show in shows], safe=False)
+
+
+def load_halls():
+    return CinemaHallSerializer(CinemaHall.objects.order_by('id'), many=True).data
+
+
+async def hall_list(request):
+    key = schedule_cache.make_key('async', 'halls')
+    halls = schedule_cache.lookup(key)
+    if halls is MISSING:
+        halls = await sync_to_async(load_halls)()
+        schedule_cache.store(key, halls)
+    return JsonResponse(halls, safe=False)
+
+
+def load_tickets_left(pk, show_date):
+    return MovieShow.objects.with_tickets_left(show_date).filter(pk=pk).values_list('tickets_left', flat=True).first()
+
+
+async def availability(request, pk):
+    """Remaining seats of a show on ?date= (today by default), in one query."""
+    try:
+        show_date = date.fromisoformat(request.GET['date']) if request.GET.get('date') else date.today()
+    except ValueError:
+        return JsonResponse({'date': 'Неверный формат даты, нужен YYYY-MM-DD'}, status=400)
+    tickets_left = await sync_to_async(load_tickets_left)(pk, show_date)
+    if tickets_left is None:
+        raise Http404
+    return JsonResponse({'movie_show': pk, 'date': show_date, 'tickets_left': tickets_left})
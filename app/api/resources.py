@@ -1,19 +1,34 @@
 import datetime
+import hashlib
+import json
 from datetime import date
 
-from django.db import transaction
 from django.db.models import Q
+from django.http import StreamingHttpResponse
+from django.shortcuts import get_object_or_404
+from django.utils import timezone
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
 from rest_framework import serializers, status
 from rest_framework.generics import CreateAPIView
 from rest_framework.permissions import AllowAny, IsAuthenticated, IsAdminUser
 from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
 from rest_framework.views import APIView
 from rest_framework.viewsets import ModelViewSet
-from rest_framework_simplejwt.tokens import RefreshToken
 
 from app.api.serializers import RegisterSerializer, CinemaHallSerializer, MovieShowSerializer, PurchaseSerializer, \
-    PurchaseSerializerCreate
-from app.models import CustomUser, CinemaHall, MovieShow, PurchasedTicket
+    PurchaseSerializerCreate, import_schedule, CheckoutSerializer, CheckoutLineSerializer, RollupFilterSerializer, \
+    DailyReportSerializer, SeatMapQuerySerializer, seats_error, SeatHoldSerializer, MovieSearchQuerySerializer, \
+    MovieSearchSerializer
+from app import booking
+from app.booking import NotEnoughSeats, checkout
+from app.cache import schedule_cache, table_versions
+from app.models import CustomUser, CinemaHall, MovieShow, PurchasedTicket, DailyRollup, SeatInventory, SeatHold
+from app.pagination import KeysetPagination
+from app.search import search_shows
+from app.seating import render_rows
+from app.tokens import RefreshToken
 
 
 class RegisterAPI(CreateAPIView):
@@ -33,6 +48,43 @@ class APILogoutView(APIView):
         return Response({"status": "OK, goodbye"})
 
 
+def make_etag(*parts):
+    return hashlib.md5(repr(parts).encode()).hexdigest()
+
+
+def get_show_day(request, show_day=None, **kwargs):
+    show_day = show_day or request.query_params.get('show_day')
+    return 'tomorrow' if show_day == 'tomorrow' else 'today'
+
+
+def table_version(request, model):
+    """The table version read once per request, shared by the ETag and Last-Modified functions."""
+    versions = request.__dict__.setdefault('table_versions', {})
+    if model not in versions:
+        versions[model] = table_versions.get(model)
+    return versions[model]
+
+
+def hall_list_etag(request, *args, **kwargs):
+    return make_etag(table_version(request, CinemaHall))
+
+
+def hall_list_last_modified(request, *args, **kwargs):
+    return table_versions.last_modified(CinemaHall, table_version(request, CinemaHall))
+
+
+def movie_list_etag(request, *args, **kwargs):
+    # the list also changes at midnight and links to images on the requested scheme and host
+    return make_etag(table_version(request, MovieShow), date.today(), get_show_day(request, **kwargs),
+                     request.scheme, request.get_host(), request.query_params.get('cursor'),
+                     request.query_params.get('page_size'))
+
+
+def movie_list_last_modified(request, *args, **kwargs):
+    midnight = timezone.make_aware(datetime.datetime.combine(date.today(), datetime.time()))
+    return max(table_versions.last_modified(MovieShow, table_version(request, MovieShow)), midnight)
+
+
 class CinemaHallViewSet(ModelViewSet):
     queryset = CinemaHall.objects.all()
     serializer_class = CinemaHallSerializer
@@ -43,14 +95,32 @@ class CinemaHallViewSet(ModelViewSet):
             self.permission_classes = [AllowAny]
         return super().get_permissions()
 
+    @method_decorator(condition(etag_func=hall_list_etag, last_modified_func=hall_list_last_modified))
+    def list(self, request, *args, **kwargs):
+        return super().list(request, *args, **kwargs)
+
 
 class MovieViewSet(ModelViewSet):
     queryset = MovieShow.objects.all()
     serializer_class = MovieShowSerializer
     permission_classes = [IsAdminUser]
+    pagination_class = KeysetPagination
+    keyset_ordering = ('start_time', 'id')
+
+    def get_show_day(self):
+        return self.kwargs.get('show_day') or self.request.query_params.get('show_day')
+
+    @method_decorator(condition(etag_func=movie_list_etag, last_modified_func=movie_list_last_modified))
+    def list(self, request, *args, **kwargs):
+        show_day = get_show_day(request, **kwargs)
+        data = schedule_cache.get_or_set(
+            ('api', request.scheme, request.get_host(), date.today(), show_day, request.query_params.get('cursor'),
+             request.query_params.get('page_size')),
+            lambda: super(MovieViewSet, self).list(request, *args, **kwargs).data)
+        return Response(data)
 
     def get_queryset(self):
-        show_day = self.request.query_params.get('show_day')
+        show_day = self.get_show_day()
         if show_day == 'tomorrow':
             return super().get_queryset().filter(start_date__lte=date.today() + datetime.timedelta(days=1),
                                                  finish_date__gt=date.today())
@@ -58,25 +128,149 @@ class MovieViewSet(ModelViewSet):
         return super().get_queryset().filter(start_date__lte=date.today(),  # show_day == 'today'
                                              finish_date__gte=date.today())
 
+    def bulk_create(self, request):
+        shows, errors = import_schedule(request.data)
+        if errors:
+            return Response(errors, status=status.HTTP_400_BAD_REQUEST)
+        return Response(MovieShowSerializer(shows, many=True).data, status=status.HTTP_201_CREATED)
+
 
 class PurchaseList(APIView):
     permission_classes = [IsAuthenticated]
 
+    stream_chunk_size = 500
+
     def get(self, request):
-        purchase_list = PurchasedTicket.objects.filter(user=request.user.id)
-        serializer = PurchaseSerializer(purchase_list, many=True)
-        return Response(serializer.data)
+        purchase_list = PurchasedTicket.objects.filter(user=request.user.id).select_related('movie_show__cinema_hall')
+        if request.query_params.get('all'):
+            return StreamingHttpResponse(
+                self.stream_history(purchase_list.order_by('-date', '-id')), content_type='application/json')
+
+        paginator = KeysetPagination(ordering=('-date', '-id'))
+        serializer = PurchaseSerializer(paginator.paginate_queryset(purchase_list, request, self), many=True)
+        return paginator.get_paginated_response(serializer.data)
+
+    def stream_history(self, purchase_list):
+        """The whole history as one JSON array, serialized chunk by chunk from a single query."""
+        yield '['
+        separator = ''
+        chunk = []
+        for ticket in purchase_list.iterator(chunk_size=self.stream_chunk_size):
+            chunk.append(ticket)
+            if len(chunk) == self.stream_chunk_size:
+                yield separator + json.dumps(PurchaseSerializer(chunk, many=True).data, cls=JSONEncoder)[1:-1]
+                separator, chunk = ',', []
+        if chunk:
+            yield separator + json.dumps(PurchaseSerializer(chunk, many=True).data, cls=JSONEncoder)[1:-1]
+        yield ']'
 
     def post(self, request):
         serializer = PurchaseSerializerCreate(data=request.data, user_id=request.user.id)
         if serializer.is_valid():
-            user = CustomUser.objects.get(id=request.user.id)
-
-            with transaction.atomic():
-                obj = serializer.save()
-                user.money_spent += obj.get_purchase_amount()
-                user.save()
+            serializer.save()
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
 
+class CheckoutView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = CheckoutSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            tickets = checkout(request.user.id, serializer.validated_data['lines'])
+        except NotEnoughSeats as error:
+            return Response({'lines': {error.line: seats_error(error)}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        return Response({'tickets': CheckoutLineSerializer(tickets, many=True).data,
+                         'total': sum(ticket.get_purchase_amount() for ticket in tickets)},
+                        status=status.HTTP_201_CREATED)
+
+
+class SeatHoldView(APIView):
+    """Hold seats while the customer pays; confirm the hold or let it expire."""
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        serializer = SeatHoldSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            seat_hold = booking.hold(request.user.id, serializer.validated_data)
+        except NotEnoughSeats as error:
+            return Response(seats_error(error), status=status.HTTP_400_BAD_REQUEST)
+        return Response(SeatHoldSerializer(seat_hold).data, status=status.HTTP_201_CREATED)
+
+
+class SeatHoldDetailView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def delete(self, request, pk):
+        seat_hold = get_object_or_404(SeatHold.objects.select_related('movie_show__cinema_hall'),
+                                      pk=pk, user=request.user.id)
+        booking.release(seat_hold)
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+
+class SeatHoldConfirmView(APIView):
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request, pk):
+        try:
+            ticket = booking.confirm(request.user.id, pk)
+        except booking.HoldExpired as error:
+            return Response({'hold': error.message}, status=status.HTTP_400_BAD_REQUEST)
+        return Response(CheckoutLineSerializer(ticket).data, status=status.HTTP_201_CREATED)
+
+
+class ScheduleCacheStatsView(APIView):
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        return Response(schedule_cache.stats())
+
+
+class DailyReportView(APIView):
+    """Revenue and occupancy per day and hall, from the rollups and the scheduled sessions."""
+    permission_classes = [IsAdminUser]
+
+    def get(self, request):
+        filters = RollupFilterSerializer(data=request.query_params)
+        filters.is_valid(raise_exception=True)
+        rows = DailyRollup.objects.report(('date', 'cinema_hall_id', 'cinema_hall__hall_name'),
+                                          **filters.validated_data)
+        return Response(DailyReportSerializer(rows, many=True).data)
+
+
+class SeatMapView(APIView):
+    """Seats of a show on a date, one string per row: '.' free, 'X' taken."""
+    permission_classes = [IsAuthenticated]
+
+    def get(self, request, pk):
+        query = SeatMapQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        movie_show = get_object_or_404(MovieShow.objects.select_related('cinema_hall'), pk=pk)
+        hall = movie_show.cinema_hall
+        seats_left, seat_map = SeatInventory.objects.filter(movie_show=movie_show, date=query.validated_data['date']) \
+            .values_list('seats_left', 'seat_map').first() or (hall.number_of_seats, b'')
+        return Response({
+            'movie_show': movie_show.pk,
+            'date': query.validated_data['date'],
+            'rows': hall.get_rows(),
+            'seats_per_row': hall.get_seats_per_row(),
+            'seats_left': seats_left,
+            'seats': render_rows(bytes(seat_map), hall.number_of_seats, hall.get_seats_per_row()),
+        })
+
+
+class MovieSearchView(APIView):
+    """Upcoming shows by title prefix or a similar title, for the search box typeahead."""
+    permission_classes = [AllowAny]
+
+    def get(self, request):
+        query = MovieSearchQuerySerializer(data=request.query_params)
+        query.is_valid(raise_exception=True)
+        shows = search_shows(query.validated_data['q'], query.validated_data['limit'])
+        return Response(MovieSearchSerializer(shows, many=True).data)
@@ -1,11 +1,14 @@
+from collections import defaultdict
 from datetime import date, datetime
 
 from django.contrib.auth.hashers import make_password
-from django.db.models import Q
 from rest_framework import serializers
 from rest_framework.exceptions import ValidationError
 
-from app.models import CustomUser, CinemaHall, MovieShow, PurchasedTicket
+from app.booking import NotEnoughSeats, checkout
+from app.images import variant_urls
+from app.models import CustomUser, CinemaHall, MovieShow, PurchasedTicket, SeatHold, SeatInventory
+from app.schedule import OVERLAP_MESSAGE, ScheduleConflict, find_conflict, import_shows
 
 
 class RegisterSerializer(serializers.ModelSerializer):
@@ -37,7 +40,7 @@ class CinemaHallSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = CinemaHall
-        fields = ['id', 'hall_name', 'number_of_seats']
+        fields = ['id', 'hall_name', 'number_of_seats', 'seats_per_row']
 
     def validate(self, data):
         if self.instance:
@@ -48,81 +51,155 @@ class CinemaHallSerializer(serializers.ModelSerializer):
         return data
 
 
+def validate_show_dates(attrs):
+    start_time = attrs.get('start_time')
+    finish_time = attrs.get('finish_time')
+    start_date = attrs.get('start_date')
+    finish_date = attrs.get('finish_date')
+
+    if start_date > finish_date:  # старт дата больше конца даты
+        raise ValidationError({
+            'start_date, finish_date': 'Дата конца сеанса не может быть раньше чем дата начала сеанса!'})
+
+    if start_date == finish_date and start_time >= finish_time:  # дата старта равна дате конца, время начала больше время конца
+        raise ValidationError({
+            'start_date, finish_date':'Время начала сеанса не может быть позже чем время конца сеанса!'})
+
+    if start_date < date.today():  # дата старта меньше сегодня
+        raise ValidationError({
+            'start_date, finish_date': 'Нельзя создать сеанс в прошлом!'})
+
+    if start_date == date.today() and start_time < datetime.now().time():  # дата начала сегодня, время начала меньше чем сейчас
+        raise ValidationError({
+            'start_date, finish_date': 'Нельзя создать сеанс в прошлом!'})
+
+
 class MovieShowSerializer(serializers.ModelSerializer):
+    image_variants = serializers.SerializerMethodField()
 
     class Meta:
         model = MovieShow
         fields = '__all__'
 
+    def get_image_variants(self, obj):
+        return variant_urls(obj, self.context.get('request'))
+
     def validate(self, attrs):
         start_time = attrs.get('start_time')
         finish_time = attrs.get('finish_time')
         start_date = attrs.get('start_date')
         finish_date = attrs.get('finish_date')
-
-        if start_date > finish_date:  # старт дата больше конца даты
-            raise ValidationError({
-                'start_date, finish_date': 'Дата конца сеанса не может быть раньше чем дата начала сеанса!'})
-
-        if start_date == finish_date and start_time >= finish_time:  # дата старта равна дате конца, время начала больше время конца
-            raise ValidationError({
-                'start_date, finish_date':'Время начала сеанса не может быть позже чем время конца сеанса!'})
-
-        if start_date < date.today():  # дата старта меньше сегодня
-            raise ValidationError({
-                'start_date, finish_date': 'Нельзя создать сеанс в прошлом!'})
-
-        if start_date == date.today() and start_time < datetime.now().time():  # дата начала сегодня, время начала меньше чем сейчас
-            raise ValidationError({
-                'start_date, finish_date': 'Нельзя создать сеанс в прошлом!'})
+        validate_show_dates(attrs)
 
         if self.instance:
             movie = self.instance
             if movie.get_purchased():
                 raise serializers.ValidationError('На этот сеанс уже куплены билеты, поэтому нельзя изменить!')
 
-        cinema_hall_obj = CinemaHall.objects.get(id=attrs.get('cinema_hall').id)
+        exclude_id = self.instance.pk if self.instance else None
+        if find_conflict(attrs.get('cinema_hall').id, start_date, finish_date, start_time, finish_time,
+                         exclude_id=exclude_id) is not None:
+            raise serializers.ValidationError({'start_date, finish_date': OVERLAP_MESSAGE})
+        return attrs
 
-        enter_start_date = Q(start_date__range=(start_date, finish_date))
-        enter_finish_date = Q(finish_date__range=(start_date, finish_date))
-        middle_date_start = Q(start_date__lte=start_date, finish_date__gte=finish_date)
-        enter_start_time = Q(start_time__range=(start_time, finish_time))
-        enter_finish_time = Q(finish_time__range=(start_time, finish_time))
+    def create(self, validated_data):
+        try:
+            return super().create(validated_data)
+        except ScheduleConflict:
+            raise serializers.ValidationError({'start_date, finish_date': OVERLAP_MESSAGE})
 
-        movie_obj = MovieShow.objects.filter(cinema_hall=cinema_hall_obj.pk).filter(
-            enter_start_date | enter_finish_date | middle_date_start).filter(enter_start_time | enter_finish_time)
+    def update(self, instance, validated_data):
+        try:
+            return super().update(instance, validated_data)
+        except ScheduleConflict:
+            raise serializers.ValidationError({'start_date, finish_date': OVERLAP_MESSAGE})
 
-        if movie_obj:
-            raise serializers.ValidationError(
-                {'start_date, finish_date': 'Сеансы в одном зале не могут накладываться друг на друга'})
 
-        if start_time > finish_time:
-            enter_start_time_until_midnight = Q(start_time__range=(start_time, '23:59:59'))
-            enter_start_time_after_midnight = Q(start_time__range=('00:00:00', finish_time))
-            enter_finish_time_until_midnight = Q(finish_time__range=(start_time, '23:59:59'))
-            enter_finish_time_after_midnight = Q(finish_time__range=('00:00:00', finish_time))
+class ScheduleRowSerializer(serializers.ModelSerializer):
+    cinema_hall = serializers.IntegerField(source='cinema_hall_id')
 
-            movie_obj = MovieShow.objects.filter(cinema_hall=cinema_hall_obj.pk).filter(
-                enter_start_date | enter_finish_date | middle_date_start). \
-                filter(enter_start_time_until_midnight | enter_start_time_after_midnight |
-                       enter_finish_time_until_midnight | enter_finish_time_after_midnight).all()
+    class Meta:
+        model = MovieShow
+        exclude = ['image', 'image_variants']
 
-        if movie_obj:
-            raise serializers.ValidationError(
-                {'start_date, finish_date': 'Сеансы в одном зале не могут накладываться друг на друга'})
+    def validate(self, attrs):
+        validate_show_dates(attrs)
         return attrs
 
 
+def import_schedule(rows):
+    """
+    Validate and import a batch of schedule rows. Returns the created shows
+    and a list of per-row errors; nothing is created if there are errors.
+    """
+    serializer = ScheduleRowSerializer(data=rows, many=True)
+    if not serializer.is_valid():
+        if not isinstance(serializer.errors, list):
+            return [], [{'row': None, 'errors': serializer.errors}]
+        return [], [{'row': number, 'errors': error} for number, error in enumerate(serializer.errors) if error]
+    shows, errors = import_shows(serializer.validated_data)
+    return shows, [{'row': number, 'errors': {'start_date, finish_date': [message]}}
+                   for number, message in sorted(errors.items())]
+
+
+class SeatSerializer(serializers.Serializer):
+    row = serializers.IntegerField(min_value=1)
+    seat = serializers.IntegerField(min_value=1)
+
+
+class PurchaseShowSerializer(serializers.ModelSerializer):
+    cinema_hall = serializers.CharField(source='cinema_hall.hall_name')
+
+    class Meta:
+        model = MovieShow
+        fields = ['id', 'movie_name', 'ticket_price', 'start_time', 'finish_time', 'cinema_hall']
+
+
 class PurchaseSerializer(serializers.ModelSerializer):
+    """Read-only; expects a queryset with select_related('movie_show__cinema_hall')."""
 
-    movie_show = MovieShowSerializer()
+    movie_show = PurchaseShowSerializer()
+    seats = SeatSerializer(many=True)
 
     class Meta:
         model = PurchasedTicket
-        fields = ['date', 'movie_show', 'number_of_ticket']
+        fields = ['id', 'date', 'movie_show', 'number_of_ticket', 'seats']
+
+
+NOT_ENOUGH_SEATS_MESSAGE = 'Такого количества свободных мест нет'
+
+
+def validate_purchase(data, check_seats_left=True):
+    movie = data['movie_show']
+    date_purchase = data['date']
+    number_of_ticket = data['number_of_ticket']
+    if number_of_ticket <= 0:
+        raise serializers.ValidationError({'number_of_ticket': 'Вы не выбрали нужного количества билетов'})
+    if check_seats_left and movie.get_tickets_count(data['date']) - int(number_of_ticket) < 0:
+        raise serializers.ValidationError({'number_of_ticket': NOT_ENOUGH_SEATS_MESSAGE})
+    if movie.start_time < datetime.now().time() and date_purchase == date.today():
+        raise serializers.ValidationError({'start_time': 'Онлайн продажи для этого сеанса закрыты'})
+    if date_purchase < date.today():
+        raise serializers.ValidationError({'date': 'Этот сеанс уже завершился'})
+    seats = data.get('seats')
+    if seats:
+        if len(seats) != number_of_ticket:
+            raise serializers.ValidationError({'seats': 'Количество мест не совпадает с количеством билетов'})
+        try:
+            indexes = {movie.cinema_hall.seat_index(**seat) for seat in seats}
+        except ValueError:
+            raise serializers.ValidationError({'seats': 'В зале нет такого места'})
+        if len(indexes) != len(seats):
+            raise serializers.ValidationError({'seats': 'Места не должны повторяться'})
+    return data
+
+
+def seats_error(error):
+    return {'seats' if error.seats_chosen else 'number_of_ticket': error.message}
 
 
 class PurchaseSerializerCreate(serializers.ModelSerializer):
+    seats = SeatSerializer(many=True, required=False)
 
     def __init__(self, *args, **kwargs):
         self.user_id = kwargs.pop('user_id', None)
@@ -130,26 +207,95 @@ class PurchaseSerializerCreate(serializers.ModelSerializer):
 
     class Meta:
         model = PurchasedTicket
-        fields = ['date', 'movie_show', 'number_of_ticket']
+        fields = ['date', 'movie_show', 'number_of_ticket', 'seats']
 
     def create(self, validated_data):
         """
         Create and return a new `PurchasedTicket` instance, given the validated data.
         """
-        return PurchasedTicket.objects.create(**validated_data)
+        try:
+            return checkout(self.user_id, [validated_data])[0]
+        except NotEnoughSeats as error:
+            raise serializers.ValidationError(seats_error(error))
 
     def validate(self, data):
-        movie = data['movie_show']
-        date_purchase = data['date']
-        number_of_ticket = data['number_of_ticket']
-        data['user'] = CustomUser.objects.get(id=self.user_id)
-        if number_of_ticket <= 0:
-            raise serializers.ValidationError({'number_of_ticket': 'Вы не выбрали нужного количества билетов'})
-        if movie.get_tickets_count(data['date']) - int(number_of_ticket) < 0:
-            raise serializers.ValidationError({'number_of_ticket': 'Такого количества свободных мест нет'})
-        if movie.start_time < datetime.now().time() and date_purchase == date.today():
-            raise serializers.ValidationError({'start_time': 'Онлайн продажи для этого сеанса закрыты'})
-        if date_purchase < date.today():
-            raise serializers.ValidationError({'date': 'Этот сеанс уже завершился'})
-        return data
+        return validate_purchase(data)
+
+
+class CheckoutLineSerializer(serializers.ModelSerializer):
+    seats = SeatSerializer(many=True, required=False)
+
+    class Meta:
+        model = PurchasedTicket
+        fields = ['date', 'movie_show', 'number_of_ticket', 'seats']
+
+    def validate(self, data):
+        return validate_purchase(data, check_seats_left=False)  # all lines at once in CheckoutSerializer
+
+
+class SeatHoldSerializer(serializers.ModelSerializer):
+    seats = SeatSerializer(many=True, required=False)
+
+    class Meta:
+        model = SeatHold
+        fields = ['id', 'date', 'movie_show', 'number_of_ticket', 'seats', 'expires_at']
+        read_only_fields = ['expires_at']
+
+    def validate(self, data):
+        return validate_purchase(data)
+
+
+class CheckoutSerializer(serializers.Serializer):
+    lines = CheckoutLineSerializer(many=True, allow_empty=False)
+
+    def validate_lines(self, lines):
+        """Remaining seats of every (show, date) in the cart with one query, against the lines' total."""
+        wanted = defaultdict(int)
+        for line in lines:
+            wanted[line['movie_show'].pk, line['date']] += line['number_of_ticket']
+        seats_left = SeatInventory.objects.get_seats_left_many(wanted)
+        short = {key for key, number_of_ticket in wanted.items() if seats_left[key] < number_of_ticket}
+        errors = [{'number_of_ticket': [NOT_ENOUGH_SEATS_MESSAGE]} if (line['movie_show'].pk, line['date']) in short
+                  else {} for line in lines]
+        if any(errors):
+            raise serializers.ValidationError(errors)
+        return lines
+
+
+class RollupFilterSerializer(serializers.Serializer):
+    date_from = serializers.DateField(required=False)
+    date_to = serializers.DateField(required=False)
+    cinema_hall = serializers.PrimaryKeyRelatedField(queryset=CinemaHall.objects.all(), required=False)
+
+
+class DailyReportSerializer(serializers.Serializer):
+    date = serializers.DateField()
+    cinema_hall = serializers.IntegerField(source='cinema_hall_id')
+    hall_name = serializers.CharField(source='cinema_hall__hall_name')
+    tickets_sold = serializers.IntegerField()
+    revenue = serializers.IntegerField()
+    seat_capacity = serializers.IntegerField()
+    occupancy = serializers.SerializerMethodField()
+
+    def get_occupancy(self, row):
+        return round(row['tickets_sold'] / row['seat_capacity'], 4) if row['seat_capacity'] else 0.0
+
+
+class MovieSearchQuerySerializer(serializers.Serializer):
+    q = serializers.CharField(min_length=2, max_length=120)
+    limit = serializers.IntegerField(min_value=1, max_value=50, default=10)
+
+
+class MovieSearchSerializer(serializers.ModelSerializer):
+    hall_name = serializers.CharField(source='cinema_hall.hall_name')
+    next_date = serializers.DateField()
+    tickets_left = serializers.IntegerField()
+
+    class Meta:
+        model = MovieShow
+        fields = ['id', 'movie_name', 'hall_name', 'ticket_price', 'start_time', 'finish_time', 'start_date',
+                  'finish_date', 'next_date', 'tickets_left']
+
 
+class SeatMapQuerySerializer(serializers.Serializer):
+    date = serializers.DateField(default=date.today)
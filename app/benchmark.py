@@ -0,0 +1,120 @@
+"""
+Helpers for the benchmark commands: drive the project in process through
+the WSGI (django.test.Client) and ASGI (django.test.AsyncClient) handlers
+with concurrent clients, or one endpoint at a time with its query counts,
+and summarize the latencies.
+"""
+import asyncio
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.db import connection
+from django.test import AsyncClient, Client
+from django.test.utils import CaptureQueriesContext, setup_test_environment
+
+COMPARED = ('p50_ms', 'p95_ms', 'p99_ms', 'queries_max')
+
+
+def percentile(samples, q):
+    """Nearest-rank percentile of a sorted list, q in 0..100."""
+    if not samples:
+        return 0.0
+    return samples[max(math.ceil(q / 100 * len(samples)) - 1, 0)]
+
+
+def summarize(latencies, elapsed):
+    latencies = sorted(latencies)
+    return {
+        'requests': len(latencies),
+        'rps': round(len(latencies) / elapsed, 1) if elapsed else 0.0,
+        'p50_ms': round(percentile(latencies, 50) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 95) * 1000, 2),
+        'p99_ms': round(percentile(latencies, 99) * 1000, 2),
+        'max_ms': round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def prepare_environment():
+    """Let the test clients reach the project (ALLOWED_HOSTS, DEBUG off); a no-op under the test runner."""
+    try:
+        setup_test_environment(debug=False)
+    except RuntimeError:
+        pass
+
+
+def measure(request, iterations, warmup=3):
+    """
+    Call `request()` `iterations` times after `warmup` unmeasured calls and
+    summarize the latencies together with the queries of each call.
+    """
+    for _ in range(warmup):
+        request()
+    latencies, queries = [], []
+    for _ in range(iterations):
+        with CaptureQueriesContext(connection) as context:
+            started = time.perf_counter()
+            response = request()
+            latencies.append(time.perf_counter() - started)
+        assert response.status_code < 400, response.status_code
+        queries.append(len(context))
+    return dict(summarize(latencies, sum(latencies)), queries_mean=round(sum(queries) / len(queries), 1),
+                queries_max=max(queries))
+
+
+def compare(results, baseline):
+    """Relative change of every COMPARED figure against the baseline run, per endpoint present in both."""
+    changes = {}
+    for name, result in results.items():
+        if name not in baseline:
+            continue
+        changes[name] = {key: round((result[key] - baseline[name][key]) / baseline[name][key] * 100, 1)
+                         if baseline[name][key] else 0.0 for key in COMPARED}
+    return changes
+
+
+def run_wsgi(url, requests, concurrency, token=None):
+    """`requests` GETs of `url` spread over `concurrency` threads, each with its own Client."""
+    per_client = [requests // concurrency + (number < requests % concurrency) for number in range(concurrency)]
+    headers = {'HTTP_AUTHORIZATION': f'Bearer {token}'} if token else {}
+
+    def client_run(count):
+        client = Client(**headers)
+        latencies = []
+        try:
+            for _ in range(count):
+                started = time.perf_counter()
+                response = client.get(url)
+                latencies.append(time.perf_counter() - started)
+                assert response.status_code == 200, (url, response.status_code)
+        finally:
+            connection.close()
+        return latencies
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(concurrency) as pool:
+        results = list(pool.map(client_run, per_client))
+    return summarize([latency for latencies in results for latency in latencies], time.perf_counter() - started)
+
+
+def run_asgi(url, requests, concurrency, token=None):
+    """`requests` GETs of `url` from `concurrency` AsyncClient tasks on one event loop."""
+    per_client = [requests // concurrency + (number < requests % concurrency) for number in range(concurrency)]
+    headers = {'authorization': f'Bearer {token}'} if token else {}  # ASGI header names
+
+    async def client_run(count):
+        client = AsyncClient()
+        latencies = []
+        for _ in range(count):
+            started = time.perf_counter()
+            response = await client.get(url, **headers)
+            latencies.append(time.perf_counter() - started)
+            assert response.status_code == 200, (url, response.status_code)
+        return latencies
+
+    async def main():
+        return await asyncio.gather(*[client_run(count) for count in per_client])
+
+    started = time.perf_counter()
+    results = asyncio.run(main())
+    return summarize([latency for latencies in results for latency in latencies], time.perf_counter() - started)
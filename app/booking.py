@@ -0,0 +1,150 @@
+"""
+Ticket checkout: buy several (show, date) lines in one transaction, or hold
+seats for a while and confirm the hold into a ticket later.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app import live
+from app.models import CustomUser, DailyRollup, PurchasedTicket, SeatHold, SeatInventory
+
+
+class NotEnoughSeats(Exception):
+
+    def __init__(self, line, seats_chosen=False):
+        self.line = line
+        self.seats_chosen = seats_chosen
+        super().__init__(f'Not enough seats for line {line}')
+
+    @property
+    def message(self):
+        if self.seats_chosen:
+            return 'Выбранные места уже заняты'
+        return 'Такого количества свободных мест нет'
+
+
+class HoldExpired(Exception):
+    message = 'Бронь не найдена или истекла'
+
+
+def add_spend(user_id, amount):
+    """Add to money_spent with one UPDATE of that column, without reading the user row."""
+    CustomUser.objects.filter(pk=user_id).update(money_spent=F('money_spent') + amount)
+
+
+def take_seats(lines):
+    """
+    Take the seats of every line (dict with movie_show, date, number_of_ticket
+    and optional seats as [{'row', 'seat'}]) and return the seats of each
+    line; lines without seats get the first free ones. Must run in a
+    transaction.
+
+    Seats are taken show by show in (movie_show, date) order, so two carts
+    touching the same shows always lock inventory rows in the same order and
+    cannot deadlock. Raises NotEnoughSeats with the index of the first line
+    that could not be served.
+    """
+    wanted = defaultdict(int)
+    chosen = defaultdict(list)
+    first_line = {}
+    for number, line in enumerate(lines):
+        key = (line['movie_show'].pk, line['date'])
+        wanted[key] += line['number_of_ticket']
+        chosen[key] += [line['movie_show'].cinema_hall.seat_index(**seat) for seat in line.get('seats') or ()]
+        first_line.setdefault(key, (number, line['movie_show']))
+
+    assigned = {}
+    for key in sorted(wanted):
+        number, movie_show = first_line[key]
+        taken = SeatInventory.objects.reserve(movie_show, key[1], wanted[key], chosen[key])
+        if not taken:
+            raise NotEnoughSeats(number, seats_chosen=bool(chosen[key]))
+        assigned[key] = iter(taken[len(chosen[key]):])
+
+    seats = []
+    for line in lines:
+        hall = line['movie_show'].cinema_hall
+        free = assigned[(line['movie_show'].pk, line['date'])]
+        seats.append(line.get('seats') or [hall.seat_label(next(free)) for _ in range(line['number_of_ticket'])])
+    return seats
+
+
+def sell(user_id, lines, seats):
+    """
+    Turn lines whose seats are already taken into tickets, rollups and spend.
+
+    The spend is added with a single UPDATE of money_spent as the last
+    statement, so the user row is locked only for the commit itself and
+    parallel purchases by the same account never lose an increment.
+    """
+    tickets = PurchasedTicket.objects.bulk_create([
+        PurchasedTicket(user_id=user_id, movie_show=line['movie_show'], date=line['date'],
+                        number_of_ticket=line['number_of_ticket'], seats=line_seats)
+        for line, line_seats in zip(lines, seats)
+    ])
+    for ticket in tickets:
+        DailyRollup.objects.record(ticket.movie_show, ticket.date, ticket.number_of_ticket)
+        # bulk_create() sends no post_save, publish like app.signals does for saved tickets
+        transaction.on_commit(partial(live.publish_seats, ticket.movie_show_id, ticket.date))
+    add_spend(user_id, sum(ticket.get_purchase_amount() for ticket in tickets))
+    return tickets
+
+
+def checkout(user_id, lines):
+    """Buy every line or none, see take_seats()."""
+    with transaction.atomic():
+        return sell(user_id, lines, take_seats(lines))
+
+
+def hold(user_id, line, ttl=None):
+    """Take the seats of one line for `ttl` seconds, settings.SEAT_HOLD_TTL by default."""
+    ttl = ttl or getattr(settings, 'SEAT_HOLD_TTL', 600)
+    with transaction.atomic():
+        seats = take_seats([line])[0]
+        return SeatHold.objects.create(user_id=user_id, movie_show=line['movie_show'], date=line['date'],
+                                       number_of_ticket=line['number_of_ticket'], seats=seats,
+                                       expires_at=timezone.now() + timedelta(seconds=ttl))
+
+
+def confirm(user_id, hold_id):
+    """
+    Turn a live hold into a ticket. The hold row is deleted only while it has
+    not expired, so a confirmation and the sweeper never both win.
+    """
+    with transaction.atomic():
+        seat_hold = SeatHold.objects.select_related('movie_show__cinema_hall') \
+            .filter(pk=hold_id, user_id=user_id).first()
+        if seat_hold is None or not SeatHold.objects.filter(pk=hold_id, expires_at__gt=timezone.now()).delete()[0]:
+            raise HoldExpired
+        line = {'movie_show': seat_hold.movie_show, 'date': seat_hold.date,
+                'number_of_ticket': seat_hold.number_of_ticket}
+        return sell(user_id, [line], [seat_hold.seats])[0]
+
+
+def release(seat_hold):
+    """Delete the hold and give its seats back; False if it was already confirmed or released."""
+    with transaction.atomic():
+        if not SeatHold.objects.filter(pk=seat_hold.pk).delete()[0]:
+            return False
+        hall = seat_hold.movie_show.cinema_hall
+        SeatInventory.objects.release(seat_hold.movie_show, seat_hold.date,
+                                      [hall.seat_index(**seat) for seat in seat_hold.seats])
+    return True
+
+
+def sweep_holds(now=None, batch_size=500):
+    """Release expired holds by walking the expires_at index, so the cost is O(expired). Returns the count."""
+    now = now or timezone.now()
+    released = 0
+    while True:
+        expired = list(SeatHold.objects.select_related('movie_show__cinema_hall')
+                       .filter(expires_at__lte=now).order_by('expires_at')[:batch_size])
+        released += sum(release(seat_hold) for seat_hold in expired)
+        if len(expired) < batch_size:
+            return released
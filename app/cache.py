@@ -0,0 +1,113 @@
+"""
+Versioned cache for schedule listings.
+
+Every key embeds the current schedule version, so invalidation is a single
+increment of the version key instead of deleting key patterns; stale
+entries simply stop being read and expire on their own. Works with any
+Django cache backend (local memory per process, or a shared one).
+
+TableVersions keeps the time of the last write to a table in the database,
+the validator behind the ETag and Last-Modified headers of the list APIs.
+"""
+import threading
+import time
+from datetime import datetime, timezone
+
+from django.conf import settings
+from django.core.cache import caches
+
+from app.models import TableVersion
+
+MISSING = object()
+
+
+class ScheduleCache:
+    version_key = 'schedule:version'
+
+    def __init__(self, alias='default', timeout=None):
+        self.alias = alias
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def get_timeout(self):
+        if self.timeout is not None:
+            return self.timeout
+        return getattr(settings, 'SCHEDULE_CACHE_TIMEOUT', 300)
+
+    def version(self):
+        version = self.cache.get(self.version_key)
+        if version is None:
+            # start from the clock, so a version evicted from the cache never repeats an old one
+            self.cache.add(self.version_key, time.time_ns(), None)
+            version = self.cache.get(self.version_key)
+        return version
+
+    def invalidate(self):
+        try:
+            self.cache.incr(self.version_key)
+        except ValueError:
+            self.cache.set(self.version_key, time.time_ns(), None)
+
+    def make_key(self, *parts):
+        return ':'.join(['schedule', str(self.version())] + [str(part) for part in parts])
+
+    def lookup(self, key):
+        """The value cached under a make_key() key, or MISSING."""
+        value = self.cache.get(key, MISSING)
+        self._count('misses' if value is MISSING else 'hits')
+        return value
+
+    def store(self, key, value):
+        # the key was made before computing the value, so a change in between leaves it under the old version
+        self.cache.set(key, value, self.get_timeout())
+
+    def get_or_set(self, parts, compute):
+        """Return the cached value for the key parts, computing and storing it on a miss."""
+        key = self.make_key(*parts)
+        value = self.lookup(key)
+        if value is MISSING:
+            value = compute()
+            self.store(key, value)
+        return value
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {'hits': self.hits, 'misses': self.misses, 'hit_ratio': self.hits / total if total else 0.0}
+
+    def _count(self, counter):
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+
+
+schedule_cache = ScheduleCache()
+
+
+class TableVersions:
+    """
+    Last write to each table in nanoseconds since the epoch, moved by touch()
+    after the write commits (see app.signals). The versions live in the
+    TableVersion table, not in the cache, so every worker reads the same one
+    with a primary key lookup.
+    """
+
+    def label(self, model):
+        return model._meta.label_lower
+
+    def get(self, model):
+        return TableVersion.objects.current(self.label(model))
+
+    def last_modified(self, model, version=None):
+        version = self.get(model) if version is None else version
+        return datetime.fromtimestamp(version / 10 ** 9, timezone.utc)
+
+    def touch(self, *models):
+        TableVersion.objects.touch(*(self.label(model) for model in models))
+
+
+table_versions = TableVersions()
@@ -0,0 +1,63 @@
+"""
+Streaming sales export: tickets joined with show, hall and user, written
+row by row as CSV or NDJSON from a values_list().iterator(), so memory use
+stays flat whatever the number of rows.
+"""
+import csv
+import json
+
+from django.core.serializers.json import DjangoJSONEncoder
+
+from app.models import PurchasedTicket
+
+SALES_COLUMNS = [
+    ('ticket_id', 'id'),
+    ('date', 'date'),
+    ('number_of_ticket', 'number_of_ticket'),
+    ('ticket_price', 'movie_show__ticket_price'),
+    ('movie_show_id', 'movie_show_id'),
+    ('movie_name', 'movie_show__movie_name'),
+    ('cinema_hall_id', 'movie_show__cinema_hall_id'),
+    ('hall_name', 'movie_show__cinema_hall__hall_name'),
+    ('user_id', 'user_id'),
+    ('username', 'user__username'),
+]
+HEADER = [name for name, _ in SALES_COLUMNS] + ['amount']
+CONTENT_TYPES = {'csv': 'text/csv', 'ndjson': 'application/x-ndjson'}
+CHUNK_SIZE = 2000
+
+
+def sales_rows(date_from=None, date_to=None, cinema_hall=None, chunk_size=CHUNK_SIZE):
+    """Yield export rows (HEADER order) for the tickets in the date range and hall."""
+    tickets = PurchasedTicket.objects.order_by('id')
+    if date_from:
+        tickets = tickets.filter(date__gte=date_from)
+    if date_to:
+        tickets = tickets.filter(date__lte=date_to)
+    if cinema_hall:
+        tickets = tickets.filter(movie_show__cinema_hall=cinema_hall)
+    for row in tickets.values_list(*[lookup for _, lookup in SALES_COLUMNS]).iterator(chunk_size=chunk_size):
+        yield row + (row[2] * row[3],)
+
+
+class Echo:
+    """File-like object handing each written line back to the caller."""
+
+    def write(self, value):
+        return value
+
+
+def iter_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(HEADER)
+    for row in rows:
+        yield writer.writerow(row)
+
+
+def iter_ndjson(rows):
+    for row in rows:
+        yield json.dumps(dict(zip(HEADER, row)), cls=DjangoJSONEncoder, ensure_ascii=False) + '\n'
+
+
+def iter_export(file_format, rows):
+    return iter_csv(rows) if file_format == 'csv' else iter_ndjson(rows)
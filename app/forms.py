@@ -3,12 +3,12 @@ from datetime import datetime, date
 from django import forms
 from django.contrib import messages
 from django.core.exceptions import ValidationError
-from django.db.models import Q
 from django.forms.widgets import TextInput
 from django.contrib.auth.forms import UserCreationForm
 from django.forms import ModelForm
 
 from app.models import CustomUser, MovieShow, CinemaHall, PurchasedTicket
+from app.schedule import OVERLAP_MESSAGE, find_conflict
 
 
 class NumberInput(TextInput):
@@ -32,7 +32,7 @@ class RegisterForm(UserCreationForm):
 class HallCreateForm(ModelForm):
     class Meta:
         model = CinemaHall
-        fields = ['hall_name', 'number_of_seats']
+        fields = ['hall_name', 'number_of_seats', 'seats_per_row']
 
 
 class ChoiceForm(forms.Form):
@@ -84,28 +84,8 @@ class MovieShowCreateForm(ModelForm):
         if start_date == date.today() and start_time < datetime.now().time():  # дата начала сегодня, время начала меньше чем сейчас
             raise ValidationError('Нельзя создавать сеанс в прошедшем времени!')
 
-        enter_start_date = Q(start_date__range=(start_date, finish_date))  # date
-        enter_finish_date = Q(finish_date__range=(start_date, finish_date))
-        middle_date_start = Q(start_date__lte=start_date, finish_date__gte=finish_date)
-        enter_start_time = Q(start_time__range=(start_time, finish_time))  # time
-        enter_finish_time = Q(finish_time__range=(start_time, finish_time))
-
-        movie_obj = MovieShow.objects.filter(cinema_hall=cinema_hall_obj.pk).filter(
-            enter_start_date | enter_finish_date | middle_date_start).filter(enter_start_time | enter_finish_time).all()
-
-        if start_time > finish_time:
-            enter_start_time_until_midnight = Q(start_time__range=(start_time, '23:59:59'))
-            enter_start_time_after_midnight = Q(start_time__range=('00:00:00', finish_time))
-            enter_finish_time_until_midnight = Q(finish_time__range=(start_time, '23:59:59'))
-            enter_finish_time_after_midnight = Q(finish_time__range=('00:00:00', finish_time))
-
-            movie_obj = MovieShow.objects.filter(cinema_hall=cinema_hall_obj.pk).filter(
-                enter_start_date | enter_finish_date | middle_date_start). \
-                filter(enter_start_time_until_midnight | enter_start_time_after_midnight |
-                       enter_finish_time_until_midnight | enter_finish_time_after_midnight)
-
-        if movie_obj:
-            raise ValidationError('Сеансы в одном зале не могут накладываться друг на друга')
+        if find_conflict(cinema_hall_obj.pk, start_date, finish_date, start_time, finish_time) is not None:
+            raise ValidationError(OVERLAP_MESSAGE)
 
 
 class MovieShowUpdateForm(ModelForm):
@@ -164,7 +144,7 @@ class BuyTicketForm(ModelForm):
         movie_id = self.request.POST.get('movie-id')
         movie_show = MovieShow.objects.get(id=movie_id)
         count_of_buy = int(cleaned_data.get('number_of_ticket'))
-        tickets_left = int(self.request.POST.get('tickets_left'))
+        tickets_left = movie_show.get_tickets_count(self.request.POST.get('date-buy') or date.today())
 
         if movie_show.start_time < datetime.now().time() and self.request.POST.get('date-buy') == str(date.today()):
             messages.warning(self.request, 'Продажи для этого сеанса на сегодня закрыты')
@@ -173,3 +153,13 @@ class BuyTicketForm(ModelForm):
         if count_of_buy > tickets_left:
             messages.warning(self.request, 'Такого количества свободных мест нет')
             raise ValidationError('Такого количества свободных мест нет')
+
+
+class ReportPeriodForm(forms.Form):
+    date_from = forms.DateField(required=False, widget=DateInput())
+    date_to = forms.DateField(required=False, widget=DateInput())
+
+
+class SalesExportForm(ReportPeriodForm):
+    cinema_hall = forms.ModelChoiceField(queryset=CinemaHall.objects.all(), required=False)
+    format = forms.ChoiceField(choices=[('csv', 'CSV'), ('ndjson', 'NDJSON')], required=False)
@@ -0,0 +1,147 @@
+"""
+Resized poster variants for MovieShow.image.
+
+When a show gets a new image, the variants (settings.IMAGE_VARIANT_WIDTHS,
+WebP plus a JPEG fallback, metadata stripped) are rendered on a bounded
+process pool, so the admin request returns at once. The finished variants
+are written to `image_variants` with a guarded UPDATE, which is skipped if
+the image changed in the meantime.
+"""
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from pathlib import Path
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import connection
+from PIL import Image, ImageOps
+
+logger = logging.getLogger(__name__)
+
+FORMATS = {'webp': ('WEBP', {'quality': 80, 'method': 4}),
+           'jpeg': ('JPEG', {'quality': 82, 'optimize': True, 'progressive': True})}
+PENDING_PER_WORKER = 8
+
+_pool = None
+_pool_lock = threading.Lock()
+_slots = None
+
+
+def get_widths():
+    return getattr(settings, 'IMAGE_VARIANT_WIDTHS', (320, 640, 960))
+
+
+def get_workers():
+    return getattr(settings, 'IMAGE_WORKERS', 2)
+
+
+def make_variants(source_path, media_root, name, movie_show_id, widths):
+    """
+    Render the variants of one image; runs in a pool process, so it only
+    uses Pillow and plain paths. Returns the `image_variants` value.
+
+    Transparent posters keep their alpha channel in WebP; JPEG has none, so
+    its fallback is flattened onto white. The variants live in a directory
+    of the show, two shows uploading poster.png never share a file.
+    """
+    with Image.open(source_path) as original:
+        has_alpha = original.mode in ('RGBA', 'LA', 'PA') or 'transparency' in original.info
+        mode = 'RGBA' if has_alpha else 'RGB'
+        image = ImageOps.exif_transpose(original)
+        # copying the pixels into a new image drops EXIF, ICC and other metadata
+        image = Image.frombytes(mode, image.size, image.convert(mode).tobytes())
+    stem = Path(name).stem
+    variants = {'source': name, 'width': image.width}
+    for width in sorted({min(width, image.width) for width in widths}):
+        resized = image if width == image.width else image.resize(
+            (width, max(round(image.height * width / image.width), 1)), Image.LANCZOS)
+        for extension, (image_format, options) in FORMATS.items():
+            variant = f'images/variants/{movie_show_id}/{stem}-{width}.{extension}'
+            path = Path(media_root) / variant
+            path.parent.mkdir(parents=True, exist_ok=True)
+            flatten(resized, image_format).save(path, image_format, **options)
+            variants.setdefault(extension, []).append([width, variant])
+    return variants
+
+
+def flatten(image, image_format):
+    """The image on a white background for formats without transparency."""
+    if image.mode != 'RGBA' or image_format != 'JPEG':
+        return image
+    background = Image.new('RGB', image.size, 'white')
+    background.paste(image, mask=image.getchannel('A'))
+    return background
+
+
+def store(movie_show_id, name, variants):
+    from app.cache import schedule_cache, table_versions
+    from app.models import MovieShow
+
+    if MovieShow.objects.filter(pk=movie_show_id, image=name).update(image_variants=variants):
+        schedule_cache.invalidate()  # update() sends no signals
+        table_versions.touch(MovieShow)
+
+
+def get_pool():
+    global _pool, _slots
+    with _pool_lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=get_workers())
+            _slots = threading.BoundedSemaphore(get_workers() * PENDING_PER_WORKER)
+        return _pool
+
+
+def shutdown():
+    """Wait for the queued variants, including storing them, and stop the pool."""
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+            _pool = None
+
+
+def schedule(movie_show, block=False):
+    """
+    Queue the variants of the show image. Returns the future, or None when
+    they were rendered inline (IMAGE_WORKERS = 0) or the queue is full; the
+    build_image_variants command catches up on the skipped ones.
+    """
+    args = (default_storage.path(movie_show.image.name), str(settings.MEDIA_ROOT), movie_show.image.name,
+            movie_show.pk, get_widths())
+    if not get_workers():
+        store(movie_show.pk, movie_show.image.name, make_variants(*args))
+        return None
+    pool = get_pool()
+    if not _slots.acquire(blocking=block):
+        logger.warning('Image variant queue is full, skipped %s', movie_show.image.name)
+        return None
+    future = pool.submit(make_variants, *args)
+    future.add_done_callback(partial(finished, movie_show.pk, movie_show.image.name, threading.get_ident()))
+    return future
+
+
+def finished(movie_show_id, name, scheduled_by, future):
+    _slots.release()
+    try:
+        store(movie_show_id, name, future.result())
+    except Exception:
+        logger.exception('Could not build image variants for %s', name)
+    finally:
+        if threading.get_ident() != scheduled_by:
+            connection.close()  # callback thread of the pool
+
+
+def is_stale(movie_show):
+    return bool(movie_show.image) and movie_show.image_variants.get('source') != movie_show.image.name
+
+
+def variant_urls(movie_show, request=None):
+    """{'webp': {'320': url, ...}, 'jpeg': {...}} for the API."""
+    urls = {}
+    for extension in FORMATS:
+        for width, name in movie_show.image_variants.get(extension, ()):
+            url = default_storage.url(name)
+            urls.setdefault(extension, {})[str(width)] = request.build_absolute_uri(url) if request else url
+    return urls
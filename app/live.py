@@ -0,0 +1,154 @@
+"""
+Live seat counts over Server-Sent Events.
+
+Purchases and seat holds publish the new count of their (show, date) to an
+in-process broker once they commit (see app.signals): one query per commit
+when somebody watches, whatever the number of watchers. The broker only sees
+writes made by this process.
+
+The stream is served only under ASGI, by `sse_application` mounted in
+cinema/asgi.py in front of Django, so every watcher is a coroutine on the
+event loop. It marks the requests it passes on with the stream path (see
+stream_path); pages served without it, under WSGI, poll the availability
+endpoint instead of holding a worker thread per watcher.
+"""
+import asyncio
+import json
+import threading
+from collections import defaultdict
+from datetime import date
+from urllib.parse import parse_qs
+
+from asgiref.sync import sync_to_async
+from app.models import MovieShow, SeatInventory
+
+MAX_WATCHES = 50
+HEARTBEAT = 15  # seconds
+
+
+class SeatBroker:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._watchers = defaultdict(set)
+
+    def subscribe(self, keys, deliver):
+        """Call deliver(event) from any thread on every change of the (movie_show_id, date) keys."""
+        with self._lock:
+            for key in keys:
+                self._watchers[key].add(deliver)
+
+    def unsubscribe(self, keys, deliver):
+        with self._lock:
+            for key in keys:
+                self._watchers[key].discard(deliver)
+                if not self._watchers[key]:
+                    del self._watchers[key]
+
+    def is_watched(self, key):
+        return key in self._watchers
+
+    def publish(self, key, tickets_left):
+        event = {'movie_show': key[0], 'date': key[1], 'tickets_left': tickets_left}
+        with self._lock:
+            watchers = list(self._watchers.get(key, ()))
+        for deliver in watchers:
+            deliver(event)
+
+
+broker = SeatBroker()
+
+
+def publish_seats(movie_show_id, date_show):
+    key = (movie_show_id, str(date_show))
+    if not broker.is_watched(key):
+        return
+    tickets_left = SeatInventory.objects.filter(movie_show_id=movie_show_id, date=date_show) \
+        .values_list('seats_left', flat=True).first()
+    if tickets_left is not None:
+        broker.publish(key, tickets_left)
+
+
+def parse_watches(values):
+    """`?watch=<show id>[:<YYYY-MM-DD>]` values, today by default; ValueError if malformed."""
+    keys = set()
+    for value in values:
+        movie_show_id, _, date_show = value.partition(':')
+        keys.add((int(movie_show_id), (date.fromisoformat(date_show) if date_show else date.today()).isoformat()))
+    if not keys or len(keys) > MAX_WATCHES:
+        raise ValueError(f'Watch between 1 and {MAX_WATCHES} shows')
+    return keys
+
+
+def snapshot(keys):
+    """Current counts of the watched keys, one query per distinct date."""
+    events = []
+    for date_show in {key[1] for key in keys}:
+        shows = [key[0] for key in keys if key[1] == date_show]
+        events += [{'movie_show': pk, 'date': date_show, 'tickets_left': tickets_left}
+                   for pk, tickets_left in MovieShow.objects.with_tickets_left(date_show).filter(pk__in=shows)
+                   .values_list('pk', 'tickets_left')]
+    return events
+
+
+def format_event(event):
+    return f'event: seats\ndata: {json.dumps(event)}\n\n'
+
+
+def stream_path(request):
+    """Path of the seat stream when the request came through sse_application, None otherwise."""
+    return getattr(request, 'scope', {}).get('live_seats')
+
+
+def sse_application(application, path='/api/live/seats/'):
+    """ASGI middleware serving the seat stream at `path` and passing everything else to `application`."""
+
+    async def app(scope, receive, send):
+        if scope['type'] != 'http':
+            return await application(scope, receive, send)
+        if scope['path'] != path:
+            return await application(dict(scope, live_seats=path), receive, send)
+        try:
+            keys = parse_watches(parse_qs(scope['query_string'].decode()).get('watch', []))
+        except ValueError as error:
+            await send({'type': 'http.response.start', 'status': 400,
+                        'headers': [(b'content-type', b'text/plain; charset=utf-8')]})
+            await send({'type': 'http.response.body', 'body': str(error).encode()})
+            return
+
+        loop = asyncio.get_running_loop()
+        events = asyncio.Queue()
+
+        def deliver(event):
+            loop.call_soon_threadsafe(events.put_nowait, event)
+
+        broker.subscribe(keys, deliver)
+        disconnected = asyncio.ensure_future(wait_disconnect(receive))
+        try:
+            await send({'type': 'http.response.start', 'status': 200,
+                        'headers': [(b'content-type', b'text/event-stream'), (b'cache-control', b'no-cache'),
+                                    (b'x-accel-buffering', b'no')]})
+            for event in await sync_to_async(snapshot)(keys):
+                await send({'type': 'http.response.body', 'body': format_event(event).encode(), 'more_body': True})
+            while not disconnected.done():
+                next_event = asyncio.ensure_future(events.get())
+                await asyncio.wait([next_event, disconnected], timeout=HEARTBEAT,
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if next_event.done():
+                    body = format_event(next_event.result())
+                else:
+                    next_event.cancel()
+                    if disconnected.done():
+                        break
+                    body = ': ping\n\n'
+                await send({'type': 'http.response.body', 'body': body.encode(), 'more_body': True})
+        finally:
+            broker.unsubscribe(keys, deliver)
+            disconnected.cancel()
+
+    return app
+
+
+async def wait_disconnect(receive):
+    while (await receive())['type'] != 'http.disconnect':
+        pass
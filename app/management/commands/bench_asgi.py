@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from app.benchmark import prepare_environment, run_asgi, run_wsgi
+from app.models import CustomUser, MovieShow
+from app.tokens import RefreshToken
+
+
+class Command(BaseCommand):
+    help = 'Compare requests per second and latency of the read endpoints under WSGI and ASGI, in process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=500, help='Requests per endpoint and handler')
+        parser.add_argument('--concurrency', type=int, default=20, help='Concurrent clients')
+        parser.add_argument('--output', help='Also write the results as JSON to this file')
+
+    def handle(self, *args, **options):
+        movie_show = MovieShow.objects.order_by('id').first()
+        if movie_show is None:
+            raise CommandError('No movie shows in the database, create some first')
+        prepare_environment()
+        staff = CustomUser.objects.filter(is_staff=True).order_by('id').first()
+        token = staff and str(RefreshToken.for_user(staff).access_token)
+
+        endpoints = [
+            ('halls', reverse('async-hall-list'), None),
+            ('movies', reverse('async-movie-list'), token),
+            ('availability', reverse('async-availability', args=[movie_show.pk]), None),
+            ('halls (sync view)', reverse('cinema_hall_list'), None),
+            ('movies (sync view)', reverse('show_movie'), token),
+        ]
+        if token is None:
+            endpoints = [endpoint for endpoint in endpoints if endpoint[2] is None]  # the schedule is for admins
+            self.stderr.write('No staff user, skipping the movie endpoints')
+        results = []
+        for name, url, token in endpoints:
+            for handler, run in (('wsgi', run_wsgi), ('asgi', run_asgi)):
+                result = dict(run(url, options['requests'], options['concurrency'], token),
+                              endpoint=name, handler=handler)
+                results.append(result)
+                self.stdout.write(f"{name:<20} {handler}  {result['rps']:>8} req/s  "
+                                  f"p50 {result['p50_ms']:>7} ms  p99 {result['p99_ms']:>7} ms")
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(results, file, indent=2)
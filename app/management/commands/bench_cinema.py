@@ -0,0 +1,77 @@
+import json
+import platform
+from datetime import date, datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+
+from app.benchmark import COMPARED, compare, measure, prepare_environment
+from app.models import CinemaHall, CustomUser, MovieShow, PurchasedTicket
+from app.tokens import RefreshToken
+
+
+class Command(BaseCommand):
+    help = 'Measure latency percentiles and query counts of the main pages and API endpoints'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50, help='Measured requests per endpoint')
+        parser.add_argument('--output', help='Write the results as JSON to this file')
+        parser.add_argument('--baseline', help='JSON file of an earlier run to compare with')
+
+    def handle(self, *args, **options):
+        # the heaviest buyer, so the purchase pages show a realistic history
+        user = CustomUser.objects.filter(is_staff=False).order_by('-money_spent', 'id').first()
+        tomorrow = date.today() + timedelta(days=1)
+        shows = list(MovieShow.objects.filter(start_date__lte=tomorrow, finish_date__gte=tomorrow)
+                     .values_list('pk', flat=True))
+        if user is None or not shows:
+            raise CommandError('No users or shows running tomorrow, run seed_cinema first')
+        prepare_environment()
+
+        client = Client()
+        client.force_login(user)
+        api = Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(user).access_token}')
+        staff = CustomUser.objects.filter(is_staff=True).order_by('id').first()
+        admin_api = staff and Client(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(staff).access_token}')
+        bought = iter(range(10 ** 9))
+
+        def buy():
+            return client.post(reverse('ticket_buy'), {'movie-id': shows[next(bought) % len(shows)],
+                                                       'date-buy': str(tomorrow), 'number_of_ticket': 1})
+
+        endpoints = {
+            'index': lambda: client.get(reverse('index')),
+            'purchases': lambda: client.get(reverse('purchases')),
+            'ticket_buy': buy,
+            'api/movie': lambda: admin_api.get(reverse('show_movie')),
+            'api/purchased': lambda: api.get(reverse('api-purchased')),
+            'api/hall': lambda: api.get(reverse('cinema_hall_list')),
+        }
+        if staff is None:
+            del endpoints['api/movie']  # admins only
+            self.stderr.write('No staff user, skipping api/movie')
+        results = {}
+        for name, request in endpoints.items():
+            results[name] = measure(request, options['iterations'])
+            self.stdout.write(f"{name:<15} p50 {results[name]['p50_ms']:>8} ms  p95 {results[name]['p95_ms']:>8} ms  "
+                              f"p99 {results[name]['p99_ms']:>8} ms  queries {results[name]['queries_max']:>4}")
+
+        report = {
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'python': platform.python_version(),
+            'iterations': options['iterations'],
+            'rows': {'halls': CinemaHall.objects.count(), 'shows': MovieShow.objects.count(),
+                     'users': CustomUser.objects.count(), 'tickets': PurchasedTicket.objects.count()},
+            'results': results,
+        }
+        if options['baseline']:
+            with open(options['baseline']) as file:
+                report['changes'] = compare(results, json.load(file)['results'])
+            for name, change in report['changes'].items():
+                self.stdout.write(f'{name:<15} ' + '  '.join(f'{key} {change[key]:+.1f}%' for key in COMPARED))
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, indent=2)
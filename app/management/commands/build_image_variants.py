@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from app import images
+from app.models import MovieShow
+
+
+class Command(BaseCommand):
+    help = 'Render the resized WebP and JPEG variants of movie show images that do not have them yet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true', help='Rebuild the variants of every image')
+
+    def handle(self, *args, **options):
+        shows = [show for show in MovieShow.objects.exclude(image='').exclude(image__isnull=True).order_by('id')
+                 if options['force'] or images.is_stale(show)]
+        futures = [future for future in (images.schedule(show, block=True) for show in shows) if future]
+        images.shutdown()
+        failed = [future for future in futures if future.exception()]
+        for future in failed:
+            self.stderr.write(str(future.exception()))
+        self.stdout.write(self.style.SUCCESS(f'Built variants for {len(shows) - len(failed)} of {len(shows)} images'))
@@ -0,0 +1,32 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.exports import iter_export, sales_rows
+from app.forms import SalesExportForm
+
+
+class Command(BaseCommand):
+    help = 'Stream ticket sales joined with show, hall and user as CSV or NDJSON'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--from', dest='date_from', help='First sale date, YYYY-MM-DD')
+        parser.add_argument('--to', dest='date_to', help='Last sale date, YYYY-MM-DD')
+        parser.add_argument('--hall', dest='cinema_hall', help='Cinema hall id')
+        parser.add_argument('--format', choices=['csv', 'ndjson'], default='csv')
+        parser.add_argument('--output', help='File to write, stdout by default')
+
+    def handle(self, *args, **options):
+        form = SalesExportForm({key: options[key] for key in ('date_from', 'date_to', 'cinema_hall', 'format')
+                                if options[key]})
+        if not form.is_valid():
+            raise CommandError(form.errors.as_text())
+        rows = sales_rows(form.cleaned_data['date_from'], form.cleaned_data['date_to'],
+                          form.cleaned_data['cinema_hall'])
+        output = open(options['output'], 'w', encoding='utf-8', newline='') if options['output'] else sys.stdout
+        try:
+            for chunk in iter_export(options['format'], rows):
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout:
+                output.close()
@@ -0,0 +1,31 @@
+import csv
+import json
+from pathlib import Path
+
+from django.core.management.base import BaseCommand, CommandError
+
+from app.api.serializers import import_schedule
+
+
+class Command(BaseCommand):
+    help = 'Import a batch of movie shows from a CSV or JSON file in one transaction'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV with a header row or a JSON list of objects with MovieShow fields')
+        parser.add_argument('--format', choices=['csv', 'json'], help='File format, guessed from the extension')
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError('Unknown file format, use --format csv or --format json')
+
+        with path.open(encoding='utf-8', newline='') as file:
+            rows = list(csv.DictReader(file)) if file_format == 'csv' else json.load(file)
+
+        shows, errors = import_schedule(rows)
+        if errors:
+            for error in errors:
+                self.stderr.write(f"row {error['row']}: {error['errors']}")
+            raise CommandError(f'{len(errors)} rows rejected, nothing imported')
+        self.stdout.write(self.style.SUCCESS(f'Imported {len(shows)} shows'))
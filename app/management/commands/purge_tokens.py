@@ -0,0 +1,37 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+
+class Command(BaseCommand):
+    help = 'Delete expired outstanding and blacklisted JWTs in batches, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep purging with this many seconds between runs')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        while True:
+            purged = self.purge(options['batch_size'])
+            if purged or not options['interval']:
+                self.stdout.write(f'Purged {purged} expired tokens')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
+
+    def purge(self, batch_size):
+        """Short transactions of `batch_size` tokens each, so the tables are never locked for long."""
+        now = aware_utcnow()
+        purged = 0
+        while True:
+            ids = list(OutstandingToken.objects.filter(expires_at__lte=now).order_by('id')
+                       .values_list('id', flat=True)[:batch_size])
+            with transaction.atomic():
+                BlacklistedToken.objects.filter(token_id__in=ids).delete()
+                OutstandingToken.objects.filter(id__in=ids).delete()
+            purged += len(ids)
+            if len(ids) < batch_size:
+                return purged
@@ -0,0 +1,121 @@
+import random
+import time as timer
+from collections import defaultdict
+from datetime import date, time, timedelta
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from app import seating
+from app.models import CinemaHall, CustomUser, DailyRollup, PurchasedTicket, SeatInventory
+from app.schedule import import_shows
+
+MOVIES = ['Дюна', 'Интерстеллар', 'Начало', 'Брат', 'Матрица', 'Солярис', 'Сталкер', 'Аватар', 'Титаник',
+          'Джокер', 'Гладиатор', 'Бэтмен', 'Довод', 'Оппенгеймер', 'Барби', 'Холоп']
+SESSIONS = [(time(10, 0), time(12, 30)), (time(13, 0), time(15, 30)), (time(16, 0), time(18, 30)),
+            (time(19, 0), time(21, 30))]
+
+
+class Command(BaseCommand):
+    help = 'Fill the database with generated halls, shows, users and tickets for benchmarks'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--halls', type=int, default=8)
+        parser.add_argument('--days', type=int, default=90, help='Days of schedule, two thirds of them in the past')
+        parser.add_argument('--run-days', type=int, default=7, help='Days each show runs')
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--tickets', type=int, default=100000)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--prefix', default='seed', help='Prefix of the generated hall and user names')
+        parser.add_argument('--seed', type=int, default=0, help='Random seed')
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if CinemaHall.objects.filter(hall_name__startswith=f'{prefix} hall ').exists():
+            raise CommandError(f'There is already {prefix} data, use another --prefix')
+        self.random = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        started = timer.perf_counter()
+
+        halls = self.create_halls(prefix, options['halls'])
+        shows = self.create_shows(halls, options['days'], options['run_days'])
+        users = self.create_users(prefix, options['users'])
+        sold = self.create_tickets(shows, users, options['tickets'])
+        self.create_inventory(shows, sold)
+        first_date = min(show.start_date for show in shows)
+        last_date = max(show.finish_date for show in shows)
+        rollups = DailyRollup.objects.rebuild(first_date, last_date)
+        self.stdout.write(self.style.SUCCESS(
+            f'{len(halls)} halls, {len(shows)} shows, {len(users)} users, {sum(sold.values())} seats sold, '
+            f'{rollups} rollups in {timer.perf_counter() - started:.1f}s'))
+
+    def create_halls(self, prefix, count):
+        return CinemaHall.objects.bulk_create([
+            CinemaHall(hall_name=f'{prefix} hall {number}', number_of_seats=self.random.randrange(50, 301, 10),
+                       seats_per_row=self.random.choice([10, 12, 15, 20]))
+            for number in range(1, count + 1)
+        ])
+
+    def create_shows(self, halls, days, run_days):
+        first_date = date.today() - timedelta(days=days * 2 // 3)
+        rows = [
+            {'movie_name': self.random.choice(MOVIES), 'ticket_price': self.random.randrange(100, 601, 50),
+             'start_time': start_time, 'finish_time': finish_time, 'cinema_hall_id': hall.pk,
+             'start_date': first_date + timedelta(days=offset),
+             'finish_date': first_date + timedelta(days=min(offset + run_days, days) - 1)}
+            for hall in halls for offset in range(0, days, run_days) for start_time, finish_time in SESSIONS
+        ]
+        shows, errors = import_shows(rows)
+        if errors:
+            raise CommandError(f'Generated schedule overlaps existing shows: {errors}')
+        return shows
+
+    def create_users(self, prefix, count):
+        password = make_password('password123')
+        return CustomUser.objects.bulk_create([
+            CustomUser(username=f'{prefix}-user-{number}', password=password) for number in range(1, count + 1)
+        ], batch_size=self.batch_size)
+
+    def create_tickets(self, shows, users, count):
+        """Random purchases within the hall capacities, seats assigned in order. Returns seats sold per key."""
+        halls = {show.cinema_hall_id: show.cinema_hall for show in shows}
+        sold = defaultdict(int)
+        spent = defaultdict(int)
+        created = attempts = 0
+        while created < count and attempts < count * 3:
+            batch = []
+            for _ in range(min(self.batch_size, count - created)):
+                attempts += 1
+                show = self.random.choice(shows)
+                hall = halls[show.cinema_hall_id]
+                date_show = show.start_date + timedelta(
+                    days=self.random.randrange((show.finish_date - show.start_date).days + 1))
+                number_of_ticket = self.random.randint(1, 4)
+                key = (show.pk, date_show)
+                if sold[key] + number_of_ticket > hall.number_of_seats:
+                    continue
+                user = self.random.choice(users)
+                seats = [hall.seat_label(index) for index in range(sold[key], sold[key] + number_of_ticket)]
+                sold[key] += number_of_ticket
+                spent[user.pk] += number_of_ticket * show.ticket_price
+                batch.append(PurchasedTicket(movie_show=show, user=user, date=date_show,
+                                             number_of_ticket=number_of_ticket, seats=seats))
+            PurchasedTicket.objects.bulk_create(batch, batch_size=self.batch_size)
+            created += len(batch)
+            self.stdout.write(f'{created} tickets', ending='\r')
+        self.stdout.write('')
+
+        for user in users:
+            user.money_spent = spent[user.pk]
+        CustomUser.objects.bulk_update(users, ['money_spent'], batch_size=self.batch_size)
+        return sold
+
+    @transaction.atomic
+    def create_inventory(self, shows, sold):
+        capacity = {show.pk: show.cinema_hall.number_of_seats for show in shows}
+        SeatInventory.objects.bulk_create([
+            SeatInventory(movie_show_id=show_id, date=date_show, seats_left=capacity[show_id] - count,
+                          seat_map=seating.first_taken(count))
+            for (show_id, date_show), count in sold.items()
+        ], batch_size=self.batch_size)
@@ -0,0 +1,22 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from app.booking import sweep_holds
+
+
+class Command(BaseCommand):
+    help = 'Release expired seat holds, once or every --interval seconds'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--interval', type=float, help='Keep sweeping with this many seconds between runs')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        while True:
+            released = sweep_holds(batch_size=options['batch_size'])
+            if released or not options['interval']:
+                self.stdout.write(f'Released {released} expired holds')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
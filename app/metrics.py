@@ -0,0 +1,190 @@
+"""
+Per-view request metrics in Prometheus text format.
+
+MetricsMiddleware times every request and counts the SQL it runs through
+an execute wrapper installed on every connection, then records latency, query count and SQL time
+in fixed-bucket histograms keyed by the resolved URL name. Recording is a
+few additions under a lock, cheap enough to stay on in production.
+
+The histograms live in the process, so every worker exposes its own at
+/metrics and Prometheus adds them up. The endpoint needs the
+settings.METRICS_TOKEN bearer token; without one it is only open with DEBUG. Streaming responses are timed until
+the response object is returned, not until the last byte is sent.
+"""
+import asyncio
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import partial
+
+from django.conf import settings
+from django.db import connections
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import HttpResponse, HttpResponseForbidden
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+QUERY_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 200)
+SQL_TIME_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+
+
+class Histogram:
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # the last one is +Inf
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def cumulative(self):
+        """(le, count) pairs as Prometheus expects them, every bucket counting the ones below it too."""
+        total = 0
+        for le, count in zip(self.buckets + ('+Inf',), self.counts):
+            total += count
+            yield le, total
+
+
+class Registry:
+    metrics = {
+        'cinema_request_duration_seconds': ('Request latency by view', LATENCY_BUCKETS),
+        'cinema_request_queries': ('SQL queries per request by view', QUERY_BUCKETS),
+        'cinema_request_sql_seconds': ('SQL time per request by view', SQL_TIME_BUCKETS),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+
+    def observe(self, view, duration, queries, sql_time):
+        with self._lock:
+            for name, value in zip(self.metrics, (duration, queries, sql_time)):
+                key = (name, view)
+                if key not in self._histograms:
+                    self._histograms[key] = Histogram(self.metrics[name][1])
+                self._histograms[key].observe(value)
+
+    def clear(self):
+        with self._lock:
+            self._histograms.clear()
+
+    def render(self):
+        with self._lock:
+            histograms = sorted(self._histograms.items())
+        lines = []
+        for name, (description, _) in self.metrics.items():
+            lines += [f'# HELP {name} {description}', f'# TYPE {name} histogram']
+            for (metric, view), histogram in histograms:
+                if metric != name:
+                    continue
+                label = f'view="{escape(view)}"'
+                lines += [f'{name}_bucket{{{label},le="{le}"}} {count}' for le, count in histogram.cumulative()]
+                lines += [f'{name}_sum{{{label}}} {round(histogram.sum, 6)}',
+                          f'{name}_count{{{label}}} {histogram.count}']
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+
+def escape(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class QueryTimer:
+    """Execute wrapper adding up the queries of one request and the time they take."""
+
+    def __init__(self):
+        self.queries = 0
+        self.time = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.time += time.perf_counter() - started
+            self.queries += 1
+
+
+_request_wrappers = ContextVar('request_wrappers', default=())
+
+
+def run_request_wrappers(execute, sql, params, many, context):
+    for wrapper in reversed(_request_wrappers.get()):
+        execute = partial(wrapper, execute)
+    return execute(sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_request_wrappers(sender, connection, **kwargs):
+    if run_request_wrappers not in connection.execute_wrappers:
+        connection.execute_wrappers.append(run_request_wrappers)
+
+
+for opened in connections.all():  # connected before this module was imported
+    install_request_wrappers(None, opened)
+
+
+@contextmanager
+def request_execute_wrapper(wrapper):
+    """
+    connection.execute_wrapper() for every connection the request uses.
+    Connections belong to threads, so the queries an async view makes
+    through sync_to_async run on another thread's connection; the wrapper
+    follows the request there in a context variable instead.
+    """
+    token = _request_wrappers.set(_request_wrappers.get() + (wrapper,))
+    try:
+        yield
+    finally:
+        _request_wrappers.reset(token)
+
+
+class MetricsMiddleware:
+    """Sync and async, so an ASGI request with async views stays on the event loop."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # what Django checks, as in MiddlewareMixin
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with request_execute_wrapper(timer):
+            response = self.get_response(request)
+        observe(request, started, timer)
+        return response
+
+    async def __acall__(self, request):
+        timer = QueryTimer()
+        started = time.perf_counter()
+        with request_execute_wrapper(timer):
+            response = await self.get_response(request)
+        observe(request, started, timer)
+        return response
+
+
+def observe(request, started, timer):
+    match = request.resolver_match
+    view = match.view_name if match and match.view_name else 'unresolved'
+    registry.observe(view, time.perf_counter() - started, timer.queries, timer.time)
+
+
+def metrics(request):
+    """The histograms for Prometheus, behind the settings.METRICS_TOKEN bearer token (open only with DEBUG)."""
+    token = getattr(settings, 'METRICS_TOKEN', None)
+    if not token and not settings.DEBUG or token and request.headers.get('Authorization') != f'Bearer {token}':
+        return HttpResponseForbidden()
+    return HttpResponse(registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,41 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:26
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_seat_inventory(apps, schema_editor):
+    PurchasedTicket = apps.get_model('app', 'PurchasedTicket')
+    SeatInventory = apps.get_model('app', 'SeatInventory')
+    sold = PurchasedTicket.objects.values('movie_show', 'date', 'movie_show__cinema_hall__number_of_seats') \
+        .annotate(sold=Sum('number_of_ticket'))
+    SeatInventory.objects.bulk_create([
+        SeatInventory(movie_show_id=row['movie_show'], date=row['date'],
+                      seats_left=max(row['movie_show__cinema_hall__number_of_seats'] - row['sold'], 0))
+        for row in sold.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0003_alter_movieshow_image'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SeatInventory',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('seats_left', models.PositiveIntegerField()),
+                ('movie_show', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='seat_inventory', to='app.movieshow')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='seatinventory',
+            constraint=models.UniqueConstraint(fields=('movie_show', 'date'), name='unique_seat_inventory'),
+        ),
+        migrations.RunPython(fill_seat_inventory, migrations.RunPython.noop),
+    ]
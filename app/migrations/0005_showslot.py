@@ -0,0 +1,85 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:28
+
+from datetime import datetime, timedelta
+
+from django.db import migrations, models
+from django.utils import timezone
+import django.db.models.deletion
+
+
+def show_intervals(start_date, finish_date, start_time, finish_time):
+    # a frozen copy of app.schedule.show_intervals as of this migration
+    crosses_midnight = finish_time <= start_time
+    last_day = finish_date - timedelta(days=1) if crosses_midnight else finish_date
+    day = start_date
+    while day <= last_day:
+        finish_day = day + timedelta(days=1) if crosses_midnight else day
+        yield (timezone.make_aware(datetime.combine(day, start_time)),
+               timezone.make_aware(datetime.combine(finish_day, finish_time)))
+        day += timedelta(days=1)
+
+
+def fill_show_slots(apps, schema_editor):
+    MovieShow = apps.get_model('app', 'MovieShow')
+    ShowSlot = apps.get_model('app', 'ShowSlot')
+    slots = []
+    for show in MovieShow.objects.iterator():
+        slots.extend(
+            ShowSlot(movie_show_id=show.pk, cinema_hall_id=show.cinema_hall_id, starts_at=start, ends_at=finish)
+            for start, finish in show_intervals(show.start_date, show.finish_date, show.start_time, show.finish_time))
+    ShowSlot.objects.bulk_create(slots, batch_size=1000)
+
+
+OVERLAPPING_SHOWS = """
+    SELECT DISTINCT LEAST(a.movie_show_id, b.movie_show_id), GREATEST(a.movie_show_id, b.movie_show_id)
+    FROM app_showslot a JOIN app_showslot b ON a.cinema_hall_id = b.cinema_hall_id
+        AND a.movie_show_id <> b.movie_show_id AND a.starts_at < b.ends_at AND b.starts_at < a.ends_at
+    ORDER BY 1, 2
+"""
+
+
+def add_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return  # на SQLite пересечения отсекает блокировка в app.schedule.lock_hall
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute(OVERLAPPING_SHOWS)
+        clashes = cursor.fetchall()
+    if clashes:
+        # the constraint would fail with a bare IntegrityError; the schedule has to be fixed by hand first
+        raise RuntimeError('Сеансы пересекаются в одном зале, измените или удалите их и повторите migrate: '
+                           + ', '.join(f'MovieShow {first} и {second}' for first, second in clashes))
+    schema_editor.execute('CREATE EXTENSION IF NOT EXISTS btree_gist')
+    schema_editor.execute(
+        'ALTER TABLE app_showslot ADD CONSTRAINT showslot_no_overlap EXCLUDE USING gist '
+        "(cinema_hall_id WITH =, tstzrange(starts_at, ends_at, '[)') WITH &&)")
+
+
+def drop_exclusion_constraint(apps, schema_editor):
+    if schema_editor.connection.vendor == 'postgresql':
+        schema_editor.execute('ALTER TABLE app_showslot DROP CONSTRAINT IF EXISTS showslot_no_overlap')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0004_seatinventory'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShowSlot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('starts_at', models.DateTimeField()),
+                ('ends_at', models.DateTimeField()),
+                ('cinema_hall', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='app.cinemahall')),
+                ('movie_show', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='slots', to='app.movieshow')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='showslot',
+            index=models.Index(fields=['cinema_hall', 'starts_at'], name='showslot_hall_starts_idx'),
+        ),
+        migrations.RunPython(fill_show_slots, migrations.RunPython.noop),
+        migrations.RunPython(add_exclusion_constraint, drop_exclusion_constraint),
+    ]
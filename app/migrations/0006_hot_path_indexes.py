@@ -0,0 +1,29 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:31
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0005_showslot'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='movieshow',
+            index=models.Index(fields=['start_date', 'finish_date'], name='movieshow_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='movieshow',
+            index=models.Index(fields=['cinema_hall', 'start_date', 'finish_date'], name='movieshow_hall_dates_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchasedticket',
+            index=models.Index(fields=['movie_show', 'date', 'number_of_ticket'], name='ticket_show_date_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='purchasedticket',
+            index=models.Index(fields=['user', 'date', 'id'], name='ticket_user_date_idx'),
+        ),
+    ]
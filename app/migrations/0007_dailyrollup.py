@@ -0,0 +1,50 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:37
+
+from django.db import migrations, models
+from django.db.models import Sum
+import django.db.models.deletion
+
+
+def fill_daily_rollups(apps, schema_editor):
+    PurchasedTicket = apps.get_model('app', 'PurchasedTicket')
+    DailyRollup = apps.get_model('app', 'DailyRollup')
+    sold = PurchasedTicket.objects.values('date', 'movie_show', 'movie_show__cinema_hall', 'movie_show__ticket_price',
+                                          'movie_show__cinema_hall__number_of_seats') \
+        .annotate(tickets_sold=Sum('number_of_ticket'))
+    DailyRollup.objects.bulk_create([
+        DailyRollup(date=row['date'], movie_show_id=row['movie_show'], cinema_hall_id=row['movie_show__cinema_hall'],
+                    tickets_sold=row['tickets_sold'], revenue=row['tickets_sold'] * row['movie_show__ticket_price'],
+                    seat_capacity=row['movie_show__cinema_hall__number_of_seats'])
+        for row in sold.iterator()
+    ], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0006_hot_path_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('tickets_sold', models.PositiveIntegerField(default=0)),
+                ('revenue', models.PositiveBigIntegerField(default=0)),
+                ('seat_capacity', models.PositiveIntegerField()),
+                ('cinema_hall', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='app.cinemahall')),
+                ('movie_show', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rollups', to='app.movieshow')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='dailyrollup',
+            index=models.Index(fields=['date', 'cinema_hall'], name='rollup_date_hall_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='dailyrollup',
+            constraint=models.UniqueConstraint(fields=('movie_show', 'date'), name='unique_daily_rollup'),
+        ),
+        migrations.RunPython(fill_daily_rollups, migrations.RunPython.noop),
+    ]
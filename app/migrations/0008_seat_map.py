@@ -0,0 +1,45 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:43
+
+from django.db import migrations, models
+
+
+def first_taken(count):
+    # a frozen copy of app.seating.first_taken as of this migration
+    seat_map = bytearray(b'\xff' * (count // 8))
+    if count % 8:
+        seat_map.append((1 << count % 8) - 1)
+    return bytes(seat_map)
+
+
+def fill_seat_maps(apps, schema_editor):
+    SeatInventory = apps.get_model('app', 'SeatInventory')
+    inventory = list(SeatInventory.objects.select_related('movie_show__cinema_hall'))
+    for row in inventory:
+        row.seat_map = first_taken(max(row.movie_show.cinema_hall.number_of_seats - row.seats_left, 0))
+    SeatInventory.objects.bulk_update(inventory, ['seat_map'], batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0007_dailyrollup'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='cinemahall',
+            name='seats_per_row',
+            field=models.PositiveIntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='purchasedticket',
+            name='seats',
+            field=models.JSONField(blank=True, default=list),
+        ),
+        migrations.AddField(
+            model_name='seatinventory',
+            name='seat_map',
+            field=models.BinaryField(default=b''),
+        ),
+        migrations.RunPython(fill_seat_maps, migrations.RunPython.noop),
+    ]
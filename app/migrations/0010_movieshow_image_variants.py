@@ -0,0 +1,18 @@
+# Generated by Django 4.0.4 on 2026-10-18 04:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0009_seathold'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='movieshow',
+            name='image_variants',
+            field=models.JSONField(blank=True, default=dict, editable=False),
+        ),
+    ]
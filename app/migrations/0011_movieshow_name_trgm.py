@@ -0,0 +1,31 @@
+# Generated by Django 4.0.4 on 2026-10-18 06:12
+
+from django.db import migrations
+
+# Django 4.0 cannot declare an opclass index on an expression, and the
+# extension only exists on PostgreSQL; other databases search through
+# app.search.TitleIndex.
+CREATE_INDEX = [
+    'CREATE EXTENSION IF NOT EXISTS pg_trgm',
+    'CREATE INDEX IF NOT EXISTS movieshow_name_trgm_idx ON app_movieshow USING gin (UPPER(movie_name) gin_trgm_ops)',
+]
+DROP_INDEX = ['DROP INDEX IF EXISTS movieshow_name_trgm_idx']
+
+
+def run_on_postgresql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0010_movieshow_image_variants'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_INDEX), run_on_postgresql(DROP_INDEX)),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 4.0.4 on 2026-10-18 07:02
+
+from django.db import migrations
+
+# app.search compares titles with Ё folded into Е, so the index is built on
+# the same expression; see 0011 for why this is raw SQL.
+CREATE_INDEX = [
+    'DROP INDEX IF EXISTS movieshow_name_trgm_idx',
+    "CREATE INDEX IF NOT EXISTS movieshow_name_trgm_idx ON app_movieshow "
+    "USING gin (REPLACE(UPPER(movie_name), 'Ё', 'Е') gin_trgm_ops)",
+]
+DROP_INDEX = [
+    'DROP INDEX IF EXISTS movieshow_name_trgm_idx',
+    'CREATE INDEX IF NOT EXISTS movieshow_name_trgm_idx ON app_movieshow USING gin (UPPER(movie_name) gin_trgm_ops)',
+]
+
+
+def run_on_postgresql(statements):
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('app', '0012_tableversion'),
+    ]
+
+    operations = [
+        migrations.RunPython(run_on_postgresql(CREATE_INDEX), run_on_postgresql(DROP_INDEX)),
+    ]
@@ -1,8 +1,16 @@
+import math
+import random
+import time
 from datetime import date
 
 from django.contrib.auth.models import AbstractUser
-from django.db import models
-from django.db.models import Sum
+from django.db import IntegrityError, OperationalError, models, transaction
+from django.db.models import F, FilteredRelation, OuterRef, Q, Subquery, Sum, Value
+from django.db.models.functions import Coalesce, Greatest, TruncDate
+
+from app import seating
+
+RESERVE_ATTEMPTS = 20
 
 
 class CustomUser(AbstractUser):
@@ -12,17 +20,45 @@ class CustomUser(AbstractUser):
 class CinemaHall(models.Model):
     hall_name = models.CharField(max_length=200, unique=True)
     number_of_seats = models.PositiveIntegerField(default=20)
+    seats_per_row = models.PositiveIntegerField(null=True, blank=True)
 
     def __str__(self):
         return self.hall_name
 
+    def get_seats_per_row(self):
+        return min(self.seats_per_row or self.number_of_seats, self.number_of_seats) or 1
+
+    def get_rows(self):
+        return math.ceil(self.number_of_seats / self.get_seats_per_row())
+
+    def seat_index(self, row, seat):
+        """Position of the seat in the hall seat map; ValueError if the hall has no such seat."""
+        seats_per_row = self.get_seats_per_row()
+        index = (row - 1) * seats_per_row + seat - 1
+        if row < 1 or not 1 <= seat <= seats_per_row or index >= self.number_of_seats:
+            raise ValueError(f'No seat {seat} in row {row}')
+        return index
+
+    def seat_label(self, index):
+        return {'row': index // self.get_seats_per_row() + 1, 'seat': index % self.get_seats_per_row() + 1}
+
     def get_tickets(self):
         movie_shows_id = MovieShow.objects.filter(cinema_hall=self).values_list('id', flat=True)
         return PurchasedTicket.objects.filter(movie_show__in=movie_shows_id).first()
 
 
+class MovieShowQuerySet(models.QuerySet):
+
+    def with_tickets_left(self, date_show):
+        """Annotate every show with `tickets_left` for the date in the same query."""
+        seats_left = SeatInventory.objects.filter(movie_show=OuterRef('pk'), date=date_show).values('seats_left')[:1]
+        return self.select_related('cinema_hall').annotate(
+            tickets_left=Coalesce(Subquery(seats_left), F('cinema_hall__number_of_seats')))
+
+
 class MovieShow(models.Model):
     image = models.ImageField(upload_to='images/', null=True, blank=True)
+    image_variants = models.JSONField(default=dict, blank=True, editable=False)  # see app.images
     movie_name = models.CharField(max_length=120)
     ticket_price = models.PositiveIntegerField(default=100)
     start_time = models.TimeField()
@@ -31,16 +67,35 @@ class MovieShow(models.Model):
     finish_date = models.DateField()
     cinema_hall = models.ForeignKey(CinemaHall, on_delete=models.CASCADE, related_name='movie_show')
 
+    objects = MovieShowQuerySet.as_manager()
+
+    SCHEDULE_FIELDS = ('start_time', 'finish_time', 'start_date', 'finish_date', 'cinema_hall')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['start_date', 'finish_date'], name='movieshow_dates_idx'),
+            models.Index(fields=['cinema_hall', 'start_date', 'finish_date'], name='movieshow_hall_dates_idx'),
+        ]
+
+    def save(self, *args, **kwargs):
+        from app import schedule
+
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and not set(update_fields) & set(self.SCHEDULE_FIELDS):
+            return super().save(*args, **kwargs)
+        with transaction.atomic():
+            schedule.check_free(self)
+            super().save(*args, **kwargs)
+            schedule.sync_slots(self)
+
     def get_purchased(self):
         return self.purchased_tickets.filter().first()
 
-    def get_tickets_count(self, date_today=date.today()):
-        if self.purchased_tickets.filter(date=date_today).aggregate(Sum('number_of_ticket')).get(
-                'number_of_ticket__sum'):
-            return self.cinema_hall.number_of_seats - self.purchased_tickets.filter(date=date_today) \
-                .aggregate(Sum('number_of_ticket')).get('number_of_ticket__sum')
-        return self.cinema_hall.number_of_seats
-
+    def get_tickets_count(self, date_today=None):
+        seats_left = SeatInventory.objects.get_seats_left(self, date_today or date.today())
+        if seats_left is None:
+            return self.cinema_hall.number_of_seats
+        return seats_left
 
     def __str__(self):
         return self.movie_name
@@ -51,6 +106,279 @@ class PurchasedTicket(models.Model):
     number_of_ticket = models.PositiveIntegerField(default=1)
     movie_show = models.ForeignKey(MovieShow, on_delete=models.DO_NOTHING, related_name='purchased_tickets')
     user = models.ForeignKey(CustomUser, on_delete=models.DO_NOTHING, related_name='user')
+    seats = models.JSONField(default=list, blank=True)  # [{'row': 1, 'seat': 2}, ...]
+
+    class Meta:
+        indexes = [
+            # number_of_ticket makes the availability and rollup sums index-only
+            models.Index(fields=['movie_show', 'date', 'number_of_ticket'], name='ticket_show_date_idx'),
+            models.Index(fields=['user', 'date', 'id'], name='ticket_user_date_idx'),
+        ]
 
     def get_purchase_amount(self):
         return self.number_of_ticket * self.movie_show.ticket_price
+
+
+class ShowSlot(models.Model):
+    """One session of a show in absolute time, maintained by app.schedule."""
+    movie_show = models.ForeignKey(MovieShow, on_delete=models.CASCADE, related_name='slots')
+    cinema_hall = models.ForeignKey(CinemaHall, on_delete=models.CASCADE, related_name='slots')
+    starts_at = models.DateTimeField()
+    ends_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['cinema_hall', 'starts_at'], name='showslot_hall_starts_idx'),
+        ]
+
+
+class SeatInventoryManager(models.Manager):
+
+    def get_seats_left(self, movie_show, date_show):
+        """Remaining seats for the show on the date, or None while nothing was sold."""
+        return self.filter(movie_show=movie_show, date=date_show).values_list('seats_left', flat=True).first()
+
+    def get_seats_left_many(self, keys):
+        """{(movie_show_id, date): remaining seats} for several shows and dates, with one query."""
+        keys = set(keys)
+        rows = MovieShow.objects.filter(pk__in={movie_show_id for movie_show_id, _ in keys}).annotate(
+            inventory=FilteredRelation('seat_inventory', condition=Q(seat_inventory__date__in={
+                date_show for _, date_show in keys}))
+        ).values_list('pk', 'cinema_hall__number_of_seats', 'inventory__date', 'inventory__seats_left')
+        capacity, seats_left = {}, {}
+        for movie_show_id, number_of_seats, date_show, left in rows:
+            capacity[movie_show_id] = number_of_seats
+            if date_show is not None:
+                seats_left[movie_show_id, date_show] = left
+        return {key: seats_left.get(key, capacity.get(key[0], 0)) for key in keys}
+
+    def refresh_tickets_left(self, movie_shows, date_show):
+        """Set `tickets_left` on already loaded shows with one query."""
+        seats_left = dict(self.filter(movie_show__in=movie_shows, date=date_show)
+                          .values_list('movie_show_id', 'seats_left'))
+        for movie_show in movie_shows:
+            movie_show.tickets_left = seats_left.get(movie_show.pk, movie_show.cinema_hall.number_of_seats)
+
+    def get_or_create_for(self, movie_show, date_show):
+        """
+        Lazily create the inventory row, starting from the hall capacity minus
+        the tickets sold before the row existed.
+        """
+        try:
+            return self.get(movie_show=movie_show, date=date_show)
+        except self.model.DoesNotExist:
+            pass
+        sold = movie_show.purchased_tickets.filter(date=date_show).aggregate(
+            Sum('number_of_ticket')).get('number_of_ticket__sum') or 0
+        sold = min(sold, movie_show.cinema_hall.number_of_seats)
+        try:
+            with transaction.atomic():
+                return self.create(movie_show=movie_show, date=date_show,
+                                   seats_left=movie_show.cinema_hall.number_of_seats - sold,
+                                   seat_map=seating.first_taken(sold))
+        except IntegrityError:  # создана параллельным запросом
+            return self.get(movie_show=movie_show, date=date_show)
+
+    def reserve(self, movie_show, date_show, number_of_ticket, seats=()):
+        """
+        Take seats with one conditional UPDATE of the counter, which also locks
+        the row, then mark the requested seat indexes and the first free ones
+        in the seat map. Returns the taken seat indexes, or None when there
+        are not enough seats left or a requested seat is already taken.
+
+        SQLite refuses a competing write with "database table is locked"
+        instead of waiting; the reservation is retried a few times before
+        the OperationalError is let through.
+        """
+        for attempt in range(RESERVE_ATTEMPTS):
+            try:
+                with transaction.atomic():  # a savepoint inside checkout(), so a failed attempt leaves no trace
+                    inventory = self.get_or_create_for(movie_show, date_show)
+                    rows = self.filter(pk=inventory.pk)
+                    if not rows.filter(seats_left__gte=number_of_ticket).update(
+                            seats_left=F('seats_left') - number_of_ticket):
+                        return None
+                    seat_map, taken = seating.take(bytes(rows.values_list('seat_map', flat=True).get()),
+                                                   movie_show.cinema_hall.number_of_seats, number_of_ticket, seats)
+                    rows.update(seat_map=seat_map)
+                    return taken
+            except seating.SeatTaken:
+                return None
+            except OperationalError:
+                if attempt == RESERVE_ATTEMPTS - 1:
+                    raise
+                time.sleep(random.random() * 0.01 * (attempt + 1))
+
+    def release(self, movie_show, date_show, seats):
+        """Give the seat indexes back: the counter first, which locks the row, then the seat map."""
+        rows = self.filter(movie_show=movie_show, date=date_show)
+        with transaction.atomic():
+            rows.update(seats_left=F('seats_left') + len(seats))
+            seat_map = rows.values_list('seat_map', flat=True).first()
+            if seat_map is not None:
+                rows.update(seat_map=seating.release(bytes(seat_map), seats))
+
+
+class SeatInventory(models.Model):
+    movie_show = models.ForeignKey(MovieShow, on_delete=models.CASCADE, related_name='seat_inventory')
+    date = models.DateField()
+    seats_left = models.PositiveIntegerField()
+    seat_map = models.BinaryField(default=b'')
+
+    objects = SeatInventoryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['movie_show', 'date'], name='unique_seat_inventory'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_show} {self.date}: {self.seats_left}'
+
+
+class SeatHold(models.Model):
+    """Seats taken from SeatInventory for a customer until `expires_at`, see app.booking."""
+    user = models.ForeignKey(CustomUser, on_delete=models.CASCADE, related_name='seat_holds')
+    movie_show = models.ForeignKey(MovieShow, on_delete=models.CASCADE, related_name='seat_holds')
+    date = models.DateField()
+    number_of_ticket = models.PositiveIntegerField()
+    seats = models.JSONField(default=list)  # [{'row': 1, 'seat': 2}, ...]
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at'], name='seathold_expires_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_show} {self.date}: {self.number_of_ticket} until {self.expires_at}'
+
+
+class DailyRollupQuerySet(models.QuerySet):
+
+    def between(self, date_from=None, date_to=None, cinema_hall=None):
+        rollups = self
+        if date_from:
+            rollups = rollups.filter(date__gte=date_from)
+        if date_to:
+            rollups = rollups.filter(date__lte=date_to)
+        if cinema_hall:
+            rollups = rollups.filter(cinema_hall=cinema_hall)
+        return rollups
+
+    def totals(self, *group_by):
+        """Tickets sold, revenue and seat capacity summed per `group_by` values."""
+        return self.values(*group_by).order_by(*group_by).annotate(
+            tickets_sold=Sum('tickets_sold'), revenue=Sum('revenue'), seat_capacity=Sum('seat_capacity'))
+
+
+class DailyRollupManager(models.Manager.from_queryset(DailyRollupQuerySet)):
+
+    def record(self, movie_show, date_show, number_of_ticket):
+        """Add a sale to the (date, show) rollup with an atomic increment, creating the row on first sale."""
+        revenue = number_of_ticket * movie_show.ticket_price
+        increment = {'tickets_sold': F('tickets_sold') + number_of_ticket, 'revenue': F('revenue') + revenue}
+        if self.filter(movie_show=movie_show, date=date_show).update(**increment):
+            return
+        try:
+            with transaction.atomic():
+                self.create(movie_show=movie_show, cinema_hall_id=movie_show.cinema_hall_id, date=date_show,
+                            tickets_sold=number_of_ticket, revenue=revenue,
+                            seat_capacity=movie_show.cinema_hall.number_of_seats)
+        except IntegrityError:  # создана параллельным запросом
+            self.filter(movie_show=movie_show, date=date_show).update(**increment)
+
+    def report(self, group_by, date_from=None, date_to=None, cinema_hall=None):
+        """
+        Tickets sold, revenue and seat capacity per `group_by` values. Sales
+        come from the rollups, which only exist for sessions that sold a
+        ticket; the capacity is summed over every scheduled session (ShowSlot)
+        of the period, so unsold sessions lower the occupancy too.
+        """
+        totals = {tuple(row[key] for key in group_by): row
+                  for row in self.between(date_from, date_to, cinema_hall).totals(*group_by)}
+        slots = ShowSlot.objects.annotate(date=TruncDate('starts_at'))
+        if date_from:
+            slots = slots.filter(date__gte=date_from)
+        if date_to:
+            slots = slots.filter(date__lte=date_to)
+        if cinema_hall:
+            slots = slots.filter(cinema_hall=cinema_hall)
+        for row in slots.values(*group_by).order_by(*group_by) \
+                .annotate(seat_capacity=Sum('cinema_hall__number_of_seats')):
+            key = tuple(row[name] for name in group_by)
+            totals.setdefault(key, dict(row, tickets_sold=0, revenue=0))['seat_capacity'] = row['seat_capacity']
+        return [totals[key] for key in sorted(totals)]
+
+    def rebuild(self, date_from=None, date_to=None):
+        """Recompute the rollups of the date range from PurchasedTicket. Returns the number of rows."""
+        tickets = PurchasedTicket.objects.all()
+        if date_from:
+            tickets = tickets.filter(date__gte=date_from)
+        if date_to:
+            tickets = tickets.filter(date__lte=date_to)
+        sold = tickets.values('date', 'movie_show', 'movie_show__cinema_hall', 'movie_show__ticket_price',
+                              'movie_show__cinema_hall__number_of_seats').order_by() \
+            .annotate(tickets_sold=Sum('number_of_ticket'))
+        with transaction.atomic():
+            self.between(date_from, date_to).delete()
+            rollups = self.bulk_create([
+                self.model(date=row['date'], movie_show_id=row['movie_show'],
+                           cinema_hall_id=row['movie_show__cinema_hall'], tickets_sold=row['tickets_sold'],
+                           revenue=row['tickets_sold'] * row['movie_show__ticket_price'],
+                           seat_capacity=row['movie_show__cinema_hall__number_of_seats'])
+                for row in sold.iterator()
+            ], batch_size=1000)
+        return len(rollups)
+
+
+class DailyRollup(models.Model):
+    """Sales of a show on a date, kept up to date on every purchase by DailyRollup.objects.record()."""
+    date = models.DateField()
+    cinema_hall = models.ForeignKey(CinemaHall, on_delete=models.CASCADE, related_name='rollups')
+    movie_show = models.ForeignKey(MovieShow, on_delete=models.CASCADE, related_name='rollups')
+    tickets_sold = models.PositiveIntegerField(default=0)
+    revenue = models.PositiveBigIntegerField(default=0)
+    seat_capacity = models.PositiveIntegerField()
+
+    objects = DailyRollupManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['movie_show', 'date'], name='unique_daily_rollup'),
+        ]
+        indexes = [
+            models.Index(fields=['date', 'cinema_hall'], name='rollup_date_hall_idx'),
+        ]
+
+    def __str__(self):
+        return f'{self.movie_show} {self.date}: {self.tickets_sold}'
+
+
+class TableVersionManager(models.Manager):
+
+    def current(self, label):
+        """The version of a table, one primary key lookup; created from the clock when no write was recorded."""
+        version = self.filter(pk=label).values_list('version', flat=True).first()
+        if version is None:
+            self.bulk_create([self.model(table=label, version=time.time_ns())], ignore_conflicts=True)
+            version = self.filter(pk=label).values_list('version', flat=True).first()
+        return version
+
+    def touch(self, *labels):
+        """Move the versions to now, or one past the stored value if a worker's clock is behind."""
+        now = time.time_ns()
+        for label in labels:
+            if not self.filter(pk=label).update(version=Greatest(F('version') + 1, Value(now))):
+                self.bulk_create([self.model(table=label, version=now)], ignore_conflicts=True)
+
+
+class TableVersion(models.Model):
+    """Last write to a table in nanoseconds since the epoch, see app.cache.TableVersions."""
+    table = models.CharField(max_length=100, primary_key=True)  # model label, app.movieshow
+    version = models.BigIntegerField()
+
+    objects = TableVersionManager()
+
+    def __str__(self):
+        return f'{self.table}: {self.version}'
@@ -0,0 +1,168 @@
+"""
+Keyset (cursor) pagination on stable orderings such as (start_time, id).
+
+A page is fetched with `WHERE (key) > (last key) ORDER BY key LIMIT n + 1`,
+so page N costs the same as page 1 and there is no COUNT(*). Cursors are
+opaque url-safe tokens holding the direction and the boundary key.
+"""
+import base64
+import json
+
+from django.core.exceptions import ValidationError
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db.models import Q
+from django.http import Http404
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import replace_query_param
+
+NEXT, PREVIOUS = 'n', 'p'
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(direction, values):
+    payload = json.dumps([direction, values], cls=DjangoJSONEncoder, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        payload = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+        direction, values = json.loads(payload)
+    except (TypeError, ValueError) as error:
+        raise InvalidCursor(cursor) from error
+    if direction not in (NEXT, PREVIOUS) or not isinstance(values, list):
+        raise InvalidCursor(cursor)
+    return direction, values
+
+
+def reverse_ordering(ordering):
+    return [field[1:] if field.startswith('-') else f'-{field}' for field in ordering]
+
+
+def after_key(ordering, values):
+    """Q selecting the rows that come after `values` in `ordering`."""
+    condition = Q()
+    for position in reversed(range(len(ordering))):
+        field = ordering[position].lstrip('-')
+        lookup = 'lt' if ordering[position].startswith('-') else 'gt'
+        equal = Q(**{ordering[index].lstrip('-'): values[index] for index in range(position)})
+        condition |= equal & Q(**{f'{field}__{lookup}': values[position]})
+    return condition
+
+
+def row_key(obj, ordering):
+    return [getattr(obj, field.lstrip('-')) for field in ordering]
+
+
+class KeysetPage:
+    """Enough of django.core.paginator.Page for the templates, without a total count."""
+
+    def __init__(self, object_list, next_cursor=None, previous_cursor=None):
+        self.object_list = object_list
+        self.next_cursor = next_cursor
+        self.previous_cursor = previous_cursor
+
+    def __iter__(self):
+        return iter(self.object_list)
+
+    def __len__(self):
+        return len(self.object_list)
+
+    def has_next(self):
+        return self.next_cursor is not None
+
+    def has_previous(self):
+        return self.previous_cursor is not None
+
+    def has_other_pages(self):
+        return self.has_next() or self.has_previous()
+
+
+def paginate(queryset, ordering, page_size, cursor=None):
+    """Return the KeysetPage of `queryset` ordered by `ordering` (the last field must be unique)."""
+    direction, values = decode_cursor(cursor) if cursor else (NEXT, None)
+    if values is not None and len(values) != len(ordering):
+        raise InvalidCursor(cursor)
+    page_ordering = ordering if direction == NEXT else reverse_ordering(ordering)
+    queryset = queryset.order_by(*page_ordering)
+    if values is not None:
+        try:
+            queryset = queryset.filter(after_key(page_ordering, values))
+        except (TypeError, ValueError, ValidationError) as error:
+            raise InvalidCursor(cursor) from error
+    rows = list(queryset[:page_size + 1])
+    has_more = len(rows) > page_size
+    rows = rows[:page_size]
+    if direction == PREVIOUS:
+        rows.reverse()
+    if not rows:
+        return KeysetPage(rows)
+
+    has_next = has_more if direction == NEXT else True
+    has_previous = values is not None if direction == NEXT else has_more
+    return KeysetPage(
+        rows,
+        next_cursor=encode_cursor(NEXT, row_key(rows[-1], ordering)) if has_next else None,
+        previous_cursor=encode_cursor(PREVIOUS, row_key(rows[0], ordering)) if has_previous else None,
+    )
+
+
+class KeysetListMixin:
+    """Keyset pagination for ListView; get_ordering() must end with a unique field."""
+    cursor_kwarg = 'cursor'
+
+    def paginate_queryset(self, queryset, page_size):
+        try:
+            page = paginate(queryset, list(self.get_ordering()), page_size, self.request.GET.get(self.cursor_kwarg))
+        except InvalidCursor:
+            raise Http404('Invalid cursor')
+        return None, page, page.object_list, page.has_other_pages()
+
+
+class KeysetPagination(BasePagination):
+    """DRF pagination returning {'next', 'previous', 'results'} with opaque cursors."""
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'page_size'
+    page_size = 20
+    max_page_size = 100
+    ordering = ('id',)
+
+    def __init__(self, ordering=None):
+        if ordering is not None:
+            self.ordering = ordering
+
+    def get_ordering(self, request, view):
+        return getattr(view, 'keyset_ordering', None) or self.ordering
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params[self.page_size_query_param])
+        except (KeyError, ValueError):
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        try:
+            self.page = paginate(queryset, list(self.get_ordering(request, view)), self.get_page_size(request),
+                                 request.query_params.get(self.cursor_query_param))
+        except InvalidCursor:
+            raise NotFound('Invalid cursor')
+        return self.page.object_list
+
+    def get_link(self, cursor):
+        if cursor is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(), self.cursor_query_param, cursor)
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_link(self.page.next_cursor),
+            'previous': self.get_link(self.page.previous_cursor),
+            'results': data,
+        })
@@ -0,0 +1,151 @@
+"""
+On-demand cProfile of any view.
+
+ProfileMiddleware profiles a request when a staff user adds ?profile=1, or
+at random for settings.PROFILE_SAMPLE_RATE of all requests. The raw stats
+are written to settings.PROFILE_DIR for snakeviz or pstats. A staff request
+with the flag gets a summary page instead of the view's response: the top
+functions (?sort=cumulative|tottime|calls), every SQL query with its time
+and the time spent rendering templates.
+"""
+import asyncio
+import cProfile
+import os
+import pstats
+import random
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.http import HttpResponse
+from django.template.base import Template
+from django.template.loader import render_to_string
+
+from app.metrics import request_execute_wrapper
+
+SORT_KEYS = {'cumulative': 3, 'tottime': 2, 'calls': 1}  # index in a pstats entry
+TOP_FUNCTIONS = 40
+TEMPLATE_RENDER = (Template.render.__code__.co_filename, Template.render.__code__.co_firstlineno, 'render')
+
+
+class QueryLog:
+    """Execute wrapper keeping the SQL of the profiled request with its time."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({'sql': sql, 'time_ms': round((time.perf_counter() - started) * 1000, 2)})
+
+
+def summarize(profiler, sort='cumulative'):
+    stats = pstats.Stats(profiler)
+    index = SORT_KEYS.get(sort, SORT_KEYS['cumulative'])
+    entries = sorted(stats.stats.items(), key=lambda item: item[1][index], reverse=True)[:TOP_FUNCTIONS]
+    functions = [{'function': pstats.func_std_string(key), 'calls': calls, 'tottime_ms': round(tottime * 1000, 2),
+                  'cumulative_ms': round(cumulative * 1000, 2)}
+                 for key, (_, calls, tottime, cumulative, _) in entries]
+    # the cumulative time of the outermost Template.render covers included and extended templates
+    template_time = stats.stats.get(TEMPLATE_RENDER, (0, 0, 0, 0))[3]
+    return {'total_ms': round(stats.total_tt * 1000, 2), 'template_ms': round(template_time * 1000, 2),
+            'functions': functions}
+
+
+def dump(profiler, request):
+    directory = getattr(settings, 'PROFILE_DIR', os.path.join(settings.BASE_DIR, 'profiles'))
+    os.makedirs(directory, exist_ok=True)
+    view = request.resolver_match.view_name if request.resolver_match else 'unresolved'
+    path = os.path.join(directory, f"{time.strftime('%Y%m%d-%H%M%S')}-{view.replace(':', '-')}-"
+                                   f"{uuid.uuid4().hex[:8]}.prof")
+    profiler.dump_stats(path)
+    return path
+
+
+def may_be_staff(request):
+    """
+    False when the flag cannot come from a staff user: a session user who
+    is not staff, or an anonymous request without a bearer token. API
+    requests authenticate in the view (JWT), so for those staff is checked
+    once the response is ready.
+    """
+    if request.user.is_authenticated:
+        return request.user.is_staff
+    return 'Authorization' in request.headers
+
+
+class ProfileMiddleware:
+    """Sync and async; under ASGI the profile covers the event loop thread, not sync_to_async threads."""
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if asyncio.iscoroutinefunction(get_response):
+            self._is_coroutine = asyncio.coroutines._is_coroutine  # what Django checks, as in MiddlewareMixin
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+        requested = request.GET.get('profile') == '1' and may_be_staff(request)
+        sampled = random.random() < getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        if not requested and not sampled:
+            return self.get_response(request)
+
+        profiler = cProfile.Profile()
+        query_log = QueryLog()
+        with request_execute_wrapper(query_log):
+            try:
+                profiler.enable()
+            except ValueError:  # Python 3.12+ allows one profiler at a time in the process
+                return self.get_response(request)
+            try:
+                response = self.get_response(request)
+            finally:
+                profiler.disable()
+        show_summary = requested and request.user.is_staff
+        return finish(request, response, profiler, query_log, show_summary, sampled)
+
+    async def __acall__(self, request):
+        requested = request.GET.get('profile') == '1' and await sync_to_async(may_be_staff)(request)
+        sampled = random.random() < getattr(settings, 'PROFILE_SAMPLE_RATE', 0)
+        if not requested and not sampled:
+            return await self.get_response(request)
+
+        profiler = cProfile.Profile()
+        query_log = QueryLog()
+        with request_execute_wrapper(query_log):
+            try:
+                profiler.enable()
+            except ValueError:
+                return await self.get_response(request)
+            try:
+                response = await self.get_response(request)
+            finally:
+                profiler.disable()
+        show_summary = requested and await sync_to_async(lambda: request.user.is_staff)()
+        return await sync_to_async(finish)(request, response, profiler, query_log, show_summary, sampled)
+
+
+def finish(request, response, profiler, query_log, show_summary, sampled):
+    """Save the stats of a sampled or summarized request; the summary page replaces the response."""
+    if not show_summary and not sampled:
+        return response
+    path = dump(profiler, request)
+    if not show_summary:
+        return response
+
+    sort = request.GET.get('sort', 'cumulative')
+    sort_links = {}
+    for key in SORT_KEYS:
+        params = request.GET.copy()
+        params['sort'] = key
+        sort_links[key] = f'?{params.urlencode()}'
+    context = dict(summarize(profiler, sort), path=request.get_full_path(), status=response.status_code,
+                   sort=sort, sort_links=sort_links, stats_file=path, queries=query_log.queries,
+                   sql_ms=round(sum(query['time_ms'] for query in query_log.queries), 2))
+    return HttpResponse(render_to_string('profile.html', context, request=request))
@@ -0,0 +1,187 @@
+"""
+Hall scheduling: every show is normalised into the absolute datetime
+intervals it occupies its hall (one per day, crossing midnight when the
+finish time is not after the start time) and stored as ShowSlot rows.
+
+Overlaps are answered by an in-memory interval index built from the slots
+of one hall, and concurrent writers are serialised by locking the hall row.
+On PostgreSQL the slots table also carries a range exclusion constraint
+(see migration 0005), so a conflicting insert is rejected by the database.
+"""
+import bisect
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, connection, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from app.cache import schedule_cache, table_versions
+from app.models import CinemaHall, MovieShow, ShowSlot
+
+OVERLAP_MESSAGE = 'Сеансы в одном зале не могут накладываться друг на друга'
+HALL_NOT_FOUND_MESSAGE = 'Такого зала не существует'
+
+
+class ScheduleConflict(ValidationError):
+    pass
+
+
+def show_intervals(start_date, finish_date, start_time, finish_time):
+    """
+    Yield (starts_at, ends_at) for every session of a show. A session that
+    crosses midnight ends on the next day, so the last one starts the day
+    before `finish_date`.
+    """
+    crosses_midnight = finish_time <= start_time
+    last_day = finish_date - timedelta(days=1) if crosses_midnight else finish_date
+    day = start_date
+    while day <= last_day:
+        finish_day = day + timedelta(days=1) if crosses_midnight else day
+        yield (timezone.make_aware(datetime.combine(day, start_time)),
+               timezone.make_aware(datetime.combine(finish_day, finish_time)))
+        day += timedelta(days=1)
+
+
+class IntervalIndex:
+    """
+    Half-open intervals of one hall sorted by start. `overlapping` is a
+    binary search plus a walk back that stops as soon as the running maximum
+    of finishes is behind the queried start.
+    """
+
+    def __init__(self, intervals=()):
+        self._items = sorted(intervals, key=lambda item: item[0])
+        self._starts = [item[0] for item in self._items]
+        self._max_finish = None
+
+    def __len__(self):
+        return len(self._items)
+
+    def add(self, start, finish, key=None):
+        position = bisect.bisect_right(self._starts, start)
+        self._starts.insert(position, start)
+        self._items.insert(position, (start, finish, key))
+        self._max_finish = None
+
+    def overlapping(self, start, finish):
+        """Return the key of an interval overlapping [start, finish) or None."""
+        if self._max_finish is None:
+            self._max_finish = []
+            for item in self._items:
+                self._max_finish.append(max(item[1], self._max_finish[-1]) if self._max_finish else item[1])
+        position = bisect.bisect_left(self._starts, finish) - 1
+        while position >= 0 and self._max_finish[position] > start:
+            if self._items[position][1] > start:
+                return self._items[position][2]
+            position -= 1
+        return None
+
+
+def hall_index(cinema_hall, window_start, window_finish, exclude_id=None):
+    """Build the interval index of a hall from the slots touching the window, in one query."""
+    slots = ShowSlot.objects.filter(cinema_hall=cinema_hall, starts_at__lt=window_finish, ends_at__gt=window_start)
+    if exclude_id is not None:
+        slots = slots.exclude(movie_show=exclude_id)
+    return IntervalIndex(slots.values_list('starts_at', 'ends_at', 'movie_show_id'))
+
+
+def find_conflict(cinema_hall, start_date, finish_date, start_time, finish_time, exclude_id=None):
+    """Return the id of a show overlapping the given schedule in the hall, or None."""
+    intervals = list(show_intervals(start_date, finish_date, start_time, finish_time))
+    if not intervals:
+        return None
+    index = hall_index(cinema_hall, intervals[0][0], intervals[-1][1], exclude_id)
+    for start, finish in intervals:
+        conflict = index.overlapping(start, finish)
+        if conflict is not None:
+            return conflict
+    return None
+
+
+def lock_hall(cinema_hall_id):
+    """
+    Serialise schedule changes of one hall until the end of the transaction.
+    SQLite has no row locks, but its first write takes the database write
+    lock, so a no-op UPDATE gives the same guarantee there.
+    """
+    halls = CinemaHall.objects.filter(pk=cinema_hall_id)
+    if connection.features.has_select_for_update:
+        list(halls.select_for_update().values_list('pk', flat=True))
+    else:
+        halls.update(number_of_seats=F('number_of_seats'))
+
+
+def build_slots(movie_show):
+    return [
+        ShowSlot(movie_show=movie_show, cinema_hall_id=movie_show.cinema_hall_id, starts_at=start, ends_at=finish)
+        for start, finish in show_intervals(movie_show.start_date, movie_show.finish_date,
+                                            movie_show.start_time, movie_show.finish_time)
+    ]
+
+
+def save_slots(slots):
+    """Insert slots, turning an exclusion constraint violation into ScheduleConflict."""
+    try:
+        with transaction.atomic():
+            return ShowSlot.objects.bulk_create(slots, batch_size=1000)
+    except IntegrityError as error:
+        raise ScheduleConflict(OVERLAP_MESSAGE) from error
+
+
+def check_free(movie_show):
+    """Lock the hall and re-check overlaps; called by MovieShow.save inside its transaction."""
+    lock_hall(movie_show.cinema_hall_id)
+    if find_conflict(movie_show.cinema_hall_id, movie_show.start_date, movie_show.finish_date,
+                     movie_show.start_time, movie_show.finish_time, exclude_id=movie_show.pk) is not None:
+        raise ScheduleConflict(OVERLAP_MESSAGE)
+
+
+def sync_slots(movie_show):
+    ShowSlot.objects.filter(movie_show=movie_show).delete()
+    save_slots(build_slots(movie_show))
+
+
+def import_shows(rows):
+    """
+    Insert a batch of shows (dicts of MovieShow fields with `cinema_hall_id`)
+    in one transaction. Overlaps are checked against the batch itself and
+    against existing slots with one query per hall. Returns (shows, errors),
+    errors mapping the row number to a message; nothing is written if any
+    row is rejected.
+    """
+    errors = {}
+    sessions = defaultdict(list)
+    halls = CinemaHall.objects.in_bulk({row['cinema_hall_id'] for row in rows})
+    for number, row in enumerate(rows):
+        if row['cinema_hall_id'] not in halls:
+            errors[number] = HALL_NOT_FOUND_MESSAGE
+            continue
+        intervals = list(show_intervals(row['start_date'], row['finish_date'], row['start_time'], row['finish_time']))
+        if intervals:
+            sessions[row['cinema_hall_id']].append((number, intervals))
+
+    with transaction.atomic():
+        for hall_id in sorted(sessions):
+            lock_hall(hall_id)
+            hall_sessions = sessions[hall_id]
+            index = hall_index(hall_id, min(intervals[0][0] for _, intervals in hall_sessions),
+                               max(intervals[-1][1] for _, intervals in hall_sessions))
+            for number, intervals in hall_sessions:
+                conflicts = (index.overlapping(start, finish) for start, finish in intervals)
+                conflict = next((key for key in conflicts if key is not None), None)
+                if conflict is not None:
+                    errors[number] = f'{OVERLAP_MESSAGE} (строка {conflict[1]})' \
+                        if isinstance(conflict, tuple) else OVERLAP_MESSAGE
+                    continue
+                for start, finish in intervals:
+                    index.add(start, finish, key=('row', number))
+
+        if errors:
+            return [], errors
+        shows = MovieShow.objects.bulk_create([MovieShow(**row) for row in rows], batch_size=500)
+        save_slots([slot for show in shows for slot in build_slots(show)])
+    schedule_cache.invalidate()  # bulk_create does not send post_save
+    table_versions.touch(MovieShow)
+    return shows, errors
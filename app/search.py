@@ -0,0 +1,148 @@
+"""
+Movie title search for the search box typeahead.
+
+A title matches when it or one of its words starts with the query, or when
+it is similar to the query by trigrams (typos, missing letters). Results are
+the upcoming shows of the matching titles with their free seats on the next
+show date, prefix matches first.
+
+Both sides are compared with ё folded into е. On PostgreSQL the matching
+runs in the database on the pg_trgm GIN index of the folded UPPER(movie_name)
+(migration 0013), which serves both the LIKE prefix patterns and the %
+similarity operator. Other databases (SQLite in development and tests) use
+TitleIndex, an in-process trigram index of the distinct titles, rebuilt when
+the MovieShow table version in the database changes (see
+app.cache.table_versions); a search then costs the version lookup and one
+query for the shows.
+"""
+import threading
+from collections import defaultdict
+from datetime import date
+
+from django.db import connection
+from django.db.models import Case, F, IntegerField, OuterRef, Q, Value, When
+from django.db.models.functions import Greatest, Replace, Upper
+from django.db.models.lookups import Contains, StartsWith
+
+from app.cache import table_versions
+from app.models import MovieShow
+
+MIN_SIMILARITY = 0.3  # pg_trgm similarity_threshold default
+
+
+def normalize(text):
+    return ' '.join(text.lower().replace('ё', 'е').split())
+
+
+def trigrams(text):
+    """Trigrams the way pg_trgm builds them: every word padded with two spaces in front and one behind."""
+    grams = set()
+    for word in normalize(text).split():
+        padded = f'  {word} '
+        grams.update(padded[start:start + 3] for start in range(len(padded) - 2))
+    return grams
+
+
+def similarity(grams, other):
+    return len(grams & other) / len(grams | other) if grams or other else 0.0
+
+
+def is_prefix(query, title):
+    return title.startswith(query) or f' {query}' in title
+
+
+class TitleIndex:
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.version = None
+        self.titles = {}  # normalized title -> (trigrams, movie_name spellings)
+        self.postings = defaultdict(set)  # trigram -> normalized titles
+
+    def refresh(self):
+        version = table_versions.get(MovieShow)
+        with self._lock:
+            if version == self.version:
+                return
+            titles, postings = {}, defaultdict(set)
+            for movie_name in MovieShow.objects.values_list('movie_name', flat=True).distinct():
+                title = normalize(movie_name)
+                if title not in titles:
+                    titles[title] = (trigrams(title), set())
+                    for gram in titles[title][0]:
+                        postings[gram].add(title)
+                titles[title][1].add(movie_name)
+            self.titles, self.postings, self.version = titles, postings, version
+
+    def clear(self):
+        with self._lock:
+            self.version = None
+
+    def match(self, query):
+        """[(rank, movie_name)] of the matching spellings, best first."""
+        self.refresh()
+        query, grams = normalize(query), trigrams(query)
+        titles, postings = self.titles, self.postings
+        candidates = set().union(*(postings.get(gram, ()) for gram in grams))
+        ranked = []
+        for title in candidates:
+            score = similarity(grams, titles[title][0])
+            if is_prefix(query, title):
+                ranked.append((0, -score, title))
+            elif score >= MIN_SIMILARITY:
+                ranked.append((1, -score, title))
+        ranked.sort()
+        return [(number, movie_name) for number, (_, _, title) in enumerate(ranked)
+                for movie_name in sorted(titles[title][1])]
+
+
+title_index = TitleIndex()
+
+
+def upcoming_shows():
+    today = date.today()
+    return MovieShow.objects.filter(finish_date__gte=today) \
+        .annotate(next_date=Greatest(F('start_date'), Value(today))) \
+        .with_tickets_left(Greatest(OuterRef('start_date'), Value(today)))
+
+
+def search_shows(query, limit=10):
+    """Upcoming shows whose title matches the query, each with next_date and tickets_left."""
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        prefix, match = postgresql_match(query)
+        return list(upcoming_shows().filter(match).annotate(
+            prefix_rank=Case(When(prefix, then=Value(0)), default=Value(1), output_field=IntegerField()),
+            similarity=TrigramSimilarity(postgresql_title(), postgresql_query(query)),
+        ).order_by('prefix_rank', '-similarity', 'next_date', 'start_time', 'id')[:limit])
+    ranks = {movie_name: rank for rank, movie_name in title_index.match(query)}
+    if not ranks:
+        return []
+    shows = upcoming_shows().filter(movie_name__in=ranks)
+    return sorted(shows, key=lambda show: (ranks[show.movie_name], show.next_date, show.start_time, show.pk))[:limit]
+
+
+def filter_shows(queryset, query):
+    """The shows of a MovieShow queryset with a matching title, without running a query yet."""
+    if connection.vendor == 'postgresql':
+        return queryset.filter(postgresql_match(query)[1])
+    return queryset.filter(movie_name__in=[movie_name for _, movie_name in title_index.match(query)])
+
+
+def postgresql_title():
+    """The indexed expression of migration 0013: upper case title with Ё folded into Е."""
+    return Replace(Upper('movie_name'), Value('Ё'), Value('Е'))
+
+
+def postgresql_query(query):
+    return query.upper().replace('Ё', 'Е')
+
+
+def postgresql_match(query):
+    """(prefix condition, prefix or similar condition), both served by the trigram index."""
+    from django.contrib.postgres.lookups import TrigramSimilar
+
+    title, query = postgresql_title(), postgresql_query(query)
+    prefix = Q(StartsWith(title, Value(query))) | Q(Contains(title, Value(f' {query}')))
+    return prefix, prefix | Q(TrigramSimilar(title, Value(query)))
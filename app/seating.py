@@ -0,0 +1,67 @@
+"""
+Seat maps as bitsets: bit i of a (show, date) map is set when seat i of the
+hall is taken, seats numbered row by row from 0. A 300 seat hall fits in
+38 bytes, so the whole hall is read and written as one small value.
+"""
+FREE, TAKEN = '.', 'X'
+
+
+class SeatTaken(Exception):
+    pass
+
+
+def is_taken(seat_map, index):
+    return index // 8 < len(seat_map) and bool(seat_map[index // 8] & (1 << index % 8))
+
+
+def first_taken(count):
+    """Map with the first `count` seats taken (tickets sold before seats were assigned)."""
+    seat_map = bytearray(b'\xff' * (count // 8))
+    if count % 8:
+        seat_map.append((1 << count % 8) - 1)
+    return bytes(seat_map)
+
+
+def take(seat_map, capacity, number_of_ticket, seats=()):
+    """
+    Take the requested seat indexes plus the first free ones up to
+    `number_of_ticket`. Returns the new map and the taken indexes, requested
+    seats first; raises SeatTaken if a requested seat is not free.
+    """
+    seat_map = bytearray(seat_map)
+    seat_map.extend(bytes((capacity + 7) // 8 - len(seat_map)))
+    taken = []
+    for index in seats:
+        if not 0 <= index < capacity or is_taken(seat_map, index):
+            raise SeatTaken(index)
+        seat_map[index // 8] |= 1 << index % 8
+        taken.append(index)
+    for byte in range(len(seat_map)):
+        if len(taken) == number_of_ticket:
+            break
+        if seat_map[byte] == 0xff:
+            continue
+        for index in range(byte * 8, min(byte * 8 + 8, capacity)):
+            if len(taken) == number_of_ticket:
+                break
+            if not is_taken(seat_map, index):
+                seat_map[byte] |= 1 << index % 8
+                taken.append(index)
+    if len(taken) < number_of_ticket:
+        raise SeatTaken(None)
+    return bytes(seat_map), taken
+
+
+def release(seat_map, seats):
+    """Free the seat indexes."""
+    seat_map = bytearray(seat_map)
+    for index in seats:
+        if index // 8 < len(seat_map):
+            seat_map[index // 8] &= ~(1 << index % 8) & 0xff
+    return bytes(seat_map)
+
+
+def render_rows(seat_map, capacity, seats_per_row):
+    """The map as one string per row, FREE or TAKEN for each seat."""
+    seats = ''.join(TAKEN if is_taken(seat_map, index) else FREE for index in range(capacity))
+    return [seats[start:start + seats_per_row] for start in range(0, capacity, seats_per_row)]
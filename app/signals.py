@@ -0,0 +1,39 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from app import images, live
+from app.cache import schedule_cache, table_versions
+from app.models import CinemaHall, MovieShow, PurchasedTicket, SeatHold
+from app.tokens import blacklist_cache
+
+
+@receiver([post_save, post_delete], sender=MovieShow)
+@receiver([post_save, post_delete], sender=CinemaHall)
+def invalidate_schedule_cache(sender, **kwargs):
+    # again after commit: a reader may have cached the old rows in between
+    schedule_cache.invalidate()
+    transaction.on_commit(schedule_cache.invalidate)
+    # after commit only, the version row is not kept locked by the writing transaction
+    transaction.on_commit(partial(table_versions.touch, sender))
+
+
+@receiver(post_save, sender=PurchasedTicket)
+@receiver([post_save, post_delete], sender=SeatHold)
+def publish_seat_change(sender, instance, **kwargs):
+    transaction.on_commit(partial(live.publish_seats, instance.movie_show_id, instance.date))
+
+
+@receiver(post_save, sender=MovieShow)
+def build_image_variants(sender, instance, raw=False, **kwargs):
+    if not raw and images.is_stale(instance):
+        transaction.on_commit(partial(images.schedule, instance))
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def remember_blacklisted_token(sender, instance, created, **kwargs):
+    if created:
+        transaction.on_commit(partial(blacklist_cache.add, instance.token.jti))
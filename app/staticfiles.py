@@ -0,0 +1,117 @@
+"""
+Fingerprinted, precompressed static files.
+
+collectstatic with CompressedManifestStaticFilesStorage writes content
+hashed copies of every file (css/style.css -> css/style.1d2c3b4a5e6f.css)
+and next to each hashed copy a .gz and, when the brotli package is
+installed, a .br sibling, kept only if smaller than the original.
+
+`serve_static` serves STATIC_ROOT when Django serves static files itself:
+the smallest precompressed variant accepted by the client, and for hashed
+names a year of `immutable` caching, since their content never changes
+under the same name.
+"""
+import gzip
+import mimetypes
+import os
+import posixpath
+
+from django.conf import settings
+from django.contrib.staticfiles.storage import ManifestStaticFilesStorage, staticfiles_storage
+from django.core.exceptions import SuspiciousFileOperation
+from django.http import FileResponse, Http404, HttpResponseNotModified
+from django.utils._os import safe_join
+from django.utils.http import http_date
+from django.views.static import was_modified_since
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+ENCODINGS = (('br', '.br'), ('gzip', '.gz'))  # preferred first
+SKIP_EXTENSIONS = {'.br', '.gz', '.png', '.jpg', '.jpeg', '.gif', '.webp', '.woff', '.woff2', '.zip'}
+IMMUTABLE = 'public, max-age=31536000, immutable'
+REVALIDATE = 'public, max-age=0, must-revalidate'
+
+
+def compress(content):
+    """{extension: compressed bytes} for the encodings that make the content smaller."""
+    variants = {'.gz': gzip.compress(content, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants['.br'] = brotli.compress(content, quality=11)
+    return {extension: data for extension, data in variants.items() if len(data) < len(content)}
+
+
+class CompressedManifestStaticFilesStorage(ManifestStaticFilesStorage):
+
+    def post_process(self, paths, dry_run=False, **options):
+        hashed_names = set()
+        for name, hashed_name, processed in super().post_process(paths, dry_run, **options):
+            if hashed_name and not isinstance(processed, Exception):
+                hashed_names.add(hashed_name)
+            yield name, hashed_name, processed
+        if dry_run:
+            return
+        for hashed_name in sorted(hashed_names):
+            if posixpath.splitext(hashed_name)[1].lower() in SKIP_EXTENSIONS:
+                continue
+            with self.open(hashed_name) as file:
+                variants = compress(file.read())
+            for extension, data in variants.items():
+                with open(self.path(hashed_name + extension), 'wb') as file:
+                    file.write(data)
+
+
+def accepted_encodings(header):
+    """Content codings of an Accept-Encoding header, without the ones refused with q=0."""
+    encodings = set()
+    for part in header.split(','):
+        coding, _, params = part.partition(';')
+        name, _, quality = params.partition('=')
+        try:
+            if name.strip() == 'q' and float(quality) == 0:
+                continue
+        except ValueError:
+            pass
+        encodings.add(coding.strip().lower())
+    return encodings
+
+
+_hashed_names = {}
+
+
+def is_hashed(path):
+    """Whether the path is a fingerprinted name from the manifest (read once per process)."""
+    hashed_files = getattr(staticfiles_storage, 'hashed_files', None) or {}
+    if _hashed_names.get('source') is not hashed_files:
+        _hashed_names.update(source=hashed_files, names=frozenset(hashed_files.values()))
+    return path in _hashed_names['names']
+
+
+def serve_static(request, path):
+    try:
+        full_path = safe_join(settings.STATIC_ROOT, path)
+    except SuspiciousFileOperation:
+        raise Http404
+    if not os.path.isfile(full_path) or posixpath.splitext(path)[1] in ('.br', '.gz'):
+        raise Http404
+    modified = os.stat(full_path).st_mtime
+    if not was_modified_since(request.headers.get('If-Modified-Since'), modified):
+        return HttpResponseNotModified()
+
+    content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+    encodings = accepted_encodings(request.headers.get('Accept-Encoding', ''))
+    encoding, file_path = None, full_path
+    for coding, extension in ENCODINGS:
+        if coding in encodings and os.path.isfile(full_path + extension):
+            encoding, file_path = coding, full_path + extension
+            break
+
+    response = FileResponse(open(file_path, 'rb'), content_type=content_type, filename=posixpath.basename(path))
+    response['Last-Modified'] = http_date(modified)
+    if encoding:
+        response['Content-Encoding'] = encoding
+    response['Vary'] = 'Accept-Encoding'
+    response['Cache-Control'] = IMMUTABLE if is_hashed(path) else REVALIDATE
+    return response
@@ -1,4 +1,5 @@
 from django import template
+from django.core.files.storage import default_storage
 # from app.models import *
 
 
@@ -7,5 +8,22 @@ register = template.Library()
 
 @register.simple_tag
 def call_method_get_tickets_count(obj, method_name, date_today):
+    if hasattr(obj, 'tickets_left'):  # посчитано в MovieShow.objects.with_tickets_left
+        return obj.tickets_left
     method = getattr(obj, method_name)
     return method(date_today)
+
+
+@register.simple_tag
+def image_srcset(obj, extension):
+    """`url 320w, url 640w, ...` of the resized poster variants in the format."""
+    return ', '.join(f'{default_storage.url(name)} {width}w' for width, name in obj.image_variants.get(extension, ()))
+
+
+@register.simple_tag
+def image_fallback_url(obj, width=640):
+    """The JPEG variant closest to `width`, or the original image while there are no variants."""
+    variants = obj.image_variants.get('jpeg')
+    if not variants:
+        return obj.image.url
+    return default_storage.url(min(variants, key=lambda variant: abs(variant[0] - width))[1])
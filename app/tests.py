@@ -1,3 +1,1262 @@
-from django.test import TestCase
+import asyncio
+import gzip
+import io
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+import threading
+from datetime import date, time, timedelta
+from time import sleep
+from unittest import skipUnless
 
-# Create your tests here.
+from asgiref.sync import async_to_sync, sync_to_async
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.staticfiles.storage import staticfiles_storage
+from django.core.cache import cache
+from django.core.handlers.asgi import ASGIHandler
+from django.core.files.storage import default_storage
+from django.core.management import CommandError, call_command
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import OperationalError, connection
+from django.db.models import Sum
+from django.http import Http404, HttpResponse
+from django.template import Context, Template
+from django.test import AsyncClient, Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from PIL import Image
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken, OutstandingToken
+from rest_framework_simplejwt.tokens import AccessToken
+
+from app import images, live, metrics, seating
+from app.api.serializers import MovieShowSerializer, import_schedule
+from app.booking import NotEnoughSeats, add_spend, checkout, sweep_holds
+from app.cache import schedule_cache, table_versions
+from app.models import CinemaHall, CustomUser, DailyRollup, MovieShow, PurchasedTicket, SeatHold, SeatInventory, \
+    ShowSlot, TableVersion
+from app.pagination import paginate
+from app.profiling import ProfileMiddleware
+from app.schedule import ScheduleConflict, build_slots, find_conflict, show_intervals
+from app.search import search_shows, title_index
+from app.staticfiles import serve_static
+from app.tokens import BloomFilter, RefreshToken, StatelessJWTAuthentication, blacklist_cache
+
+
+def run_concurrently(func, workers):
+    """Results of func run by `workers` threads at once; the first exception of a thread is raised here."""
+    barrier = threading.Barrier(workers)
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            barrier.wait()
+            result = func()
+            with lock:
+                results.append(result)
+        except Exception as error:
+            with lock:
+                errors.append(error)
+        finally:
+            connection.close()
+
+    threads = [threading.Thread(target=worker) for _ in range(workers)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    if errors:
+        raise errors[0]
+    return results
+
+
+def async_get(url, data=None, **headers):
+    """AsyncClient().get() from sync test code; it returns a coroutine but is not a coroutine function."""
+
+    async def get():
+        return await AsyncClient().get(url, data or {}, **headers)
+
+    return async_to_sync(get)()
+
+
+class SeatInventoryContentionTest(TransactionTestCase):
+
+    def setUp(self):
+        self.hall = CinemaHall.objects.create(hall_name='Red', number_of_seats=10)
+        self.show_date = date.today() + timedelta(days=1)
+        self.movie_show = MovieShow.objects.create(
+            movie_name='Premiere', cinema_hall=self.hall, start_time=time(18, 0), finish_time=time(20, 0),
+            start_date=self.show_date, finish_date=self.show_date)
+
+    def test_concurrent_buyers_never_oversell(self):
+        results = run_concurrently(lambda: SeatInventory.objects.reserve(self.movie_show, self.show_date, 3), 12)
+        taken = [seat for seats in results if seats for seat in seats]
+
+        self.assertEqual(results.count(None), 9)  # refused for lack of seats, not crashed
+        self.assertEqual(len(taken), 9)
+        self.assertEqual(len(set(taken)), 9)
+        self.assertEqual(SeatInventory.objects.get_seats_left(self.movie_show, self.show_date), 1)
+
+    def test_parallel_spend_updates_keep_every_increment(self):
+        user = CustomUser.objects.create_user(username='regular', password='password123')
+        run_concurrently(lambda: add_spend(user.pk, 100), 16)
+        user.refresh_from_db()
+        self.assertEqual(user.money_spent, 1600)
+
+    def test_parallel_purchases_through_both_paths_keep_every_increment(self):
+        """
+        The site form and the API at once. SQLite rejects some of the
+        overlapping transactions with "database is locked"; they roll back
+        whole and are retried like a client would.
+        """
+        user = CustomUser.objects.create_user(username='regular', password='password123')
+        # the test client reports exceptions through a global signal, so a thread could raise another's error
+        site, api = Client(raise_request_exception=False), APIClient(raise_request_exception=False)
+        site.force_login(user)
+        api.force_authenticate(user)
+        purchases = iter([
+            lambda: site.post(reverse('ticket_buy'), {'movie-id': self.movie_show.pk, 'date-buy': self.show_date,
+                                                      'number_of_ticket': 1}),
+            lambda: api.post(reverse('api-purchased'), {'date': self.show_date, 'movie_show': self.movie_show.pk,
+                                                        'number_of_ticket': 1}),
+        ] * 4)
+        lock = threading.Lock()
+
+        def buy():
+            with lock:
+                purchase = next(purchases)
+            for _ in range(50):
+                status_code = purchase().status_code
+                if status_code != 500:
+                    return status_code
+                sleep(random.random() / 100)
+
+        self.assertEqual(sorted(run_concurrently(buy, 8)), [201] * 4 + [302] * 4)
+        user.refresh_from_db()
+        self.assertEqual(PurchasedTicket.objects.filter(user=user).count(), 8)
+        self.assertEqual(user.money_spent, 8 * self.movie_show.ticket_price)
+
+    @skipUnless(connection.vendor == 'postgresql', 'SQLite cannot run parallel read-write transactions')
+    def test_parallel_purchases_by_one_user_keep_every_increment(self):
+        user = CustomUser.objects.create_user(username='regular', password='password123')
+
+        def buy():
+            client = APIClient()
+            client.force_authenticate(user)
+            return client.post(reverse('api-purchased'), {'date': self.show_date, 'movie_show': self.movie_show.pk,
+                                                          'number_of_ticket': 1}).status_code
+
+        self.assertEqual(run_concurrently(buy, 8), [201] * 8)
+        user.refresh_from_db()
+        self.assertEqual(user.money_spent, 8 * self.movie_show.ticket_price)
+
+    def test_tickets_count_without_sales_is_hall_capacity(self):
+        self.assertEqual(self.movie_show.get_tickets_count(self.show_date), 10)
+        self.assertFalse(SeatInventory.objects.exists())
+
+
+class CheckoutTest(TestCase):
+
+    def setUp(self):
+        self.user = CustomUser.objects.create_user(username='family', password='password123')
+        self.show_date = date.today() + timedelta(days=1)
+        self.shows = [
+            MovieShow.objects.create(
+                movie_name=f'Movie {number}', cinema_hall=CinemaHall.objects.create(
+                    hall_name=f'Hall {number}', number_of_seats=5),
+                ticket_price=100, start_time=time(18, 0), finish_time=time(20, 0),
+                start_date=self.show_date, finish_date=self.show_date)
+            for number in range(2)
+        ]
+
+    def test_checkout_buys_all_lines(self):
+        tickets = checkout(self.user.pk, [
+            {'movie_show': self.shows[0], 'date': self.show_date, 'number_of_ticket': 2},
+            {'movie_show': self.shows[1], 'date': self.show_date, 'number_of_ticket': 3},
+        ])
+
+        self.assertEqual(len(tickets), 2)
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.money_spent, 500)
+        self.assertEqual(self.shows[1].get_tickets_count(self.show_date), 2)
+
+    def test_checkout_is_all_or_nothing(self):
+        with self.assertRaises(NotEnoughSeats) as error:
+            checkout(self.user.pk, [
+                {'movie_show': self.shows[0], 'date': self.show_date, 'number_of_ticket': 2},
+                {'movie_show': self.shows[1], 'date': self.show_date, 'number_of_ticket': 6},
+            ])
+
+        self.assertEqual(error.exception.line, 1)
+        self.assertFalse(PurchasedTicket.objects.exists())
+        self.assertEqual(self.shows[0].get_tickets_count(self.show_date), 5)
+
+    def test_checkout_api_checks_seats_left_with_one_query(self):
+        checkout(self.user.pk, [{'movie_show': self.shows[0], 'date': self.show_date, 'number_of_ticket': 4}])
+        client = APIClient()
+        client.force_authenticate(self.user)
+        lines = [{'movie_show': show.pk, 'date': self.show_date, 'number_of_ticket': 1} for show in self.shows]
+        lines.append({'movie_show': self.shows[0].pk, 'date': self.show_date, 'number_of_ticket': 1})
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.post(reverse('api-checkout'), {'lines': lines}, format='json')
+
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json()['lines'], [{'number_of_ticket': ['Такого количества свободных мест нет']},
+                                                    {}, {'number_of_ticket': ['Такого количества свободных мест нет']}])
+        self.assertEqual(sum('app_seatinventory' in query['sql'] for query in queries), 1)
+
+
+class MovieListQueriesTest(TestCase):
+
+    def setUp(self):
+        schedule_cache.cache.clear()
+        self.user = CustomUser.objects.create_user(username='viewer', password='password123')
+        self.client.force_login(self.user)
+
+    def create_shows(self, first, count):
+        for number in range(first, first + count):
+            hall = CinemaHall.objects.create(hall_name=f'Hall {number}', number_of_seats=30)
+            MovieShow.objects.create(
+                movie_name=f'Movie {number}', cinema_hall=hall, image='images/poster.jpg',
+                start_time=time(10 + number, 0), finish_time=time(10 + number, 30),
+                start_date=date.today(), finish_date=date.today())
+
+    def count_index_queries(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(reverse('index'), {'show_date': 'Today'})
+        self.assertEqual(response.status_code, 200)
+        return len(queries)
+
+    def test_index_queries_do_not_grow_with_cards(self):
+        self.create_shows(0, 1)
+        one_card = self.count_index_queries()
+        self.create_shows(1, 3)
+        self.assertEqual(self.count_index_queries(), one_card)
+
+    def test_cached_page_keeps_fresh_availability(self):
+        self.create_shows(0, 1)
+        self.count_index_queries()
+        hits = schedule_cache.hits
+        SeatInventory.objects.reserve(MovieShow.objects.get(), date.today(), 4)
+
+        response = self.client.get(reverse('index'), {'show_date': 'Today'})
+
+        self.assertEqual(schedule_cache.hits, hits + 1)
+        self.assertEqual(response.context['movieshow_list'][0].tickets_left, 26)
+
+    def test_saving_a_show_invalidates_the_cache(self):
+        self.create_shows(0, 1)
+        self.count_index_queries()
+        MovieShow.objects.update(movie_name='Renamed')
+        MovieShow.objects.get().save()
+
+        response = self.client.get(reverse('index'), {'show_date': 'Today'})
+
+        self.assertEqual(response.context['movieshow_list'][0].movie_name, 'Renamed')
+
+
+class ScheduleTest(TransactionTestCase):
+
+    def setUp(self):
+        self.hall = CinemaHall.objects.create(hall_name='Blue', number_of_seats=10)
+        self.first_day = date.today() + timedelta(days=1)
+
+    def create_show(self, start_time, finish_time, days=1, name='Night'):
+        return MovieShow.objects.create(
+            movie_name=name, cinema_hall=self.hall, start_time=start_time, finish_time=finish_time,
+            start_date=self.first_day, finish_date=self.first_day + timedelta(days=days - 1))
+
+    def test_show_crossing_midnight_ends_next_day(self):
+        intervals = list(show_intervals(self.first_day, self.first_day + timedelta(days=2), time(23, 0), time(1, 0)))
+
+        self.assertEqual(len(intervals), 2)
+        self.assertEqual(intervals[0][1] - intervals[0][0], timedelta(hours=2))
+
+    def test_overlaps_are_found_across_midnight(self):
+        self.create_show(time(23, 0), time(1, 0), days=3)
+
+        self.assertIsNotNone(find_conflict(self.hall.pk, self.first_day + timedelta(days=1),
+                                           self.first_day + timedelta(days=1), time(0, 30), time(2, 0)))
+        self.assertIsNone(find_conflict(self.hall.pk, self.first_day, self.first_day, time(21, 0), time(23, 0)))
+
+    def test_save_rejects_conflicting_show(self):
+        show = self.create_show(time(18, 0), time(20, 0), days=5)
+        self.assertEqual(ShowSlot.objects.filter(movie_show=show).count(), 5)
+
+        with self.assertRaises(ScheduleConflict):
+            self.create_show(time(19, 0), time(21, 0), name='Late')
+        self.assertEqual(MovieShow.objects.count(), 1)
+
+    def test_concurrent_conflicting_inserts(self):
+        def insert():
+            for _ in range(50):
+                try:
+                    self.create_show(time(12, 0), time(14, 0))
+                except ScheduleConflict:
+                    return False
+                except OperationalError:  # SQLite: "database table is locked", retried like a client would
+                    sleep(random.random() / 100)
+                    continue
+                return True
+
+        results = run_concurrently(insert, 4)
+
+        self.assertEqual(results.count(True), 1)
+        self.assertEqual(results.count(False), 3)
+        self.assertEqual(ShowSlot.objects.count(), 1)
+
+    def test_import_rejects_overlaps_per_row(self):
+        self.create_show(time(18, 0), time(20, 0))
+        day = str(self.first_day)
+        row = {'movie_name': 'Imported', 'ticket_price': 100, 'cinema_hall': self.hall.pk,
+               'start_date': day, 'finish_date': day}
+        rows = [dict(row, start_time='10:00', finish_time='12:00'),
+                dict(row, start_time='11:00', finish_time='13:00'),
+                dict(row, start_time='19:00', finish_time='21:00'),
+                dict(row, start_time='14:00', finish_time='16:00')]
+
+        shows, errors = import_schedule(rows)
+
+        self.assertEqual(shows, [])
+        self.assertEqual([error['row'] for error in errors], [1, 2])
+        self.assertEqual(MovieShow.objects.count(), 1)
+
+        shows, errors = import_schedule([rows[0], rows[3]])
+
+        self.assertEqual(errors, [])
+        self.assertEqual(ShowSlot.objects.filter(movie_show__in=shows).count(), 2)
+
+
+class HotPathIndexTest(TestCase):
+    """Every hot filter path must be answered from an index, never by a sequential scan."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='heavy', password='password123')
+        cls.show_date = date.today() + timedelta(days=1)
+        halls = CinemaHall.objects.bulk_create([CinemaHall(hall_name=f'Hall {number}') for number in range(10)])
+        shows = MovieShow.objects.bulk_create([
+            MovieShow(movie_name=f'Movie {number}', cinema_hall=halls[number % 10],
+                      start_time=time(number % 24, 0), finish_time=time(number % 24, 30),
+                      start_date=cls.show_date + timedelta(days=number % 30),
+                      finish_date=cls.show_date + timedelta(days=number % 30 + 1))
+            for number in range(300)
+        ])
+        ShowSlot.objects.bulk_create([slot for show in shows for slot in build_slots(show)])
+        PurchasedTicket.objects.bulk_create([
+            PurchasedTicket(movie_show=shows[number % 300], user=cls.user,
+                            date=cls.show_date + timedelta(days=number % 30))
+            for number in range(2000)
+        ])
+        SeatInventory.objects.bulk_create([SeatInventory(movie_show=show, date=cls.show_date, seats_left=20)
+                                           for show in shows])
+        cls.show, cls.hall = shows[0], halls[0]
+
+    def assertUsesIndex(self, queryset):
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET enable_seqscan = off')
+            plan = queryset.explain()
+            self.assertNotIn('Seq Scan', plan)
+        else:
+            plan = queryset.explain()
+            self.assertIsNone(re.search(r'SCAN (TABLE )?app_\w+$', plan, re.MULTILINE), plan)
+
+    def test_availability(self):
+        self.assertUsesIndex(SeatInventory.objects.filter(movie_show=self.show, date=self.show_date))
+        self.assertUsesIndex(PurchasedTicket.objects.filter(movie_show=self.show, date=self.show_date)
+                             .values('movie_show').annotate(sold=Sum('number_of_ticket')))
+
+    def test_purchase_history(self):
+        self.assertUsesIndex(PurchasedTicket.objects.filter(user=self.user).order_by('-date', '-id'))
+
+    def test_schedule_listing(self):
+        self.assertUsesIndex(MovieShow.objects.filter(start_date__lte=self.show_date, finish_date__gte=self.show_date))
+        self.assertUsesIndex(MovieShow.objects.filter(cinema_hall=self.hall, start_date__lte=self.show_date,
+                                                      finish_date__gte=self.show_date))
+
+    def test_overlap_check(self):
+        starts_at, ends_at = next(show_intervals(self.show_date, self.show_date, time(10, 0), time(12, 0)))
+        self.assertUsesIndex(ShowSlot.objects.filter(cinema_hall=self.hall, starts_at__lt=ends_at,
+                                                     ends_at__gt=starts_at))
+
+
+class KeysetPaginationTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        hall = CinemaHall.objects.create(hall_name='Green')
+        show = MovieShow.objects.create(movie_name='Classic', cinema_hall=hall, start_time=time(9, 0),
+                                        finish_time=time(10, 0), start_date=date.today() + timedelta(days=1),
+                                        finish_date=date.today() + timedelta(days=10))
+        PurchasedTicket.objects.bulk_create([
+            PurchasedTicket(movie_show=show, user=cls.user, date=date.today() + timedelta(days=number // 3))
+            for number in range(7)
+        ])
+
+    def test_pages_walk_forward_and_back(self):
+        queryset = PurchasedTicket.objects.all()
+        ordering = ['-date', '-id']
+        expected = list(queryset.order_by(*ordering))
+
+        first = paginate(queryset, ordering, 3)
+        second = paginate(queryset, ordering, 3, first.next_cursor)
+        third = paginate(queryset, ordering, 3, second.next_cursor)
+
+        self.assertEqual(first.object_list + second.object_list + third.object_list, expected)
+        self.assertFalse(first.has_previous())
+        self.assertFalse(third.has_next())
+        self.assertEqual(paginate(queryset, ordering, 3, third.previous_cursor).object_list, second.object_list)
+
+    def test_purchase_api_is_paginated_without_count(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        response = client.get(reverse('api-purchased'), {'page_size': 5})
+        following = client.get(response.data['next'])
+
+        self.assertNotIn('count', response.data)
+        self.assertEqual(len(response.data['results']), 5)
+        self.assertEqual(len(following.data['results']), 2)
+        self.assertIsNone(following.data['next'])
+
+    def test_invalid_cursor_is_not_found(self):
+        self.client.force_login(self.user)
+
+        self.assertEqual(self.client.get(reverse('purchases'), {'cursor': 'garbage'}).status_code, 404)
+
+    def test_full_history_streams_in_constant_queries(self):
+        client = APIClient()
+        client.force_authenticate(self.user)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('api-purchased'), {'all': 1})
+            history = json.loads(b''.join(response.streaming_content))
+
+        self.assertEqual(len(queries), 1)
+        self.assertEqual(len(history), 7)
+        self.assertEqual(history[0]['movie_show']['cinema_hall'], 'Green')
+
+
+class SalesExportTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(username='boss', password='password123')
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        halls = [CinemaHall.objects.create(hall_name=name) for name in ('Red', 'Blue')]
+        for hall in halls:
+            show = MovieShow.objects.create(movie_name=f'Film {hall.hall_name}', cinema_hall=hall,
+                                            start_time=time(9, 0), finish_time=time(10, 0), ticket_price=100,
+                                            start_date=date.today(), finish_date=date.today() + timedelta(days=5))
+            PurchasedTicket.objects.bulk_create([
+                PurchasedTicket(movie_show=show, user=cls.user, date=date.today() + timedelta(days=number),
+                                number_of_ticket=2)
+                for number in range(3)
+            ])
+        cls.hall = halls[0]
+
+    def export(self, **params):
+        self.client.force_login(self.admin)
+        response = self.client.get(reverse('export_sales'), params)
+        return response, b''.join(response.streaming_content).decode()
+
+    def test_csv_is_filtered_by_hall_and_dates(self):
+        response, content = self.export(cinema_hall=self.hall.pk, date_to=date.today() + timedelta(days=1))
+        lines = content.splitlines()
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertTrue(lines[0].startswith('ticket_id,date,'))
+        self.assertEqual(len(lines), 3)
+        self.assertTrue(all(',Red,' in line and line.endswith(',200') for line in lines[1:]))
+
+    def test_ndjson(self):
+        _, content = self.export(format='ndjson')
+        rows = [json.loads(line) for line in content.splitlines()]
+        self.assertEqual(len(rows), 6)
+        self.assertEqual(rows[0]['username'], 'regular')
+
+    def test_only_admins(self):
+        self.client.force_login(self.user)
+        self.assertEqual(self.client.get(reverse('export_sales')).status_code, 403)
+
+
+class DailyRollupTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(username='boss', password='password123')
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        cls.hall = CinemaHall.objects.create(hall_name='Red', number_of_seats=10)
+        cls.show = MovieShow.objects.create(movie_name='Film', cinema_hall=cls.hall, ticket_price=50,
+                                            start_time=time(23, 0), finish_time=time(23, 30),
+                                            start_date=date.today(), finish_date=date.today() + timedelta(days=5))
+        cls.tomorrow = date.today() + timedelta(days=1)
+
+    def buy(self, number_of_ticket):
+        client = APIClient()
+        client.force_authenticate(self.user)
+        return client.post(reverse('api-purchased'), {'date': self.tomorrow, 'movie_show': self.show.pk,
+                                                      'number_of_ticket': number_of_ticket})
+
+    def test_purchases_update_rollup_and_rebuild_matches(self):
+        self.assertEqual(self.buy(2).status_code, 201)
+        self.assertEqual(self.buy(3).status_code, 201)
+        checkout(self.user.pk, [{'movie_show': self.show, 'date': self.tomorrow, 'number_of_ticket': 1}])
+
+        rollup = DailyRollup.objects.get()
+        self.assertEqual((rollup.tickets_sold, rollup.revenue, rollup.seat_capacity), (6, 300, 10))
+
+        DailyRollup.objects.all().delete()
+        self.assertEqual(DailyRollup.objects.rebuild(self.tomorrow, self.tomorrow), 1)
+        rollup = DailyRollup.objects.get()
+        self.assertEqual((rollup.tickets_sold, rollup.revenue, rollup.seat_capacity), (6, 300, 10))
+
+    def test_report_does_not_read_tickets(self):
+        self.buy(4)
+        client = APIClient()
+        client.force_authenticate(self.admin)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(reverse('api-daily-report'), {'date_from': self.tomorrow,
+                                                                 'date_to': self.tomorrow})
+        self.assertEqual(response.json(), [{'date': str(self.tomorrow), 'cinema_hall': self.hall.pk,
+                                            'hall_name': 'Red', 'tickets_sold': 4, 'revenue': 200,
+                                            'seat_capacity': 10, 'occupancy': 0.4}])
+        self.assertFalse([query for query in queries if 'app_purchasedticket' in query['sql']])
+
+    def test_capacity_counts_sessions_without_sales(self):
+        MovieShow.objects.create(movie_name='Empty', cinema_hall=self.hall, ticket_price=50,
+                                 start_time=time(10, 0), finish_time=time(12, 0),
+                                 start_date=self.tomorrow, finish_date=self.tomorrow)
+        self.buy(4)
+        day_after = self.tomorrow + timedelta(days=1)
+
+        rows = DailyRollup.objects.report(('date', 'cinema_hall_id'), self.tomorrow, day_after)
+
+        self.assertEqual([(row['date'], row['tickets_sold'], row['seat_capacity']) for row in rows],
+                         [(self.tomorrow, 4, 20), (day_after, 0, 10)])
+
+
+class SeatMapTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        cls.hall = CinemaHall.objects.create(hall_name='Red', number_of_seats=10, seats_per_row=4)
+        cls.show = MovieShow.objects.create(movie_name='Film', cinema_hall=cls.hall, start_time=time(23, 0),
+                                            finish_time=time(23, 30), start_date=date.today(),
+                                            finish_date=date.today() + timedelta(days=5))
+        cls.tomorrow = date.today() + timedelta(days=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def buy(self, number_of_ticket, seats=None):
+        data = {'date': self.tomorrow, 'movie_show': self.show.pk, 'number_of_ticket': number_of_ticket}
+        if seats:
+            data['seats'] = [{'row': row, 'seat': seat} for row, seat in seats]
+        return self.client.post(reverse('api-purchased'), data, format='json')
+
+    def seat_map(self):
+        return self.client.get(reverse('api-seat-map', args=[self.show.pk]), {'date': self.tomorrow}).json()
+
+    def test_bitmap_take(self):
+        seat_map, taken = seating.take(seating.first_taken(3), 20, 4, [9])
+        self.assertEqual(taken, [9, 3, 4, 5])
+        self.assertEqual(len(seat_map), 3)
+        self.assertEqual(seating.render_rows(seat_map, 20, 10), ['XXXXXX...X', '..........'])
+        with self.assertRaises(seating.SeatTaken):
+            seating.take(seat_map, 20, 1, [9])
+
+    def test_chosen_and_assigned_seats(self):
+        self.assertEqual(self.buy(2, [(2, 1), (3, 2)]).json()['seats'], [{'row': 2, 'seat': 1},
+                                                                         {'row': 3, 'seat': 2}])
+        self.assertEqual(self.buy(2).json()['seats'], [{'row': 1, 'seat': 1}, {'row': 1, 'seat': 2}])
+        self.assertEqual(self.seat_map()['seats'], ['XX..', 'X...', '.X'])
+        self.assertEqual(self.seat_map()['seats_left'], 6)
+
+    def test_taken_or_missing_seat_is_rejected(self):
+        self.buy(1, [(1, 1)])
+        response = self.buy(2, [(1, 1), (1, 2)])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('seats', response.json())
+        self.assertEqual(self.buy(1, [(3, 3)]).status_code, 400)
+        self.assertEqual(self.seat_map()['seats'], ['X...', '....', '..'])
+        self.assertEqual(SeatInventory.objects.get_seats_left(self.show, self.tomorrow), 9)
+
+
+class SeatHoldTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        cls.hall = CinemaHall.objects.create(hall_name='Red', number_of_seats=10)
+        cls.show = MovieShow.objects.create(movie_name='Film', cinema_hall=cls.hall, ticket_price=50,
+                                            start_time=time(23, 0), finish_time=time(23, 30),
+                                            start_date=date.today(), finish_date=date.today() + timedelta(days=5))
+        cls.tomorrow = date.today() + timedelta(days=1)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def hold(self, number_of_ticket):
+        return self.client.post(reverse('api-holds'), {'date': self.tomorrow, 'movie_show': self.show.pk,
+                                                       'number_of_ticket': number_of_ticket}, format='json')
+
+    def test_hold_is_subtracted_and_confirmed(self):
+        hold_id = self.hold(3).json()['id']
+        self.assertEqual(self.show.get_tickets_count(self.tomorrow), 7)
+
+        response = self.client.post(reverse('api-hold-confirm', args=[hold_id]))
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(response.json()['seats']), 3)
+        self.assertEqual(self.show.get_tickets_count(self.tomorrow), 7)
+        self.assertFalse(SeatHold.objects.exists())
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.money_spent, 150)
+        self.assertEqual(self.client.post(reverse('api-hold-confirm', args=[hold_id])).status_code, 400)
+
+    def test_expired_holds_are_swept(self):
+        hold_id = self.hold(4).json()['id']
+        self.hold(2)
+        SeatHold.objects.filter(pk=hold_id).update(expires_at=timezone.now() - timedelta(seconds=1))
+
+        self.assertEqual(self.client.post(reverse('api-hold-confirm', args=[hold_id])).status_code, 400)
+        self.assertEqual(sweep_holds(), 1)
+        self.assertEqual(self.show.get_tickets_count(self.tomorrow), 8)
+        seat_map = self.client.get(reverse('api-seat-map', args=[self.show.pk]), {'date': self.tomorrow}).json()
+        self.assertEqual(seat_map['seats'], ['....XX....'])
+        self.assertFalse(PurchasedTicket.objects.exists())
+
+    def test_release_and_wrong_methods(self):
+        hold_id = self.hold(3).json()['id']
+
+        self.assertEqual(self.client.post(reverse('api-hold', args=[hold_id])).status_code, 405)
+        self.assertEqual(self.client.delete(reverse('api-holds')).status_code, 405)
+        self.assertEqual(self.client.delete(reverse('api-hold', args=[hold_id])).status_code, 204)
+        self.assertEqual(self.show.get_tickets_count(self.tomorrow), 10)
+        self.assertEqual(self.client.delete(reverse('api-hold', args=[hold_id])).status_code, 404)
+
+
+class AsyncReadPathTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        cls.hall = CinemaHall.objects.create(hall_name='Red', number_of_seats=10)
+        cls.show = MovieShow.objects.create(movie_name='Film', cinema_hall=cls.hall, start_time=time(23, 0),
+                                            finish_time=time(23, 30), start_date=date.today(),
+                                            finish_date=date.today() + timedelta(days=5))
+
+    def setUp(self):
+        schedule_cache.cache.clear()
+
+    def get(self, url, data=None, user=None, token=None):
+        token = token or user and RefreshToken.for_user(user).access_token
+        headers = {'authorization': f'Bearer {token}'} if token else {}
+        return async_get(url, data, **headers)
+
+    def test_cached_listing_makes_one_query_for_fresh_seats(self):
+        token = RefreshToken.for_user(CustomUser.objects.create_superuser(username='boss', password='password123'))
+        self.assertEqual(self.get(reverse('async-movie-list'), token=token.access_token).json()[0]['tickets_left'],
+                         10)
+        checkout(self.user.pk, [{'movie_show': self.show, 'date': date.today(), 'number_of_ticket': 4}])
+        with CaptureQueriesContext(connection) as queries:
+            shows = self.get(reverse('async-movie-list'), token=token.access_token).json()
+        self.assertEqual([(show['movie_name'], show['tickets_left']) for show in shows], [('Film', 6)])
+        self.assertEqual(len(queries), 2)  # the token's user (JWTAuthentication) and the seats
+
+    def test_listing_is_for_staff_like_the_sync_endpoint(self):
+        for cached in (False, True):
+            response = self.get(reverse('async-movie-list'))
+            self.assertEqual(response.status_code, 401)
+            self.assertEqual(response['WWW-Authenticate'], 'Bearer realm="api"')
+            self.assertEqual(self.get(reverse('async-movie-list'), user=self.user).status_code, 403)
+            self.assertEqual(self.get(reverse('async-movie-list'), token='nonsense').status_code, 401)
+            schedule_cache.store(schedule_cache.make_key('async', 'movies', date.today()), [])
+        self.assertEqual(APIClient().get(reverse('show_movie')).status_code, 401)
+
+    @override_settings(DEBUG=True)  # the handler logs every middleware it adapts
+    def test_middleware_chain_stays_async(self):
+        middleware = [path for path in settings.MIDDLEWARE if not path.startswith('debug_toolbar.')]
+        with self.settings(MIDDLEWARE=middleware), self.assertNoLogs('django.request', 'DEBUG'):
+            ASGIHandler()
+
+    def test_halls_and_availability(self):
+        self.assertEqual(self.get(reverse('async-hall-list')).json()[0]['hall_name'], 'Red')
+        with CaptureQueriesContext(connection) as queries:
+            self.get(reverse('async-hall-list'))
+        self.assertEqual(len(queries), 0)
+
+        response = self.get(reverse('async-availability', args=[self.show.pk]),
+                            {'date': str(date.today() + timedelta(days=1))})
+        self.assertEqual(response.json()['tickets_left'], 10)
+        self.assertEqual(self.get(reverse('async-availability', args=[0])).status_code, 404)
+        self.assertEqual(self.get(reverse('async-availability', args=[self.show.pk]), {'date': 'soon'}).status_code,
+                         400)
+
+
+class LiveSeatsTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        cls.hall = CinemaHall.objects.create(hall_name='Red', number_of_seats=10)
+        cls.show = MovieShow.objects.create(movie_name='Film', cinema_hall=cls.hall, start_time=time(23, 0),
+                                            finish_time=time(23, 30), start_date=date.today(),
+                                            finish_date=date.today() + timedelta(days=5))
+        cls.tomorrow = date.today() + timedelta(days=1)
+
+    def buy(self, number_of_ticket):
+        with self.captureOnCommitCallbacks(execute=True):
+            checkout(self.user.pk, [{'movie_show': self.show, 'date': self.tomorrow,
+                                     'number_of_ticket': number_of_ticket}])
+
+    def test_commit_reaches_every_watcher_with_one_query(self):
+        received = [[] for _ in range(100)]
+        key = (self.show.pk, str(self.tomorrow))
+        for events in received:
+            live.broker.subscribe([key], events.append)
+        try:
+            with self.captureOnCommitCallbacks() as callbacks:
+                checkout(self.user.pk, [{'movie_show': self.show, 'date': self.tomorrow, 'number_of_ticket': 3}])
+            with CaptureQueriesContext(connection) as queries:
+                for callback in callbacks:
+                    callback()
+        finally:
+            for events in received:
+                live.broker.unsubscribe([key], events.append)
+        self.assertTrue(all(events == [{'movie_show': self.show.pk, 'date': str(self.tomorrow), 'tickets_left': 7}]
+                            for events in received))
+        self.assertEqual(len(queries), 1)
+        self.assertFalse(live.broker.is_watched(key))
+
+    def test_asgi_stream_sends_snapshot_then_updates(self):
+        async def watch(query_string):
+            messages, disconnected = asyncio.Queue(), asyncio.Event()
+
+            async def receive():
+                await disconnected.wait()
+                return {'type': 'http.disconnect'}
+
+            scope = {'type': 'http', 'path': '/api/live/seats/', 'query_string': query_string.encode()}
+            stream = asyncio.ensure_future(live.sse_application(None)(scope, receive, messages.put))
+            received = [await messages.get(), await messages.get()]
+            if received[0]['status'] == 200:
+                await sync_to_async(self.buy)(2)
+                received.append(await messages.get())
+            disconnected.set()
+            await stream
+            return received
+
+        start, snapshot, update = async_to_sync(watch)(f'watch={self.show.pk}:{self.tomorrow}')
+        self.assertIn((b'content-type', b'text/event-stream'), start['headers'])
+        self.assertIn(b'"tickets_left": 10', snapshot['body'])
+        self.assertIn(b'"tickets_left": 8', update['body'])
+        self.assertFalse(live.broker.is_watched((self.show.pk, str(self.tomorrow))))
+        self.assertEqual(async_to_sync(watch)('watch=soon')[0]['status'], 400)
+
+    def test_pages_poll_unless_served_with_the_stream(self):
+        scopes = []
+
+        async def application(scope, receive, send):
+            scopes.append(scope)
+
+        async_to_sync(live.sse_application(application))({'type': 'http', 'path': '/'}, None, None)
+        request = RequestFactory().get('/')
+        self.assertIsNone(live.stream_path(request))
+        request.scope = scopes[0]
+        self.assertEqual(live.stream_path(request), '/api/live/seats/')
+
+        self.client.force_login(self.user)
+        response = self.client.get(reverse('index'), {'show_date': 'Tomorrow'})
+        self.assertNotContains(response, 'EventSource(')
+        self.assertContains(response, reverse('async-availability', args=[self.show.pk]))
+
+
+@override_settings(IMAGE_WORKERS=0, IMAGE_VARIANT_WIDTHS=(50, 100, 400))
+class ImageVariantsTest(TestCase):
+
+    def setUp(self):
+        media_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media_root)
+        media = self.settings(MEDIA_ROOT=media_root)
+        media.enable()
+        self.addCleanup(media.disable)
+        self.hall = CinemaHall.objects.create(hall_name='Red')
+
+    def upload(self):
+        exif = Image.Exif()
+        exif[0x010f] = 'Camera'
+        buffer = io.BytesIO()
+        Image.new('RGB', (200, 100), 'red').save(buffer, 'JPEG', exif=exif)
+        return SimpleUploadedFile('poster.jpg', buffer.getvalue(), content_type='image/jpeg')
+
+    def test_variants_are_built_on_upload(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            show = MovieShow.objects.create(movie_name='Film', cinema_hall=self.hall, image=self.upload(),
+                                            start_time=time(23, 0), finish_time=time(23, 30),
+                                            start_date=date.today(), finish_date=date.today())
+        show.refresh_from_db()
+        self.assertEqual([width for width, _ in show.image_variants['webp']], [50, 100, 200])
+        self.assertFalse(images.is_stale(show))
+        with Image.open(default_storage.path(show.image_variants['jpeg'][0][1])) as variant:
+            self.assertEqual(variant.size, (50, 25))
+            self.assertFalse(variant.getexif())
+
+        html = Template("{% load cinema_tags %}{% image_srcset show 'webp' %}|{% image_fallback_url show %}") \
+            .render(Context({'show': show}))
+        variants = f'/media/images/variants/{show.pk}'
+        self.assertEqual(html, f'{variants}/poster-50.webp 50w, {variants}/poster-100.webp 100w, '
+                               f'{variants}/poster-200.webp 200w|{variants}/poster-200.jpeg')
+        self.assertEqual(set(MovieShowSerializer(show).data['image_variants']['jpeg']), {'50', '100', '200'})
+
+    def test_transparent_posters_of_two_shows(self):
+        buffer = io.BytesIO()
+        poster = Image.new('RGBA', (200, 100), (255, 0, 0, 255))
+        poster.paste((0, 0, 0, 0), (0, 0, 100, 100))  # left half transparent
+        poster.save(buffer, 'PNG')
+        shows = []
+        # the same stem in both shows: stored as poster.png and poster.jpg
+        for start, image in ((time(20, 0), SimpleUploadedFile('poster.png', buffer.getvalue())),
+                             (time(22, 0), self.upload())):
+            with self.captureOnCommitCallbacks(execute=True):
+                shows.append(MovieShow.objects.create(
+                    movie_name='Film', cinema_hall=self.hall, start_time=start, finish_time=start.replace(minute=30),
+                    start_date=date.today(), finish_date=date.today(), image=image))
+        for show in shows:
+            show.refresh_from_db()
+        first, second = (show.image_variants for show in shows)
+        self.assertFalse({name for _, name in first['webp']} & {name for _, name in second['webp']})
+
+        with Image.open(default_storage.path(first['webp'][-1][1])) as webp:
+            self.assertEqual(webp.mode, 'RGBA')
+            self.assertEqual(webp.getpixel((10, 50))[3], 0)
+        with Image.open(default_storage.path(first['jpeg'][-1][1])) as jpeg:
+            self.assertGreater(min(jpeg.getpixel((10, 50))), 240)  # white, not black
+            self.assertGreater(jpeg.getpixel((190, 50))[0], 200)
+
+    def test_show_without_image_renders(self):
+        MovieShow.objects.create(movie_name='Film', cinema_hall=self.hall, start_time=time(23, 0),
+                                 finish_time=time(23, 30), start_date=date.today(), finish_date=date.today())
+        user = CustomUser.objects.create_user(username='regular', password='password123')
+        self.client.force_login(user)
+        schedule_cache.cache.clear()
+        self.assertContains(self.client.get(reverse('index')), 'Film')
+
+
+class BenchmarkTest(TestCase):
+
+    def test_seeded_data_is_consistent(self):
+        call_command('seed_cinema', halls=2, days=6, run_days=3, users=5, tickets=300, stdout=io.StringIO())
+        self.assertEqual(MovieShow.objects.count(), 2 * 2 * 4)
+        for inventory in SeatInventory.objects.select_related('movie_show__cinema_hall'):
+            sold = PurchasedTicket.objects.filter(movie_show=inventory.movie_show, date=inventory.date) \
+                .aggregate(sold=Sum('number_of_ticket'))['sold']
+            self.assertEqual(inventory.seats_left + sold, inventory.movie_show.cinema_hall.number_of_seats)
+            self.assertEqual(inventory.seat_map, seating.first_taken(sold))
+        spent = sum(ticket.get_purchase_amount() for ticket in PurchasedTicket.objects.select_related('movie_show'))
+        self.assertEqual(CustomUser.objects.aggregate(spent=Sum('money_spent'))['spent'], spent)
+        self.assertEqual(DailyRollup.objects.aggregate(sold=Sum('tickets_sold'))['sold'],
+                         PurchasedTicket.objects.aggregate(sold=Sum('number_of_ticket'))['sold'])
+        with self.assertRaises(CommandError):
+            call_command('seed_cinema', halls=1, stdout=io.StringIO())
+
+    def test_results_are_compared_with_baseline(self):
+        call_command('seed_cinema', halls=1, days=6, users=2, tickets=20, stdout=io.StringIO())
+        CustomUser.objects.create_superuser(username='boss', password='password123')
+        with tempfile.TemporaryDirectory() as directory:
+            output = f'{directory}/bench.json'
+            call_command('bench_cinema', iterations=2, output=output, stdout=io.StringIO())
+            with open(output) as file:
+                report = json.load(file)
+            self.assertEqual(set(report['results']), {'index', 'purchases', 'ticket_buy', 'api/movie',
+                                                      'api/purchased', 'api/hall'})
+            self.assertEqual(report['rows']['tickets'], 20 + 2 + 3)  # seeded, bought during warm-up and runs
+            call_command('bench_cinema', iterations=2, baseline=output, output=output, stdout=io.StringIO())
+            with open(output) as file:
+                self.assertEqual(json.load(file)['changes']['api/hall']['queries_max'], 0.0)
+
+
+class MetricsTest(TestCase):
+
+    def setUp(self):
+        metrics.registry.clear()
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_histograms_per_view(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            CinemaHall.objects.create(hall_name='Red')
+        for _ in range(2):
+            self.client.get(reverse('cinema_hall_list'))
+        self.client.get('/no/such/page/')
+        text = self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').content.decode()
+
+        self.assertIn('# TYPE cinema_request_duration_seconds histogram', text)
+        self.assertIn('cinema_request_duration_seconds_count{view="cinema_hall_list"} 2', text)
+        self.assertIn('cinema_request_duration_seconds_bucket{view="cinema_hall_list",le="+Inf"} 2', text)
+        self.assertIn('cinema_request_queries_bucket{view="cinema_hall_list",le="0"} 0', text)
+        self.assertIn('cinema_request_queries_sum{view="cinema_hall_list"} 4', text)  # version row and halls
+        self.assertIn('cinema_request_queries_count{view="unresolved"} 1', text)
+
+    @override_settings(METRICS_TOKEN='secret')
+    def test_token(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        self.assertEqual(self.client.get(reverse('metrics'), HTTP_AUTHORIZATION='Bearer secret').status_code, 200)
+
+    @override_settings(METRICS_TOKEN=None)
+    def test_closed_without_token_unless_debug(self):
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        with self.settings(DEBUG=True):
+            self.assertEqual(self.client.get(reverse('metrics')).status_code, 200)
+
+    def test_async_views_are_recorded_with_their_queries(self):
+        schedule_cache.cache.clear()
+        middleware = [path for path in settings.MIDDLEWARE if not path.startswith('debug_toolbar.')]
+        with self.settings(MIDDLEWARE=middleware):  # the whole chain async, the query on a sync_to_async thread
+            async_get(reverse('async-hall-list'))
+        text = metrics.registry.render()
+        self.assertIn('cinema_request_queries_count{view="async-hall-list"} 1', text)
+        self.assertIn('cinema_request_queries_sum{view="async-hall-list"} 1', text)
+
+
+class ProfileMiddlewareTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = CustomUser.objects.create_superuser(username='boss', password='password123')
+        cls.user = CustomUser.objects.create_user(username='regular', password='password123')
+        CinemaHall.objects.create(hall_name='Red')
+
+    def setUp(self):
+        self.profile_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.profile_dir)
+
+    def test_staff_gets_summary(self):
+        self.client.force_login(self.admin)
+        with self.settings(PROFILE_DIR=self.profile_dir):
+            response = self.client.get(reverse('hall_list'), {'profile': '1', 'sort': 'tottime'})
+        self.assertContains(response, 'Profile of /hall/list/')
+        self.assertContains(response, 'FROM &quot;app_cinemahall&quot;')
+        self.assertContains(response, '?profile=1&amp;sort=calls')
+        self.assertEqual(len(response.context['functions']), 40)
+        self.assertGreater(response.context['template_ms'], 0)
+        self.assertEqual(len([name for name in os.listdir(self.profile_dir) if name.endswith('.prof')]), 1)
+
+    def test_flag_is_ignored_for_other_users(self):
+        self.client.force_login(self.user)
+        with self.settings(PROFILE_DIR=self.profile_dir):
+            response = self.client.get(reverse('index'), {'profile': '1'})
+        self.assertNotContains(response, 'Profile of')
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_sampled_requests_are_saved(self):
+        with self.settings(PROFILE_DIR=self.profile_dir, PROFILE_SAMPLE_RATE=1):
+            response = self.client.get(reverse('cinema_hall_list'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(os.listdir(self.profile_dir)), 1)
+
+    def test_anonymous_flag_runs_without_profiler(self):
+        middleware = ProfileMiddleware(lambda request: HttpResponse(str(sys.getprofile() is not None)))
+        request = RequestFactory().get('/', {'profile': '1'})
+        request.user = AnonymousUser()
+        self.assertEqual(middleware(request).content, b'False')
+
+        request = RequestFactory().get('/api/hall/', {'profile': '1'}, HTTP_AUTHORIZATION='Bearer token')
+        request.user = AnonymousUser()
+        with self.settings(PROFILE_DIR=self.profile_dir):
+            self.assertEqual(middleware(request).content, b'True')  # staff is known after the view
+        self.assertEqual(os.listdir(self.profile_dir), [])
+
+    def test_async_chain(self):
+        async def view(request):
+            await sync_to_async(CinemaHall.objects.count)()
+            return HttpResponse('view')
+
+        request = RequestFactory().get('/', {'profile': '1'})
+        request.user = self.admin
+        with self.settings(PROFILE_DIR=self.profile_dir):
+            response = async_to_sync(ProfileMiddleware(view))(request)
+        self.assertContains(response, 'Profile of /?profile=1')
+        self.assertContains(response, 'FROM &quot;app_cinemahall&quot;')
+        self.assertEqual(len(os.listdir(self.profile_dir)), 1)
+
+
+class TokenBlacklistTest(TestCase):
+
+    def setUp(self):
+        cache.delete(blacklist_cache.version_key)
+        blacklist_cache.clear()
+        self.user = CustomUser.objects.create_user(username='regular', password='password123')
+
+    def refresh(self, token):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.post(reverse('token_refresh'), {'refresh': token})
+
+    def test_rotated_token_is_rejected_without_queries(self):
+        old = str(RefreshToken.for_user(self.user))
+        response = self.refresh(old)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.refresh(old).status_code, 401)
+
+        new_jti = RefreshToken(response.json()['refresh'])['jti']
+        with self.assertNumQueries(0):
+            self.assertTrue(blacklist_cache.contains(RefreshToken(old, verify=False)['jti']))
+            self.assertFalse(blacklist_cache.contains(new_jti))
+
+    def test_blacklisted_elsewhere_is_picked_up(self):
+        token = RefreshToken.for_user(self.user)
+        self.assertFalse(blacklist_cache.contains(token['jti']))
+        token.blacklist()  # its on_commit callback never runs, as in another process
+        self.assertFalse(blacklist_cache.contains(token['jti']))
+        cache.incr(blacklist_cache.version_key)
+        self.assertTrue(blacklist_cache.contains(token['jti']))
+
+    def test_rows_committed_out_of_order_are_picked_up(self):
+        late, early = RefreshToken.for_user(self.user), RefreshToken.for_user(self.user)
+        self.assertFalse(blacklist_cache.contains(early['jti']))
+        late.blacklist()
+        late_row = BlacklistedToken.objects.get(token__jti=late['jti'])
+        late_row.delete()  # not committed yet when the next row is synced
+        early.blacklist()
+        cache.incr(blacklist_cache.version_key)
+        self.assertTrue(blacklist_cache.contains(early['jti']))
+
+        # commits now, with a lower id and a time before the last sync started
+        BlacklistedToken.objects.create(pk=late_row.pk, token=late_row.token)
+        BlacklistedToken.objects.filter(pk=late_row.pk).update(blacklisted_at=timezone.now() - timedelta(seconds=30))
+        cache.incr(blacklist_cache.version_key)
+        self.assertTrue(blacklist_cache.contains(late['jti']))
+
+    def test_refreshed_from_the_database_without_a_shared_cache(self):
+        with self.settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}}):
+            token = RefreshToken.for_user(self.user)
+            self.assertFalse(blacklist_cache.contains(token['jti']))
+            token.blacklist()
+            with self.assertNumQueries(0):
+                self.assertFalse(blacklist_cache.contains(token['jti']))
+            with self.settings(JWT_BLACKLIST_SYNC_INTERVAL=0):
+                self.assertTrue(blacklist_cache.contains(token['jti']))
+
+    def test_bloom_filter(self):
+        bloom = BloomFilter(1000)
+        for number in range(1000):
+            bloom.add(f'in-{number}')
+        self.assertTrue(all(f'in-{number}' in bloom for number in range(1000)))
+        self.assertLess(sum(f'out-{number}' in bloom for number in range(10000)), 50)
+
+    def test_purge_expired_tokens(self):
+        for number in range(5):
+            token = OutstandingToken.objects.create(user=self.user, jti=f'old-{number}', token='x',
+                                                    expires_at=timezone.now() - timedelta(days=1))
+            BlacklistedToken.objects.create(token=token)
+        live_token = RefreshToken.for_user(self.user)
+        call_command('purge_tokens', batch_size=2, stdout=io.StringIO())
+        self.assertEqual(list(OutstandingToken.objects.values_list('jti', flat=True)), [live_token['jti']])
+        self.assertFalse(BlacklistedToken.objects.exists())
+
+
+class StatelessAuthTest(TestCase):
+
+    def setUp(self):
+        blacklist_cache.clear()
+        self.user = CustomUser.objects.create_user(username='regular', password='password123')
+        self.tomorrow = date.today() + timedelta(days=1)
+        self.show = MovieShow.objects.create(movie_name='Film', cinema_hall=CinemaHall.objects.create(hall_name='Red'),
+                                             ticket_price=100, start_time=time(18, 0), finish_time=time(20, 0),
+                                             start_date=self.tomorrow, finish_date=self.tomorrow)
+
+    def login(self):
+        response = self.client.post(reverse('token_obtain_pair'), {'username': 'regular', 'password': 'password123'})
+        return response.json()
+
+    def test_user_is_built_from_claims(self):
+        access = self.login()['access']
+        request = RequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {access}')
+        with self.assertNumQueries(0):
+            user, _ = StatelessJWTAuthentication().authenticate(request)
+        self.assertEqual((user.id, user.is_staff, user.is_superuser), (self.user.pk, False, False))
+
+    def test_roles_are_reread_on_refresh(self):
+        refresh = self.login()['refresh']
+        CustomUser.objects.filter(pk=self.user.pk).update(is_staff=True)
+        with self.captureOnCommitCallbacks(execute=True):
+            tokens = self.client.post(reverse('token_refresh'), {'refresh': refresh}).json()
+        self.assertTrue(AccessToken(tokens['access'])['is_staff'])
+
+        CustomUser.objects.filter(pk=self.user.pk).update(is_active=False)
+        self.assertEqual(self.client.post(reverse('token_refresh'), {'refresh': tokens['refresh']}).status_code, 401)
+
+    def test_purchase_loads_user_once(self):
+        client = APIClient()
+        client.credentials(HTTP_AUTHORIZATION=f"Bearer {self.login()['access']}")
+        with CaptureQueriesContext(connection) as context:
+            response = client.post(reverse('api-purchased'), {'date': self.tomorrow, 'movie_show': self.show.pk,
+                                                              'number_of_ticket': 2})
+        self.assertEqual(response.status_code, 201)
+        user_selects = [query['sql'] for query in context.captured_queries
+                        if query['sql'].startswith('SELECT') and 'FROM "app_customuser"' in query['sql']]
+        self.assertEqual(len(user_selects), 1)
+
+
+class ConditionalGetTest(TestCase):
+
+    def setUp(self):
+        self.hall = CinemaHall.objects.create(hall_name='Red')
+        MovieShow.objects.create(movie_name='Film', cinema_hall=self.hall, ticket_price=100, start_time=time(18, 0),
+                                 finish_time=time(20, 0), start_date=date.today(), finish_date=date.today())
+
+    def test_hall_list_is_not_modified_until_a_hall_changes(self):
+        response = self.client.get(reverse('cinema_hall_list'))
+        self.assertEqual(response.status_code, 200)
+        with self.assertNumQueries(1):  # the version row, shared by both validators
+            response = self.client.get(reverse('cinema_hall_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            CinemaHall.objects.create(hall_name='Blue')
+        response = self.client.get(reverse('cinema_hall_list'), HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 2)
+        response = self.client.get(reverse('cinema_hall_list'), HTTP_IF_MODIFIED_SINCE=response['Last-Modified'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_versions_are_shared_by_workers(self):
+        etag = self.client.get(reverse('cinema_hall_list'))['ETag']
+        cache.clear()  # a worker with its own cache
+        self.assertEqual(self.client.get(reverse('cinema_hall_list'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+        ahead = TableVersion.objects.get(pk='app.cinemahall').version + 10 ** 12
+        TableVersion.objects.filter(pk='app.cinemahall').update(version=ahead)
+        table_versions.touch(CinemaHall)  # from a worker whose clock is behind
+        self.assertEqual(table_versions.get(CinemaHall), ahead + 1)
+
+    def test_movie_list_validator_depends_on_day(self):
+        client = APIClient()
+        admin = CustomUser.objects.create_superuser(username='boss', password='password123')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin).access_token}')
+        etag = client.get(reverse('show_movie'))['ETag']
+        with self.assertNumQueries(2):  # the user of the token and the version row
+            self.assertEqual(client.get(reverse('show_movie'), HTTP_IF_NONE_MATCH=etag).status_code, 304)
+        self.assertNotEqual(client.get(reverse('show_day', args=['tomorrow']))['ETag'], etag)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            MovieShow.objects.get().save()
+        self.assertEqual(client.get(reverse('show_movie'), HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_movie_list_is_cached_per_scheme(self):
+        MovieShow.objects.update(image_variants={'jpeg': [[50, 'images/variants/film-50.jpg']]})
+        client = APIClient()
+        admin = CustomUser.objects.create_superuser(username='boss', password='password123')
+        client.credentials(HTTP_AUTHORIZATION=f'Bearer {RefreshToken.for_user(admin).access_token}')
+        plain = client.get(reverse('show_movie'))
+        secure = client.get(reverse('show_movie'), secure=True)
+        self.assertTrue(secure.json()['results'][0]['image_variants']['jpeg']['50'].startswith('https://'))
+        self.assertNotEqual(secure['ETag'], plain['ETag'])
+
+
+class StaticFilesTest(TestCase):
+
+    def setUp(self):
+        self.static_root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.static_root)
+        settings = self.settings(STATIC_ROOT=self.static_root,
+                                 STATICFILES_STORAGE='app.staticfiles.CompressedManifestStaticFilesStorage')
+        settings.enable()
+        self.addCleanup(settings.disable)
+        call_command('collectstatic', interactive=False, verbosity=0)
+        self.hashed = staticfiles_storage.stored_name('css/style.css')
+
+    def get(self, path, **headers):
+        return serve_static(RequestFactory().get(f'/static/{path}', **headers), path)
+
+    def test_hashed_names_with_compressed_siblings(self):
+        self.assertRegex(self.hashed, r'^css/style\.[0-9a-f]{12}\.css$')
+        self.assertEqual(Template("{% load static %}{% static 'css/style.css' %}").render(Context()),
+                         f'/static/{self.hashed}')
+        with open(os.path.join(self.static_root, self.hashed), 'rb') as original, \
+                gzip.open(os.path.join(self.static_root, self.hashed + '.gz')) as compressed:
+            self.assertEqual(compressed.read(), original.read())
+
+    def test_serves_precompressed_and_immutable(self):
+        response = self.get(self.hashed, HTTP_ACCEPT_ENCODING='gzip, deflate, br')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(response['Content-Type'], 'text/css')
+        self.assertEqual(response['Cache-Control'], 'public, max-age=31536000, immutable')
+        with open(os.path.join(self.static_root, self.hashed), 'rb') as original:
+            self.assertEqual(gzip.decompress(b''.join(response.streaming_content)), original.read())
+        self.assertEqual(response['Vary'], 'Accept-Encoding')
+
+        response = self.get('css/style.css', HTTP_ACCEPT_ENCODING='gzip;q=0')
+        self.assertFalse(response.has_header('Content-Encoding'))
+        self.assertEqual(response['Cache-Control'], 'public, max-age=0, must-revalidate')
+        self.assertEqual(self.get('css/style.css', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code,
+                         304)
+        with self.assertRaises(Http404):
+            self.get('../manage.py')
+
+
+class MovieSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        hall = CinemaHall.objects.create(hall_name='Red', number_of_seats=30)
+        cls.tomorrow = date.today() + timedelta(days=1)
+        for number, (name, start_date) in enumerate([
+            ('Интерстеллар', date.today()), ('Дюна: Часть вторая', cls.tomorrow), ('Дюна', date.today()),
+            ('Звёздные войны', cls.tomorrow), ('Дюна', date.today() - timedelta(days=3)),
+        ]):
+            MovieShow.objects.create(movie_name=name, cinema_hall=hall, start_time=time(8 + number * 2, 0),
+                                     finish_time=time(9 + number * 2, 0), start_date=start_date,
+                                     finish_date=max(start_date, cls.tomorrow) if number != 4 else start_date)
+        cls.dune = MovieShow.objects.get(movie_name='Дюна: Часть вторая')
+        SeatInventory.objects.reserve(cls.dune, cls.tomorrow, 4)
+
+    def setUp(self):
+        title_index.clear()  # built from rows of other tests that were rolled back
+
+    def search(self, q, **params):
+        response = self.client.get(reverse('api-movie-search'), dict(params, q=q))
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def test_prefix_matches_first_with_availability(self):
+        shows = self.search('дюн')
+        self.assertEqual([show['movie_name'] for show in shows], ['Дюна', 'Дюна: Часть вторая'])
+        self.assertEqual((shows[1]['next_date'], shows[1]['tickets_left']), (str(self.tomorrow), 26))
+        self.assertEqual([show['movie_name'] for show in self.search('звезд')], ['Звёздные войны'])
+        self.assertEqual([show['movie_name'] for show in self.search('ЗВЁЗД')], ['Звёздные войны'])
+        self.assertEqual([show['movie_name'] for show in self.search('войн')], ['Звёздные войны'])
+
+    def test_fuzzy_match(self):
+        self.assertEqual([show['movie_name'] for show in self.search('интерстелар')], ['Интерстеллар'])
+        self.assertEqual(self.search('матрица'), [])
+        self.assertEqual(self.client.get(reverse('api-movie-search'), {'q': 'д'}).status_code, 400)
+
+    def test_index_is_rebuilt_on_save(self):
+        self.search('дюн')
+        with self.captureOnCommitCallbacks(execute=True):
+            MovieShow.objects.filter(movie_name='Интерстеллар').get().save()
+            self.dune.movie_name = 'Начало'
+            self.dune.save()
+        self.assertEqual([show['movie_name'] for show in self.search('начал')], ['Начало'])
+        with self.assertNumQueries(2):  # the version row and the shows
+            search_shows('интерстеллар')
+
+    def test_search_box_filters_index(self):
+        self.client.force_login(CustomUser.objects.create_user(username='regular', password='password123'))
+        response = self.client.get(reverse('index'), {'q': 'дюна', 'show_date': 'Tomorrow'})
+        self.assertEqual(sorted(show.movie_name for show in response.context['movieshow_list']),
+                         ['Дюна', 'Дюна: Часть вторая'])
+        self.assertContains(response, 'value="дюна"')
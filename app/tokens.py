@@ -0,0 +1,214 @@
+"""
+Refresh tokens checked against an in-process copy of the token blacklist,
+and stateless authentication from role claims in the access token.
+
+Every refresh and logout verifies the refresh token against
+BlacklistedToken. BlacklistCache answers that from a Bloom filter of the
+blacklisted JTIs plus an LRU of the recent ones, so a token that was never
+blacklisted (almost every lookup) costs no query. Bloom hits that are not in
+the LRU are confirmed in the database.
+
+The filter is loaded from the live (not yet expired) blacklist on first use
+and every process refreshes it from the database at least every
+JWT_BLACKLIST_SYNC_INTERVAL seconds, whatever the cache backend. A shared
+cache (Redis, Memcached) shortens that: a counter in it, bumped after every
+new BlacklistedToken commits (see app.signals), triggers the refresh at the
+next lookup. A refresh reads the rows blacklisted since the previous one
+started, minus JWT_BLACKLIST_SYNC_OVERLAP seconds, so rows that commit late
+or come from a worker whose clock is behind are not skipped.
+
+Tokens carry the is_staff and is_superuser claims, read again from the user
+row on every refresh, so StatelessJWTAuthentication can authorize API calls
+without loading the user: a role change or deactivation takes effect at the
+next refresh, within ACCESS_TOKEN_LIFETIME.
+"""
+import hashlib
+import math
+import threading
+import time
+from collections import OrderedDict
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.cache import cache
+from django.utils.translation import gettext_lazy as _
+from rest_framework_simplejwt import serializers, tokens
+from rest_framework_simplejwt.authentication import JWTAuthentication, JWTStatelessUserAuthentication
+from rest_framework_simplejwt.exceptions import TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+from rest_framework_simplejwt.utils import aware_utcnow
+
+from app.models import CustomUser
+
+
+class BloomFilter:
+
+    def __init__(self, capacity, error_rate=0.001):
+        self.capacity = max(capacity, 1)
+        self.size = math.ceil(-self.capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.hashes = max(round(self.size / self.capacity * math.log(2)), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+        self.count = 0
+
+    def positions(self, value):
+        digest = hashlib.blake2b(value.encode(), digest_size=16).digest()
+        first, second = int.from_bytes(digest[:8], 'little'), int.from_bytes(digest[8:], 'little') | 1
+        return [(first + number * second) % self.size for number in range(self.hashes)]
+
+    def add(self, value):
+        for position in self.positions(value):
+            self.bits[position // 8] |= 1 << position % 8
+        self.count += 1
+
+    def __contains__(self, value):
+        return all(self.bits[position // 8] & (1 << position % 8) for position in self.positions(value))
+
+
+class BlacklistCache:
+    version_key = 'jwt-blacklist:version'
+
+    def __init__(self, recent_size=10000):
+        self.recent_size = recent_size
+        self._lock = threading.RLock()
+        self._bloom = None
+        self._recent = OrderedDict()
+        self._since = None  # start of the last sync, the next one reads from here minus the overlap
+        self._version = None
+        self._synced_at = 0.0
+
+    def get_sync_interval(self):
+        return getattr(settings, 'JWT_BLACKLIST_SYNC_INTERVAL', 5)
+
+    def get_sync_overlap(self):
+        return timedelta(seconds=getattr(settings, 'JWT_BLACKLIST_SYNC_OVERLAP', 60))
+
+    def current_version(self):
+        """The counter of blacklistings, None while the cache cannot keep it."""
+        version = cache.get(self.version_key)
+        if version is None:
+            # start from the clock, so a counter evicted from the cache never repeats an old value
+            cache.add(self.version_key, time.time_ns(), None)
+            version = cache.get(self.version_key)
+        return version
+
+    def load(self):
+        """Rebuild the filter from the blacklisted tokens that have not expired yet."""
+        with self._lock:
+            self._version = self.current_version()
+            since = aware_utcnow()
+            rows = BlacklistedToken.objects.filter(token__expires_at__gt=since).values_list('token__jti', flat=True)
+            count = rows.count()
+            self._bloom = BloomFilter(max(count * 2, getattr(settings, 'JWT_BLACKLIST_CAPACITY', 100000)))
+            self._recent.clear()
+            self._follow(rows.iterator())
+            self._since = since
+            self._synced_at = time.monotonic()
+
+    def _follow(self, jtis):
+        for jti in jtis:
+            if jti not in self._bloom:  # rows read again in the overlap are not counted twice
+                self._bloom.add(jti)
+
+    def sync(self):
+        """Pick up rows blacklisted by other processes when the counter moved or the interval passed."""
+        with self._lock:
+            if self._bloom is None or self._bloom.count > self._bloom.capacity:
+                return self.load()
+            version = self.current_version()
+            if version == self._version and time.monotonic() - self._synced_at < self.get_sync_interval():
+                return
+            since = aware_utcnow()
+            self._follow(BlacklistedToken.objects.filter(blacklisted_at__gte=self._since - self.get_sync_overlap())
+                         .values_list('token__jti', flat=True))
+            self._version, self._since, self._synced_at = version, since, time.monotonic()
+
+    def remember(self, jti):
+        self._recent[jti] = True
+        self._recent.move_to_end(jti)
+        if len(self._recent) > self.recent_size:
+            self._recent.popitem(last=False)
+
+    def add(self, jti):
+        """A token was blacklisted by this process and committed."""
+        with self._lock:
+            if self._bloom is not None:
+                self._follow([jti])
+            self.remember(jti)
+            try:
+                version = cache.incr(self.version_key)
+            except ValueError:  # evicted, the next current_version() starts it again
+                return
+            if self._version is not None and version == self._version + 1:  # nobody else wrote in between
+                self._version = version
+
+    def contains(self, jti):
+        self.sync()
+        with self._lock:
+            if jti in self._recent:
+                self._recent.move_to_end(jti)
+                return True
+            if jti not in self._bloom:
+                return False
+        blacklisted = BlacklistedToken.objects.filter(token__jti=jti).exists()
+        if blacklisted:
+            with self._lock:
+                self.remember(jti)
+        return blacklisted
+
+    def clear(self):
+        with self._lock:
+            self._bloom = None
+            self._recent.clear()
+
+
+blacklist_cache = BlacklistCache()
+
+
+ROLE_CLAIMS = ('is_staff', 'is_superuser')
+
+
+class RefreshToken(tokens.RefreshToken):
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        for claim in ROLE_CLAIMS:
+            token[claim] = getattr(user, claim)
+        return token
+
+    @property
+    def access_token(self):
+        if self.token is not None:  # refreshing an issued token, take the roles from the user row again
+            roles = CustomUser.objects.filter(pk=self[api_settings.USER_ID_CLAIM], is_active=True) \
+                .values(*ROLE_CLAIMS).first()
+            if roles is None:
+                raise TokenError(_('User not found'))
+            self.payload.update(roles)
+        return super().access_token
+
+    def check_blacklist(self):
+        if blacklist_cache.contains(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_('Token is blacklisted'))
+
+
+class TokenObtainPairSerializer(serializers.TokenObtainPairSerializer):
+    token_class = RefreshToken
+
+
+class TokenRefreshSerializer(serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
+
+class StatelessJWTAuthentication(JWTStatelessUserAuthentication):
+    """
+    request.user is a TokenUser built from the claims (id, is_staff,
+    is_superuser), no query per request. It has none of the CustomUser
+    fields, so views that need the row load it by request.user.id. Tokens
+    issued without the role claims still load the user.
+    """
+
+    def get_user(self, validated_token):
+        if not all(claim in validated_token for claim in ROLE_CLAIMS):
+            return JWTAuthentication.get_user(self, validated_token)
+        return super().get_user(validated_token)
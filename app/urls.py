@@ -2,9 +2,13 @@ from django.urls import path
 from rest_framework import routers
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
-from app.api.resources import RegisterAPI, APILogoutView, CinemaHallViewSet, MovieViewSet, PurchaseList
+from app.api.resources import RegisterAPI, APILogoutView, CinemaHallViewSet, MovieViewSet, PurchaseList, \
+    CheckoutView, ScheduleCacheStatsView, DailyReportView, SeatMapView, SeatHoldView, SeatHoldDetailView, \
+    SeatHoldConfirmView, MovieSearchView
+from app import metrics
+from app.api import async_views
 from app.views import MovieListView, Login, Register, HallListView, MovieShowCreateView, HallCreateView, \
-    TicketBuyCreateView, Logout, PurchasesListView, HallUpdateView, MovieUpdateView
+    TicketBuyCreateView, Logout, PurchasesListView, HallUpdateView, MovieUpdateView, SalesExportView
 
 
 router = routers.SimpleRouter()
@@ -23,6 +27,7 @@ urlpatterns = [
     path('purchases/', PurchasesListView.as_view(), name='purchases'),
     path('update/hall/<int:pk>/', HallUpdateView.as_view(), name='update_hall'),
     path('update/movie/<int:pk>/', MovieUpdateView.as_view(), name='update_movie'),
+    path('export/sales/', SalesExportView.as_view(), name='export_sales'),
 
 ]
 
@@ -36,7 +41,21 @@ urlpatterns += [
     path('api/hall/<int:pk>/', CinemaHallViewSet.as_view({'put': 'update'}), name='cinema_hall_update'),
     path('api/movie/', MovieViewSet.as_view({'get': 'list', 'post': 'create', 'put': 'update'}), name='show_movie'),
     path('api/movie/<int:pk>/', MovieViewSet.as_view({'put': 'update'}), name='show_movie'),
+    path('api/movie/<int:pk>/seats/', SeatMapView.as_view(), name='api-seat-map'),
+    path('api/movie/bulk/', MovieViewSet.as_view({'post': 'bulk_create'}), name='show_movie_bulk'),
+    path('api/movie/search/', MovieSearchView.as_view(), name='api-movie-search'),
     path('api/movie/<str:show_day>/', MovieViewSet.as_view({'get': 'list'}), name='show_day'),
     path('api/purchased/', PurchaseList.as_view(), name='api-purchased'),
+    path('api/checkout/', CheckoutView.as_view(), name='api-checkout'),
+    path('api/holds/', SeatHoldView.as_view(), name='api-holds'),
+    path('api/holds/<int:pk>/', SeatHoldDetailView.as_view(), name='api-hold'),
+    path('api/holds/<int:pk>/confirm/', SeatHoldConfirmView.as_view(), name='api-hold-confirm'),
+    path('api/cache/schedule/', ScheduleCacheStatsView.as_view(), name='api-schedule-cache'),
+    path('api/async/movie/', async_views.movie_list, name='async-movie-list'),
+    path('api/async/movie/<str:show_day>/', async_views.movie_list, name='async-movie-day'),
+    path('api/async/hall/', async_views.hall_list, name='async-hall-list'),
+    path('api/async/availability/<int:pk>/', async_views.availability, name='async-availability'),
+    path('api/reports/daily/', DailyReportView.as_view(), name='api-daily-report'),
+    path('metrics', metrics.metrics, name='metrics'),
 
 ]
\ No newline at end of file
@@ -3,14 +3,20 @@ import datetime
 from django.contrib import messages
 from django.contrib.auth.mixins import LoginRequiredMixin, PermissionRequiredMixin
 from django.contrib.auth.views import LoginView, LogoutView
-from django.db import transaction
-from django.db.models import Q
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseBadRequest, HttpResponseRedirect, StreamingHttpResponse
 from django.urls import reverse_lazy
-from django.views.generic import CreateView, ListView, UpdateView
+from django.views.generic import CreateView, ListView, UpdateView, View
 
-from app.forms import RegisterForm, MovieShowCreateForm, HallCreateForm, BuyTicketForm, ChoiceForm, MovieShowUpdateForm
-from app.models import MovieShow, CinemaHall, PurchasedTicket
+from app import live
+from app.booking import NotEnoughSeats, checkout
+from app.cache import schedule_cache
+from app.exports import CONTENT_TYPES, iter_export, sales_rows
+from app.forms import RegisterForm, MovieShowCreateForm, HallCreateForm, BuyTicketForm, ChoiceForm, MovieShowUpdateForm, \
+    SalesExportForm, ReportPeriodForm
+from app.models import MovieShow, CinemaHall, PurchasedTicket, SeatInventory, DailyRollup
+from app.pagination import KeysetListMixin
+from app.schedule import OVERLAP_MESSAGE, ScheduleConflict
+from app.search import filter_shows
 
 
 class Login(LoginView):
@@ -29,10 +35,11 @@ class Logout(LoginRequiredMixin, LogoutView):
     login_url = reverse_lazy('login')
 
 
-class MovieListView(LoginRequiredMixin, ListView):
+class MovieListView(LoginRequiredMixin, KeysetListMixin, ListView):
     model = MovieShow
     login_url = 'login/'
     template_name = 'index.html'
+    context_object_name = 'movieshow_list'
     paginate_by = 3
     extra_context = {'buy_ticket_form': BuyTicketForm}
 
@@ -43,36 +50,47 @@ class MovieListView(LoginRequiredMixin, ListView):
         if self.request.GET.get('filter_by'):
             context['filter'] = self.request.GET.get('filter_by')
 
-        if self.request.GET.get('show_date') == 'Tomorrow':
-            context['date'] = str(datetime.date.today() + datetime.timedelta(days=1))
-            context['day'] = 'Tomorrow'
-
-        elif self.request.GET.get('show_date') == 'Today':
-            context['date'] = str(datetime.date.today())
-            context['day'] = 'Today'
-        else:
-            context['date'] = str(datetime.date.today())
+        if self.request.GET.get('show_date') in ('Today', 'Tomorrow'):
+            context['day'] = self.request.GET.get('show_date')
+        context['date'] = str(self.get_show_date())
+        context['q'] = self.request.GET.get('q', '')
+        context['live_seats'] = live.stream_path(self.request)
         return context
 
+    def get_show_date(self):
+        if self.request.GET.get('show_date') == 'Tomorrow':
+            return datetime.date.today() + datetime.timedelta(days=1)
+        return datetime.date.today()
+
     def get_ordering(self):
         filter_by = self.request.GET.get('filter_by')
-        if filter_by == 'start_time':
-            self.ordering = ['start_time']
-        elif filter_by == 'price_max':
-            self.ordering = ['ticket_price']
+        if filter_by == 'price_max':
+            return ['ticket_price', 'id']
         elif filter_by == 'price_min':
-            self.ordering = ['-ticket_price']
-        return self.ordering
+            return ['-ticket_price', '-id']
+        return ['start_time', 'id']
+
+    def paginate_queryset(self, queryset, page_size):
+        """
+        The page of shows comes from the schedule cache; only the remaining
+        seats, which change with every purchase, are read fresh on a hit.
+        """
+        show_date = self.get_show_date()
+        paginator, page, shows, is_paginated = schedule_cache.get_or_set(
+            ('index', show_date, self.request.GET.get('show_date'), self.request.GET.get('filter_by'),
+             self.request.GET.get('q'), self.request.GET.get(self.cursor_kwarg)),
+            lambda: super(MovieListView, self).paginate_queryset(queryset, page_size))
+        SeatInventory.objects.refresh_tickets_left(shows, show_date)
+        return paginator, page, shows, is_paginated
 
     def get_queryset(self):
-        if self.request.GET.get('show_date') == 'Tomorrow':
-            return super().get_queryset().filter(start_date__lte=datetime.date.today() + datetime.timedelta(days=1),
-                                                 finish_date__gte=datetime.date.today() + datetime.timedelta(days=1))
-        elif self.request.GET.get('show_date') == 'Today':
-            return super().get_queryset().filter(start_date__lte=datetime.date.today(),
-                                                 finish_date__gte=datetime.date.today())
-        else:
-            return super().get_queryset()
+        show_date = self.get_show_date()
+        queryset = super().get_queryset().with_tickets_left(show_date)
+        if len(self.request.GET.get('q', '').strip()) >= 2:
+            queryset = filter_shows(queryset, self.request.GET['q'])
+        if self.request.GET.get('show_date') in ('Today', 'Tomorrow'):
+            return queryset.filter(start_date__lte=show_date, finish_date__gte=show_date)
+        return queryset
 
 
 class MovieShowCreateView(PermissionRequiredMixin, CreateView):
@@ -82,6 +100,13 @@ class MovieShowCreateView(PermissionRequiredMixin, CreateView):
     template_name = 'create_movie.html'
     success_url = '/'
 
+    def form_valid(self, form):
+        try:
+            return super().form_valid(form=form)
+        except ScheduleConflict as error:
+            form.add_error(None, error)
+            return self.form_invalid(form=form)
+
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['request'] = self.request
@@ -101,37 +126,12 @@ class MovieUpdateView(PermissionRequiredMixin, UpdateView):
             messages.warning(self.request, 'На этот сеанс уже куплены билеты, поэтому нельзя изменить!')
             return super().form_invalid(form=form)
 
-        enter_start_date = Q(start_date__range=(obj.start_date, obj.finish_date))
-        middle_date_start = Q(start_date__lte=obj.start_date, finish_date__gte=obj.finish_date)
-        enter_finish_date = Q(finish_date__range=(obj.start_date, obj.finish_date))
-        enter_start_time = Q(start_time__range=(obj.start_time, obj.finish_time))
-        enter_finish_time = Q(finish_time__range=(obj.start_time, obj.finish_time))
-
-        movie_obj = MovieShow.objects.filter(cinema_hall=obj.cinema_hall).exclude(id=obj.id).filter(
-            enter_start_date | enter_finish_date | middle_date_start).filter(enter_start_time | enter_finish_time).all()
-
-        if movie_obj:
-            messages.warning(self.request, 'В это время зал занят!')
-            return super().form_invalid(form=form)
-
-        if obj.start_time > obj.finish_time:
-            enter_start_time_until_midnight = Q(start_time__range=(obj.start_time, '23:59:59'))
-            enter_start_time_after_midnight = Q(start_time__range=('00:00:00', obj.finish_time))
-            enter_finish_time_until_midnight = Q(finish_time__range=(obj.start_time, '23:59:59'))
-            enter_finish_time_after_midnight = Q(finish_time__range=('00:00:00', obj.finish_time))
-
-            movie_obj = MovieShow.objects.filter(cinema_hall=obj.cinema_hall).exclude(id=obj.id).filter(
-                enter_start_date | enter_finish_date | middle_date_start).filter(
-                enter_start_time_until_midnight | enter_start_time_after_midnight |
-                enter_finish_time_until_midnight | enter_finish_time_after_midnight)
-
-        if movie_obj:
-            messages.warning(self.request, 'Сеансы в одном зале не могут накладываться друг на друга')
+        try:
+            return super().form_valid(form=form)
+        except ScheduleConflict:
+            messages.warning(self.request, OVERLAP_MESSAGE)
             return super().form_invalid(form=form)
 
-        obj.save()
-        return super().form_valid(form=form)
-
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
         kwargs['request'] = self.request
@@ -145,23 +145,17 @@ class TicketBuyCreateView(LoginRequiredMixin, CreateView):
     success_url = '/'
 
     def form_valid(self, form):
-        obj = form.save(commit=False)
-        obj.user = self.request.user
-        number_of_ticket = int(self.request.POST.get('number_of_ticket'))
-        movie_id = self.request.POST.get('movie-id')
-        obj.movie_show = MovieShow.objects.get(id=movie_id)
-        obj.user.money_spent += obj.movie_show.ticket_price * number_of_ticket
-
-        if self.request.POST.get('date-buy'):
-            obj.date = self.request.POST.get('date-buy')
-
-        else:
-            obj.date = str(datetime.date.today())
-            obj.purchase_amount = obj.movie_show.ticket_price * number_of_ticket
-        with transaction.atomic():
-            obj.user.save()
-            obj.save()
-        return super().form_valid(form=form)
+        line = {
+            'movie_show': MovieShow.objects.get(id=self.request.POST.get('movie-id')),
+            'date': self.request.POST.get('date-buy') or str(datetime.date.today()),
+            'number_of_ticket': int(self.request.POST.get('number_of_ticket')),
+        }
+        try:
+            self.object = checkout(self.request.user.id, [line])[0]
+        except NotEnoughSeats as error:
+            messages.warning(self.request, error.message)
+            return self.form_invalid(form=form)
+        return HttpResponseRedirect(self.get_success_url())
 
     def get_form_kwargs(self):
         kwargs = super().get_form_kwargs()
@@ -182,6 +176,21 @@ class HallCreateView(LoginRequiredMixin, CreateView):
 class HallListView(ListView):
     model = CinemaHall
     template_name = 'hall_list.html'
+    report_days = 7
+
+    def get_context_data(self, **kwargs):
+        context = super().get_context_data(**kwargs)
+        if self.request.user.is_superuser:
+            # по умолчанию последняя неделя и следующая
+            today = datetime.date.today()
+            form = ReportPeriodForm(self.request.GET or {
+                'date_from': today - datetime.timedelta(days=self.report_days - 1),
+                'date_to': today + datetime.timedelta(days=self.report_days)})
+            period = form.cleaned_data if form.is_valid() else {}
+            context['report_form'] = form
+            context['report'] = DailyRollup.objects.report(('cinema_hall__hall_name',), period.get('date_from'),
+                                                           period.get('date_to'))
+        return context
 
 
 class HallUpdateView(PermissionRequiredMixin, UpdateView):
@@ -200,11 +209,12 @@ class HallUpdateView(PermissionRequiredMixin, UpdateView):
         return super().form_valid(form=form)
 
 
-class PurchasesListView(LoginRequiredMixin, ListView):
+class PurchasesListView(LoginRequiredMixin, KeysetListMixin, ListView):
     login_url = 'login/'
     model = PurchasedTicket
     template_name = 'purchases.html'
     paginate_by = 2
+    ordering = ['-date', '-id']
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
@@ -214,4 +224,19 @@ class PurchasesListView(LoginRequiredMixin, ListView):
         return context
 
     def get_queryset(self):
-        return super().get_queryset().filter(user=self.request.user.id)
+        return super().get_queryset().filter(user=self.request.user.id).select_related('movie_show')
+
+
+class SalesExportView(PermissionRequiredMixin, View):
+    permission_required = 'is_superuser'
+
+    def get(self, request):
+        form = SalesExportForm(request.GET)
+        if not form.is_valid():
+            return HttpResponseBadRequest(form.errors.as_text())
+        file_format = form.cleaned_data['format'] or 'csv'
+        rows = sales_rows(form.cleaned_data['date_from'], form.cleaned_data['date_to'],
+                          form.cleaned_data['cinema_hall'])
+        response = StreamingHttpResponse(iter_export(file_format, rows), content_type=CONTENT_TYPES[file_format])
+        response['Content-Disposition'] = f'attachment; filename="sales.{file_format}"'
+        return response
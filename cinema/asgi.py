@@ -13,4 +13,8 @@ from django.core.asgi import get_asgi_application
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'cinema.settings')
 
-application = get_asgi_application()
+django_application = get_asgi_application()
+
+from app.live import sse_application  # noqa: E402 (needs the apps loaded by get_asgi_application)
+
+application = sse_application(django_application)
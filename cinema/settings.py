@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.0/ref/settings/
 """
 import os
+import sys
 from datetime import timedelta
 from pathlib import Path
 
@@ -40,23 +41,30 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
-    'debug_toolbar',
     'app',
     'rest_framework',
     'rest_framework_simplejwt.token_blacklist',
 ]
 
 MIDDLEWARE = [
+    'app.metrics.MetricsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
+    'app.profiling.ProfileMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+TESTING = sys.argv[1:2] == ['test']
+
+if DEBUG and not TESTING:
+    # sync only: under ASGI the handler would run the whole chain, async views included, in a thread
+    INSTALLED_APPS.append('debug_toolbar')
+    MIDDLEWARE.append('debug_toolbar.middleware.DebugToolbarMiddleware')
+
 ROOT_URLCONF = 'cinema.urls'
 
 TEMPLATES = [
@@ -93,6 +101,26 @@ DATABASES = {
     }
 }
 
+# one per process; with a shared backend (Redis, Memcached) the other processes
+# also see a blacklisted token before JWT_BLACKLIST_SYNC_INTERVAL, see app.tokens
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+SCHEDULE_CACHE_TIMEOUT = 300
+
+SEAT_HOLD_TTL = 600  # seconds
+
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')  # bearer token for /metrics, closed when unset unless DEBUG
+
+PROFILE_DIR = os.path.join(BASE_DIR, 'profiles')
+PROFILE_SAMPLE_RATE = 0.0  # share of all requests profiled to PROFILE_DIR, e.g. 0.001
+
+IMAGE_WORKERS = 2  # processes rendering poster variants, 0 renders them in the request
+IMAGE_VARIANT_WIDTHS = (320, 640, 960)
+
 INTERNAL_IPS = [
     '127.0.0.1',
 ]
@@ -118,6 +146,7 @@ AUTH_PASSWORD_VALIDATORS = [
 REST_FRAMEWORK = {
 
     'DEFAULT_AUTHENTICATION_CLASSES': [
+        # 'app.tokens.StatelessJWTAuthentication' takes the user from the token claims, without a query per request
         'rest_framework_simplejwt.authentication.JWTAuthentication',
     ],
 }
@@ -152,8 +181,14 @@ SIMPLE_JWT = {
     'SLIDING_TOKEN_REFRESH_EXP_CLAIM': 'refresh_exp',
     'SLIDING_TOKEN_LIFETIME': timedelta(minutes=5),
     'SLIDING_TOKEN_REFRESH_LIFETIME': timedelta(days=1),
+
+    'TOKEN_OBTAIN_SERIALIZER': 'app.tokens.TokenObtainPairSerializer',
+    'TOKEN_REFRESH_SERIALIZER': 'app.tokens.TokenRefreshSerializer',
 }
 
+JWT_BLACKLIST_SYNC_INTERVAL = 5  # seconds, longest delay before a process sees a token blacklisted elsewhere
+JWT_BLACKLIST_SYNC_OVERLAP = 60  # seconds, longer than any transaction plus the clock skew between workers
+
 # Internationalization
 # https://docs.djangoproject.com/en/4.0/topics/i18n/
 
@@ -171,9 +206,11 @@ USE_TZ = True
 
 STATIC_URL = '/static/'
 
-STATICFILES_DIRS = [
-   os.path.join(BASE_DIR, "static"),
-]
+STATIC_ROOT = os.path.join(BASE_DIR, 'staticfiles')
+
+# collectstatic writes hashed names with .gz/.br siblings, see app.staticfiles
+STATICFILES_STORAGE = 'django.contrib.staticfiles.storage.StaticFilesStorage' if DEBUG \
+    else 'app.staticfiles.CompressedManifestStaticFilesStorage'
 
 MEDIA_URL = '/media/'
 
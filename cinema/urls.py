@@ -16,7 +16,9 @@ Including another URLconf
 from django.conf import settings
 from django.conf.urls.static import static
 from django.contrib import admin
-from django.urls import path, include
+from django.urls import path, include, re_path
+
+from app.staticfiles import serve_static
 
 urlpatterns = [
     path('admin/', admin.site.urls),
@@ -25,11 +27,14 @@ urlpatterns = [
 
 
 if settings.DEBUG:
+    # runserver serves the static files from the apps
     urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
-    urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
 
     urlpatterns = [
         path('__debug__/', include('debug_toolbar.urls')),
     ] + urlpatterns
+else:
+    # collected files, when no web server in front serves STATIC_ROOT
+    urlpatterns += [re_path(rf'^{settings.STATIC_URL.lstrip("/")}(?P<path>.*)$', serve_static)]
 
 